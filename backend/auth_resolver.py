@@ -0,0 +1,214 @@
+"""
+Auth Resolver
+Resolves a request's credentials by token shape: JWTs are verified locally, opaque tokens as cached sessions
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from jose import JWTError, jwt
+
+from auth import ALGORITHM, SECRET_KEY, verify_jwt_token
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Seconds between pulls of tokens revoked by other workers
+AUTH_REVOCATION_SYNC_SECONDS = float(os.getenv("AUTH_REVOCATION_SYNC_SECONDS", "5"))
+# Revoked tokens kept in memory per worker; past this the ones expiring soonest are dropped
+AUTH_REVOKED_TOKENS_MAX = int(os.getenv("AUTH_REVOKED_TOKENS_MAX", "100000"))
+
+# OAuth sessions are issued for 7 days; a revoked one need not be remembered longer
+SESSION_LIFETIME = timedelta(days=7)
+
+
+def token_kind(token: str) -> str:
+    """'jwt' for tokens this service signs, 'session' for anything else (opaque session tokens)"""
+    if token.count(".") != 2:
+        return "session"
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        return "session"
+    return "jwt" if header.get("alg") == ALGORITHM else "session"
+
+
+def _aware(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class AuthResolver:
+    """
+    Authenticates requests for both the API and the payment routes.
+
+    Tokens are classified by shape before any lookup: JWTs are verified with
+    the signing key and cost no I/O, opaque tokens are looked up as OAuth
+    sessions through the user cache. Logged-out tokens go into a revocation
+    set checked on every request; it is persisted with a TTL so other workers
+    pick revocations up within ``AUTH_REVOCATION_SYNC_SECONDS``.
+    """
+
+    def __init__(self):
+        self.user_cache = None
+        self.revocations = None
+        self._revoked = {}
+        self._synced_at = None
+        self._syncer = None
+        self._resolved = {"jwt": 0, "session": 0}
+        self._rejected = 0
+        self._revoked_hits = 0
+
+    def bind(self, user_cache, revocations):
+        self.user_cache = user_cache
+        self.revocations = revocations
+
+    async def ensure_indexes(self):
+        await self.revocations.create_index("expires_at", expireAfterSeconds=0)
+        await self.revocations.create_index("revoked_at")
+
+    async def resolve(self, request: Request) -> dict:
+        """The authenticated user for a request, from the session cookie or the bearer token"""
+        # Cookie first, as the OAuth flow sets it
+        session_token = request.cookies.get("session_token")
+        if session_token:
+            user = await self._authenticate(session_token, request)
+            if user:
+                return user
+
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+        user = await self._authenticate(auth_header.split(" ")[1], request)
+        if user is None:
+            self._rejected += 1
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return user
+
+    async def _authenticate(self, token: str, request: Request) -> Optional[dict]:
+        if self.is_revoked(token):
+            self._revoked_hits += 1
+            return None
+
+        if token_kind(token) == "jwt":
+            try:
+                user = verify_jwt_token(token)
+            except HTTPException:
+                return None
+            self._resolved["jwt"] += 1
+            return user
+
+        session = await self.user_cache.get_session(token)
+        if not session:
+            return None
+        expires_at = session["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at < datetime.now(timezone.utc):
+            return None
+
+        user = await self.user_cache.for_request(request, session["user_id"])
+        if not user:
+            return None
+        self._resolved["session"] += 1
+        return {"user_id": user["_id"], "email": user["email"]}
+
+    def is_revoked(self, token: str) -> bool:
+        return token_digest(token) in self._revoked
+
+    async def revoke(self, token: str, session_expires_at: Optional[datetime] = None) -> bool:
+        """
+        Reject ``token`` from now on, here immediately and in other workers after their next sync.
+
+        Only tokens this service issued are recorded, so anonymous logouts
+        cannot grow the revocation set: a JWT must carry a valid signature and
+        is kept until its own ``exp``; an opaque token is recorded only with the
+        expiry of the session the caller has just deleted for it. Returns
+        whether the token was revoked.
+        """
+        now = datetime.now(timezone.utc)
+        if token_kind(token) == "jwt":
+            try:
+                claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except JWTError:
+                return False
+            expires_at = datetime.fromtimestamp(claims["exp"], timezone.utc) if "exp" in claims else now + SESSION_LIFETIME
+        else:
+            if session_expires_at is None:
+                return False
+            self.user_cache.forget_session(token)
+            expires_at = _aware(session_expires_at)
+        if expires_at <= now:
+            return False
+
+        digest = token_digest(token)
+        self._revoked[digest] = expires_at
+        self._prune(now)
+        await self.revocations.update_one(
+            {"_id": digest}, {"$set": {"expires_at": expires_at, "revoked_at": now}}, upsert=True
+        )
+        return True
+
+    def _prune(self, now: datetime):
+        """Forget expired revocations, then the soonest-expiring ones while over AUTH_REVOKED_TOKENS_MAX"""
+        for digest, expires_at in list(self._revoked.items()):
+            if expires_at < now:
+                del self._revoked[digest]
+
+        excess = len(self._revoked) - AUTH_REVOKED_TOKENS_MAX
+        if excess > 0:
+            logger.warning(f"Revocation set over {AUTH_REVOKED_TOKENS_MAX} tokens, dropping the {excess} expiring soonest")
+            for digest in sorted(self._revoked, key=self._revoked.get)[:excess]:
+                del self._revoked[digest]
+
+    def start(self):
+        self._syncer = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._syncer:
+            self._syncer.cancel()
+            await asyncio.gather(self._syncer, return_exceptions=True)
+            self._syncer = None
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Token revocation sync failed: {e}")
+            await asyncio.sleep(AUTH_REVOCATION_SYNC_SECONDS)
+
+    async def sync(self):
+        """Load revocations made since the last sync and forget expired ones"""
+        now = datetime.now(timezone.utc)
+        if self._synced_at is None:
+            query = {"expires_at": {"$gt": now}}
+        else:
+            # Overlap the previous window to allow for clock skew between workers
+            query = {"revoked_at": {"$gte": self._synced_at - timedelta(seconds=AUTH_REVOCATION_SYNC_SECONDS * 2)}}
+
+        async for revocation in self.revocations.find(query, {"expires_at": 1}):
+            self._revoked[revocation["_id"]] = _aware(revocation["expires_at"])
+        self._synced_at = now
+        self._prune(now)
+
+    def metrics(self) -> dict:
+        return {
+            "resolved": dict(self._resolved),
+            "rejected": self._rejected,
+            "revoked_tokens": len(self._revoked),
+            "revoked_hits": self._revoked_hits
+        }
+
+
+auth_resolver = AuthResolver()
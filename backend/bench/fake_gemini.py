@@ -0,0 +1,281 @@
+"""
+Local Gemini Stand-in
+Fake of the Generative Language REST endpoints used by the converter, for load testing without API quota
+
+Run it, then start the backend with GEMINI_API_ENDPOINT pointing at it:
+
+    python bench/fake_gemini.py --port 8090 --latency-ms 2000 --quota-error-rate 0.05
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8090 GEMINI_API_KEY=fake uvicorn server:app
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# File.State.ACTIVE and Candidate.FinishReason.STOP in the int enum encoding the REST transport asks for
+FILE_STATE_ACTIVE = 2
+FINISH_REASON_STOP = 1
+
+
+def sample_statement(transactions: int = 40) -> dict:
+    """A deterministic, internally consistent statement used when no canned outputs are given"""
+    rng = random.Random(42)
+    deposits, withdrawals, purchases, checks = [], [], [], []
+    balance = 5000.0
+    beginning = balance
+    for index in range(transactions):
+        day = f"05-{index % 28 + 1:02d}"
+        amount = round(rng.uniform(5, 900), 2)
+        kind = index % 4
+        if kind == 0:
+            deposits.append({"dateCredited": day, "description": f"DIRECT DEPOSIT PAYROLL {index}", "amount": amount})
+            balance += amount
+        elif kind == 1:
+            withdrawals.append({"tranDate": day, "datePosted": day, "description": f"ATM WITHDRAWAL #{index}", "amount": -amount})
+            balance -= amount
+        elif kind == 2:
+            purchases.append({"tranDate": day, "datePosted": day, "description": f"VISA PURCHASE STORE {index}", "amount": -amount})
+            balance -= amount
+        else:
+            checks.append({"datePaid": day, "checkNumber": str(1000 + index), "amount": amount, "referenceNumber": f"{9000000 + index}"})
+            balance -= amount
+    return {
+        "accountInfo": {
+            "accountNumber": "000009752",
+            "statementDate": "May 31, 2024",
+            "beginningBalance": beginning,
+            "endingBalance": round(balance, 2)
+        },
+        "deposits": deposits,
+        "atmWithdrawals": withdrawals,
+        "checksPaid": checks,
+        "visaPurchases": purchases
+    }
+
+
+class FakeBehaviour:
+    """Latency distributions, error injection and canned responses"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        if args.outputs:
+            paths = sorted(Path(args.outputs).glob("*.json"))
+            self.outputs = [path.read_text() for path in paths]
+        else:
+            self.outputs = [json.dumps(sample_statement(args.transactions))]
+        self.requests = 0
+        self.injected_errors = 0
+
+    def latency(self, median_ms: float) -> float:
+        """Log-normal latency in seconds, the usual shape of model response times"""
+        if median_ms <= 0:
+            return 0.0
+        seconds = median_ms / 1000 * self.rng.lognormvariate(0, self.args.latency_sigma)
+        return min(seconds, self.args.latency_cap_ms / 1000)
+
+    def injected_error(self):
+        """Return an error response to send instead of a result, or None"""
+        roll = self.rng.random()
+        if roll < self.args.quota_error_rate:
+            status, code, message = 429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."
+        elif roll < self.args.quota_error_rate + self.args.server_error_rate:
+            status, code, message = 503, "UNAVAILABLE", "The model is overloaded. Please try again later."
+        else:
+            return None
+        self.injected_errors += 1
+        return JSONResponse({"error": {"code": status, "message": message, "status": code}}, status_code=status)
+
+    def output(self) -> str:
+        self.requests += 1
+        return self.outputs[self.requests % len(self.outputs)]
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI(title="Fake Gemini")
+    behaviour = FakeBehaviour(args)
+    files = {}
+    sessions = {}
+
+    def base_url(request: Request) -> str:
+        return str(request.base_url).rstrip("/")
+
+    def file_resource(name: str) -> dict:
+        return files[name]
+
+    @app.get("/$discovery/rest")
+    async def discovery(request: Request):
+        # Just enough of the discovery document for googleapiclient to build media.upload
+        root = base_url(request) + "/"
+        return {
+            "kind": "discovery#restDescription",
+            "discoveryVersion": "v1",
+            "id": "generativelanguage:v1beta",
+            "name": "generativelanguage",
+            "version": "v1beta",
+            "rootUrl": root,
+            "servicePath": "",
+            "baseUrl": root,
+            "batchPath": "batch",
+            "parameters": {"key": {"type": "string", "location": "query"}},
+            "schemas": {
+                "File": {"id": "File", "type": "object", "properties": {
+                    "name": {"type": "string"}, "displayName": {"type": "string"}
+                }},
+                "CreateFileRequest": {"id": "CreateFileRequest", "type": "object", "properties": {
+                    "file": {"$ref": "File"}
+                }},
+                "CreateFileResponse": {"id": "CreateFileResponse", "type": "object", "properties": {
+                    "file": {"$ref": "File"}
+                }}
+            },
+            "resources": {"media": {"methods": {"upload": {
+                "id": "generativelanguage.media.upload",
+                "path": "v1beta/files",
+                "flatPath": "v1beta/files",
+                "httpMethod": "POST",
+                "parameters": {},
+                "parameterOrder": [],
+                "request": {"$ref": "CreateFileRequest"},
+                "response": {"$ref": "CreateFileResponse"},
+                "supportsMediaUpload": True,
+                "mediaUpload": {"accept": ["*/*"], "protocols": {
+                    "simple": {"multipart": True, "path": "/upload/v1beta/files"}
+                }}
+            }}}}
+        }
+
+    def store_file(request: Request, size: int, mime_type: str) -> dict:
+        file_id = uuid.uuid4().hex[:12]
+        now = datetime.now(timezone.utc)
+        name = f"files/{file_id}"
+        files[name] = {
+            "name": name,
+            "mimeType": mime_type,
+            "sizeBytes": str(size),
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "updateTime": now.isoformat().replace("+00:00", "Z"),
+            "expirationTime": (now + timedelta(hours=48)).isoformat().replace("+00:00", "Z"),
+            "uri": f"{base_url(request)}/v1beta/{name}",
+            "state": FILE_STATE_ACTIVE
+        }
+        return files[name]
+
+    @app.post("/upload/v1beta/files")
+    async def upload(request: Request):
+        # googleapiclient starts resumable uploads on the media path too
+        if request.query_params.get("uploadType") == "resumable":
+            session_id = uuid.uuid4().hex
+            sessions[session_id] = request.headers.get("x-upload-content-type", "application/pdf")
+            return Response(status_code=200, headers={"Location": f"{base_url(request)}/upload-sessions/{session_id}"})
+
+        body = await request.body()
+        await asyncio.sleep(behaviour.latency(args.upload_latency_ms))
+        return {"file": store_file(request, len(body), "application/pdf")}
+
+    @app.put("/upload-sessions/{session_id}")
+    async def finish_upload(session_id: str, request: Request):
+        body = await request.body()
+        await asyncio.sleep(behaviour.latency(args.upload_latency_ms))
+        mime_type = sessions.pop(session_id, "application/pdf")
+        return {"file": store_file(request, len(body), mime_type)}
+
+    @app.get("/v1beta/files/{file_id}")
+    async def get_file(file_id: str):
+        name = f"files/{file_id}"
+        if name not in files:
+            return JSONResponse({"error": {"code": 404, "message": "File not found", "status": "NOT_FOUND"}}, 404)
+        return file_resource(name)
+
+    @app.delete("/v1beta/files/{file_id}")
+    async def delete_file(file_id: str):
+        files.pop(f"files/{file_id}", None)
+        return {}
+
+    @app.get("/v1beta/files")
+    async def list_files():
+        return {"files": list(files.values())}
+
+    def candidate(text: str) -> dict:
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": FINISH_REASON_STOP,
+                "index": 0
+            }],
+            "usageMetadata": {"promptTokenCount": 1000, "candidatesTokenCount": len(text) // 4}
+        }
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate(model: str):
+        await asyncio.sleep(behaviour.latency(args.latency_ms))
+        error = behaviour.injected_error()
+        if error is not None:
+            return error
+        return candidate(behaviour.output())
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate(model: str):
+        # Time to first token, then the rest of the latency spread over the chunks
+        total = behaviour.latency(args.latency_ms)
+        await asyncio.sleep(total * 0.2)
+        error = behaviour.injected_error()
+        if error is not None:
+            return error
+
+        text = behaviour.output()
+        size = max(1, len(text) // max(1, args.stream_chunks))
+        pieces = [text[start:start + size] for start in range(0, len(text), size)]
+
+        async def chunks():
+            yield "["
+            for index, piece in enumerate(pieces):
+                if index:
+                    await asyncio.sleep(total * 0.8 / len(pieces))
+                    yield ",\n"
+                yield json.dumps(candidate(piece))
+            yield "]"
+
+        return StreamingResponse(chunks(), media_type="application/json")
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "generate_requests": behaviour.requests,
+            "injected_errors": behaviour.injected_errors,
+            "files": len(files),
+            "uptime_s": round(time.monotonic() - started, 1)
+        }
+
+    started = time.monotonic()
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=1500, help="median generate latency")
+    parser.add_argument("--upload-latency-ms", type=float, default=150, help="median upload latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of latencies")
+    parser.add_argument("--latency-cap-ms", type=float, default=60000, help="upper bound on any latency")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="fraction of generate calls answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction answered with 503")
+    parser.add_argument("--outputs", help="directory of canned *.json model outputs, served round-robin")
+    parser.add_argument("--transactions", type=int, default=40, help="rows in the built-in sample output")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="chunks per streamed response")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    uvicorn.run(create_app(arguments), host=arguments.host, port=arguments.port, log_level="warning")
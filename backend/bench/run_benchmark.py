@@ -0,0 +1,306 @@
+"""
+End-to-End Load Benchmark
+Drives the API (signup, login, PDF conversion, documents listing) at a fixed concurrency and records latency per endpoint
+
+Typical run, starting the Gemini stand-in and the API against a local Mongo:
+
+    python bench/run_benchmark.py --spawn --concurrency 16 --duration 60 --output bench-results.json
+
+Against an already running API (which must itself point at a Gemini stand-in or real key):
+
+    python bench/run_benchmark.py --base-url http://127.0.0.1:8001 --mongo-url mongodb://localhost:27017 --db-name test_database
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCH_PASSWORD = "bench-password-123"
+
+
+def make_sample_pdf(lines) -> bytes:
+    """Build a one-page PDF with the given text lines (no dependencies needed)"""
+    text = ["BT", "/F1 10 Tf", "14 TL", "50 760 Td"]
+    for line in lines:
+        escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        text.append(f"({escaped}) Tj T*")
+    text.append("ET")
+    stream = "\n".join(text).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+# Scanned-looking content with no reconcilable balances, so the text-layer
+# fast path declines and every conversion goes through the (fake) model
+SAMPLE_PDF = make_sample_pdf(["Benchmark statement", "Account summary attached as image"] * 10)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.statuses = {}
+        self.errors = 0
+
+    def record(self, elapsed_ms: float, status):
+        self.latencies_ms.append(elapsed_ms)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        ordered = sorted(self.latencies_ms)
+
+        def percentile(fraction):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 1)
+
+        return {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "rps": round(len(ordered) / wall_seconds, 2) if wall_seconds else 0.0,
+            "mean_ms": round(sum(ordered) / len(ordered), 1) if ordered else None,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(ordered[-1], 1) if ordered else None
+        }
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stats = {}
+        self.tokens = []
+
+    async def timed(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            response = await coro
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.stats.setdefault(name, EndpointStats()).record((time.perf_counter() - started) * 1000, status)
+        return response
+
+    async def setup_users(self, client: httpx.AsyncClient):
+        """Sign up the benchmark users, give them unlimited pages and log them in"""
+        emails = [f"bench-{self.run_id}-{index}@example.com" for index in range(self.args.users)]
+        for email in emails:
+            await self.timed("signup", client.post("/api/auth/signup", json={
+                "full_name": "Benchmark User", "email": email,
+                "password": BENCH_PASSWORD, "confirm_password": BENCH_PASSWORD
+            }))
+
+        mongo = AsyncIOMotorClient(self.args.mongo_url)
+        try:
+            await mongo[self.args.db_name].users.update_many(
+                {"email": {"$in": emails}},
+                {"$set": {"subscription_tier": "enterprise", "pages_remaining": 10 ** 9, "pages_limit": 10 ** 9}}
+            )
+        finally:
+            mongo.close()
+
+        for email in emails:
+            response = await self.timed("login", client.post("/api/auth/login", json={
+                "email": email, "password": BENCH_PASSWORD
+            }))
+            if response is None or response.status_code != 200:
+                raise RuntimeError(f"Login failed for {email}: {response.text if response else 'no response'}")
+            self.tokens.append(response.json()["access_token"])
+
+    def pdf_for_request(self) -> bytes:
+        if self.args.reuse_pdf:
+            return self.pdf
+        # A trailing comment changes the content hash without changing the document
+        return self.pdf + f"%bench-{uuid.uuid4().hex}\n".encode()
+
+    async def user_loop(self, client: httpx.AsyncClient, worker: int, stop_at: float):
+        headers = {"Authorization": f"Bearer {self.tokens[worker % len(self.tokens)]}"}
+        iterations = 0
+        while time.monotonic() < stop_at and (not self.args.iterations or iterations < self.args.iterations):
+            iterations += 1
+            files = {"file": ("statement.pdf", self.pdf_for_request(), "application/pdf")}
+            await self.timed("process_pdf", client.post("/api/process-pdf", files=files, headers=headers))
+            await self.timed("documents", client.get("/api/documents", headers=headers))
+            await self.timed("profile", client.get("/api/user/profile", headers=headers))
+
+    async def run(self) -> dict:
+        self.pdf = Path(self.args.pdf).read_bytes() if self.args.pdf else SAMPLE_PDF
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2, max_keepalive_connections=self.args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=self.args.base_url, timeout=self.args.timeout, limits=limits) as client:
+            await self.setup_users(client)
+
+            started_at = datetime.now(timezone.utc)
+            started = time.monotonic()
+            stop_at = started + self.args.duration
+            await asyncio.gather(*[
+                self.user_loop(client, worker, stop_at) for worker in range(self.args.concurrency)
+            ])
+            wall_seconds = time.monotonic() - started
+
+            server_metrics = None
+            response = await client.get(
+                "/api/metrics", headers={"Authorization": f"Bearer {self.args.metrics_token}"}
+            )
+            if response.status_code == 200:
+                server_metrics = response.json()
+
+            fake_stats = None
+            if self.args.spawn:
+                response = await client.get(f"http://127.0.0.1:{self.args.fake_port}/stats")
+                fake_stats = response.json()
+
+        load_endpoints = [name for name in self.stats if name not in ("signup", "login")]
+        total_requests = sum(len(self.stats[name].latencies_ms) for name in load_endpoints)
+        return {
+            "run_id": self.run_id,
+            "started_at": started_at.isoformat(),
+            "config": {
+                "base_url": self.args.base_url,
+                "users": self.args.users,
+                "concurrency": self.args.concurrency,
+                "duration_s": self.args.duration,
+                "iterations": self.args.iterations,
+                "reuse_pdf": self.args.reuse_pdf,
+                "pdf_bytes": len(self.pdf),
+                "fake_gemini": self.fake_config() if self.args.spawn else None
+            },
+            "wall_seconds": round(wall_seconds, 2),
+            "total": {
+                "requests": total_requests,
+                "rps": round(total_requests / wall_seconds, 2) if wall_seconds else 0.0,
+                "conversions_per_s": round(len(self.stats.get("process_pdf", EndpointStats()).latencies_ms) / wall_seconds, 2)
+            },
+            "endpoints": {name: stats.summary(wall_seconds) for name, stats in self.stats.items()},
+            "server_metrics": server_metrics,
+            "fake_gemini_stats": fake_stats
+        }
+
+    def fake_config(self) -> dict:
+        return {
+            "latency_ms": self.args.fake_latency_ms,
+            "latency_sigma": self.args.fake_latency_sigma,
+            "quota_error_rate": self.args.fake_quota_error_rate,
+            "server_error_rate": self.args.fake_server_error_rate
+        }
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def spawn_services(args) -> list:
+    """Start the Gemini stand-in and the API as child processes"""
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    fake = subprocess.Popen([
+        sys.executable, str(BACKEND_DIR / "bench" / "fake_gemini.py"),
+        "--port", str(args.fake_port),
+        "--latency-ms", str(args.fake_latency_ms),
+        "--latency-sigma", str(args.fake_latency_sigma),
+        "--quota-error-rate", str(args.fake_quota_error_rate),
+        "--server-error-rate", str(args.fake_server_error_rate)
+    ])
+    env = {
+        **os.environ,
+        "GEMINI_API_ENDPOINT": fake_url,
+        "GEMINI_API_KEY": "bench-fake-key",
+        "MONGO_URL": args.mongo_url,
+        "DB_NAME": args.db_name,
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "bench-secret"),
+        "METRICS_TOKEN": args.metrics_token
+    }
+    api_port = int(args.base_url.rsplit(":", 1)[1].split("/")[0])
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(api_port),
+         "--workers", str(args.api_workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    return [fake, api]
+
+
+async def main(args):
+    processes = spawn_services(args) if args.spawn else []
+    try:
+        if args.spawn:
+            await wait_until_up(f"http://127.0.0.1:{args.fake_port}/stats")
+            await wait_until_up(f"{args.base_url}/api/")
+        result = await Benchmark(args).run()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    Path(args.output).write_text(json.dumps(result, indent=2, default=str))
+    print(f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, summary in result["endpoints"].items():
+        print(f"{name:<14}{summary['requests']:>9}{summary['errors']:>8}{summary['rps']:>9}"
+              f"{summary['p50_ms'] or 0:>9}{summary['p95_ms'] or 0:>9}{summary['p99_ms'] or 0:>9}")
+    print(f"Results written to {args.output}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the converter API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="bench_converter", help="database the API uses; benchmark users are created in it")
+    parser.add_argument("--users", type=int, default=8, help="benchmark accounts to create")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run the load phase")
+    parser.add_argument("--iterations", type=int, default=0, help="stop each virtual user after N iterations (0 = no limit)")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+    parser.add_argument("--pdf", help="PDF to upload (defaults to a generated one-page statement)")
+    parser.add_argument("--reuse-pdf", action="store_true", help="upload identical bytes every time (exercises the result cache)")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--metrics-token", default=os.environ.get("METRICS_TOKEN", "bench-metrics"),
+                        help="METRICS_TOKEN of the API, for the /api/metrics snapshot")
+    parser.add_argument("--spawn", action="store_true", help="start the Gemini stand-in and the API locally")
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--fake-port", type=int, default=8090)
+    parser.add_argument("--fake-latency-ms", type=float, default=1500)
+    parser.add_argument("--fake-latency-sigma", type=float, default=0.5)
+    parser.add_argument("--fake-quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-server-error-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,284 @@
+"""
+Conversion Job Queue
+Mongo-backed queue that lets clients submit a PDF, disconnect and poll for the result
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Concurrent jobs processed by each API worker process
+CONVERSION_JOB_WORKERS = int(os.getenv("CONVERSION_JOB_WORKERS", "4"))
+# Seconds between queue polls when idle
+CONVERSION_JOB_POLL_INTERVAL = float(os.getenv("CONVERSION_JOB_POLL_INTERVAL", "2"))
+# A job whose worker has not finished within the lease is assumed dead and re-queued
+CONVERSION_JOB_LEASE_SECONDS = int(os.getenv("CONVERSION_JOB_LEASE_SECONDS", "900"))
+CONVERSION_JOB_MAX_ATTEMPTS = int(os.getenv("CONVERSION_JOB_MAX_ATTEMPTS", "2"))
+# Seconds between sweeps that fail jobs which ran out of attempts
+CONVERSION_JOB_ABANDONED_SWEEP_INTERVAL = float(os.getenv("CONVERSION_JOB_ABANDONED_SWEEP_INTERVAL", "60"))
+# How long finished jobs remain queryable
+CONVERSION_JOB_RETENTION_HOURS = float(os.getenv("CONVERSION_JOB_RETENTION_HOURS", "72"))
+
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class ConversionJobQueue:
+    """
+    Work queue stored in ``conversion_jobs`` with uploads kept in GridFS.
+
+    Jobs are claimed with a single ``find_one_and_update`` so any number of API
+    processes can share the queue. The claim carries a lease that the worker
+    renews while it runs; a job whose worker died is picked up again once the
+    lease lapses. Updates from a run only apply while it still holds the claim,
+    so a worker that lost its lease cannot overwrite the next run's outcome.
+
+    ``processor(job, pdf_path, report_progress)`` does the actual conversion
+    and returns the fields to store on the completed job. Those should point
+    at the stored result (e.g. a document id) rather than contain it, so jobs
+    stay small whatever the size of the statement.
+    """
+
+    def __init__(self, db, processor: Callable[..., Awaitable[dict]], workers: int):
+        self.collection = db.conversion_jobs
+        self._uploads = None
+        self.processor = processor
+        self.workers = workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+        self._sweeper = None
+        self._wakeup = asyncio.Event()
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+
+    @property
+    def uploads(self) -> AsyncIOMotorGridFSBucket:
+        # Built on first use: GridFS needs the live database, which exists only once the app has started
+        if self._uploads is None:
+            self._uploads = AsyncIOMotorGridFSBucket(self.collection.database, bucket_name="conversion_uploads")
+        return self._uploads
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        await self.collection.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def submit(self, user_id: str, filename: str, pdf_path: str, file_size: int, content_hash: str) -> dict:
+        """Copy the uploaded PDF into GridFS and enqueue a job for it"""
+        job_id = str(uuid.uuid4())
+        with open(pdf_path, "rb") as pdf_file:
+            upload_id = await self.uploads.upload_from_stream(
+                filename, pdf_file, metadata={"job_id": job_id, "user_id": user_id}
+            )
+
+        now = datetime.now(timezone.utc)
+        job = {
+            "_id": job_id,
+            "user_id": user_id,
+            "filename": filename,
+            "file_size": file_size,
+            "content_hash": content_hash,
+            "upload_id": upload_id,
+            "status": JOB_QUEUED,
+            "progress": {"stage": JOB_QUEUED, "percent": 0},
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.collection.insert_one(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": job_id, "user_id": user_id})
+
+    def start(self):
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop(index)))
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+        logger.info(f"Started {self.workers} conversion job workers ({self.worker_id})")
+
+    async def stop(self):
+        tasks = self._tasks + ([self._sweeper] if self._sweeper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._sweeper = None
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": JOB_QUEUED},
+                    {"status": JOB_PROCESSING, "lease_expires_at": {"$lt": now}}
+                ],
+                "attempts": {"$lt": CONVERSION_JOB_MAX_ATTEMPTS}
+            },
+            {
+                "$set": {
+                    "status": JOB_PROCESSING,
+                    "claimed_by": self.worker_id,
+                    "lease_expires_at": now + timedelta(seconds=CONVERSION_JOB_LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker_loop(self, index: int):
+        while True:
+            try:
+                job = await self._claim()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), CONVERSION_JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Conversion job worker {index} error: {e}")
+                await asyncio.sleep(CONVERSION_JOB_POLL_INTERVAL)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(CONVERSION_JOB_ABANDONED_SWEEP_INTERVAL)
+            try:
+                await self._fail_abandoned()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Abandoned conversion job sweep failed: {e}")
+
+    async def _fail_abandoned(self):
+        """Give up on jobs whose workers kept dying until they ran out of attempts, deleting their uploads"""
+        while True:
+            now = datetime.now(timezone.utc)
+            job = await self.collection.find_one_and_update(
+                {
+                    "status": JOB_PROCESSING,
+                    "lease_expires_at": {"$lt": now},
+                    "attempts": {"$gte": CONVERSION_JOB_MAX_ATTEMPTS}
+                },
+                {
+                    "$set": {
+                        "status": JOB_FAILED,
+                        "error": "Conversion did not complete, please try again",
+                        "completed_at": now,
+                        "updated_at": now,
+                        "expires_at": now + timedelta(hours=CONVERSION_JOB_RETENTION_HOURS)
+                    },
+                    "$unset": {"lease_expires_at": "", "claimed_by": ""}
+                },
+                projection={"upload_id": 1}
+            )
+            if job is None:
+                return
+            logger.warning(f"Conversion job {job['_id']} abandoned after {CONVERSION_JOB_MAX_ATTEMPTS} attempts")
+            await self._delete_upload(job)
+
+    def _claim_filter(self, job: dict) -> dict:
+        """Matches the job only while this run still holds it; every claim increments ``attempts``"""
+        return {"_id": job["_id"], "claimed_by": self.worker_id, "attempts": job["attempts"]}
+
+    def _lease(self) -> dict:
+        now = datetime.now(timezone.utc)
+        return {"lease_expires_at": now + timedelta(seconds=CONVERSION_JOB_LEASE_SECONDS), "updated_at": now}
+
+    async def _heartbeat(self, job: dict):
+        """Renew the lease while a long conversion runs, so it is not claimed and run a second time"""
+        while True:
+            await asyncio.sleep(CONVERSION_JOB_LEASE_SECONDS / 3)
+            try:
+                await self.collection.update_one(self._claim_filter(job), {"$set": self._lease()})
+            except Exception as e:
+                logger.warning(f"Failed to renew lease of conversion job {job['_id']}: {e}")
+
+    async def _run(self, job: dict):
+        job_id = job["_id"]
+        self._active += 1
+        tmp_file_path = None
+
+        async def report_progress(stage: str, percent: int, **fields):
+            await self.collection.update_one(
+                self._claim_filter(job),
+                {"$set": {"progress": {"stage": stage, "percent": percent}, **self._lease(), **fields}}
+            )
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                tmp_file_path = tmp_file.name
+                await self.uploads.download_to_stream(job["upload_id"], tmp_file)
+
+            outcome = await self.processor(job, tmp_file_path, report_progress)
+            await self._finish(job, JOB_COMPLETED, {**outcome, "progress": {"stage": "done", "percent": 100}})
+            self._completed += 1
+
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            logger.error(f"Conversion job {job_id} failed: {error}")
+            await self._finish(job, JOB_FAILED, {"error": error})
+            self._failed += 1
+
+        finally:
+            heartbeat.cancel()
+            self._active -= 1
+            if tmp_file_path and os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
+
+    async def _finish(self, job: dict, status: str, fields: dict):
+        now = datetime.now(timezone.utc)
+        finished = await self.collection.update_one(
+            self._claim_filter(job),
+            {
+                "$set": {
+                    "status": status,
+                    "completed_at": now,
+                    "updated_at": now,
+                    "expires_at": now + timedelta(hours=CONVERSION_JOB_RETENTION_HOURS),
+                    **fields
+                },
+                "$unset": {"lease_expires_at": "", "claimed_by": ""}
+            }
+        )
+        if finished.matched_count == 0:
+            # The lease lapsed and another run owns the job now; it still needs the upload
+            logger.warning(f"Conversion job {job['_id']} was reclaimed before this run finished, discarding its outcome")
+            return
+        await self._delete_upload(job)
+
+    async def _delete_upload(self, job: dict):
+        try:
+            await self.uploads.delete(job["upload_id"])
+        except Exception as e:
+            logger.warning(f"Failed to delete upload for job {job['_id']}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "active": self._active,
+            "completed": self._completed,
+            "failed": self._failed
+        }
@@ -0,0 +1,175 @@
+"""
+Database Provider
+One MongoDB client per process, opened in the app lifespan and shared by every router
+"""
+import os
+import logging
+import threading
+from typing import Optional
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Connection pool sizing, per MongoDB server the client talks to
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Idle connections are closed after this long (0 keeps them forever)
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# Timeouts: opening a connection, finding a usable server, waiting for a free pooled connection
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters, fed by pymongo's CMAP events (called from driver threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+
+class LazyCollection:
+    """
+    A collection handle usable before the client exists.
+
+    Module-level singletons are built at import time, but the client is only
+    opened in the lifespan; attribute access resolves against the live client.
+    """
+
+    def __init__(self, provider: "MongoProvider", name: str):
+        self._provider = provider
+        self._name = name
+        self._collection = None
+        self._client = None
+
+    def __getattr__(self, attribute):
+        client = self._provider.client
+        if self._collection is None or self._client is not client:
+            self._collection = self._provider.database[self._name]
+            self._client = client
+        return getattr(self._collection, attribute)
+
+
+class LazyDatabase:
+    """``db.<collection>`` / ``db[<collection>]`` returning LazyCollection handles"""
+
+    def __init__(self, provider: "MongoProvider"):
+        self._provider = provider
+
+    def __getattr__(self, name: str) -> LazyCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return LazyCollection(self._provider, name)
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(self._provider, name)
+
+
+class MongoProvider:
+    """Owns the process's MongoDB client: pool configuration, lifecycle and pool metrics"""
+
+    def __init__(self, url: str, database_name: str):
+        self.url = url
+        self.database_name = database_name
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.pool = PoolMetrics()
+        self.db = LazyDatabase(self)
+
+    @property
+    def database(self) -> AsyncIOMotorDatabase:
+        if self.client is None:
+            raise RuntimeError("MongoDB client is not connected; it is opened in the app lifespan")
+        return self.client[self.database_name]
+
+    async def connect(self):
+        self.client = AsyncIOMotorClient(
+            self.url,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS or None,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[self.pool]
+        )
+        await self.client.admin.command("ping")
+        logger.info(f"Connected to MongoDB (pool size {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def metrics(self) -> dict:
+        pool = self.pool
+        return {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "open_connections": pool.open,
+            "in_use": pool.in_use,
+            "max_in_use": pool.max_in_use,
+            "waiting": pool.waiting,
+            "utilisation": round(pool.in_use / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else 0.0,
+            "checkouts": pool.checkouts,
+            "checkout_failures": pool.checkout_failures,
+            "pool_clears": pool.pool_clears
+        }
+
+
+def get_database(request: Request) -> AsyncIOMotorDatabase:
+    """Dependency: the shared database, from the provider the lifespan put on app.state"""
+    return request.app.state.mongo.database
@@ -0,0 +1,122 @@
+"""
+Document History
+Keyset pagination over a user's documents, newest first, ordered by (conversion_date, _id), and the summaries shown with them
+"""
+import os
+import json
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+
+from pymongo import DESCENDING
+
+from exporters import statement_transactions
+
+# Documents per page when the client does not ask for a size, and the largest size it may ask for
+DOCUMENT_PAGE_SIZE = int(os.getenv("DOCUMENT_PAGE_SIZE", "100"))
+DOCUMENT_PAGE_MAX = int(os.getenv("DOCUMENT_PAGE_MAX", "500"))
+# Documents fetched per round trip when streaming a full-history export
+DOCUMENT_EXPORT_BATCH = int(os.getenv("DOCUMENT_EXPORT_BATCH", "500"))
+# Latest documents listed on the dashboard
+DASHBOARD_RECENT_DOCUMENTS = int(os.getenv("DASHBOARD_RECENT_DOCUMENTS", "5"))
+
+# Matches the documents.user_history_keyset index, so pages are read straight off the index
+HISTORY_SORT = [("conversion_date", DESCENDING), ("_id", DESCENDING)]
+
+# The fields DocumentResponse is built from; never the stored result
+HISTORY_PROJECTION = {
+    "original_filename": 1,
+    "file_size": 1,
+    "page_count": 1,
+    "pages_deducted": 1,
+    "conversion_date": 1,
+    "download_count": 1,
+    "status": 1,
+    "summary": 1
+}
+
+
+class InvalidCursor(ValueError):
+    """The continuation token was not issued by this API"""
+
+
+def encode_cursor(document: dict) -> str:
+    """Opaque continuation token pointing just past ``document``"""
+    position = {"d": document["conversion_date"].isoformat(), "i": document["_id"]}
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(position["d"]), str(position["i"])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def history_query(user_id: str, cursor: Optional[str] = None) -> dict:
+    """Filter for the user's documents after ``cursor`` in HISTORY_SORT order (all of them without one)"""
+    query = {"user_id": user_id}
+    if cursor:
+        conversion_date, document_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"conversion_date": {"$lt": conversion_date}},
+            {"conversion_date": conversion_date, "_id": {"$lt": document_id}}
+        ]
+    return query
+
+
+def _balance(value) -> Optional[float]:
+    """A balance as printed on the statement, or None when the extraction did not find one"""
+    if value in (None, ""):
+        return None
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def statement_summary(data: dict) -> dict:
+    """
+    Compact totals for a statement, stored on its document at conversion time.
+
+    Totals are positive amounts per transaction type. ``reconciliation_delta``
+    is what the extracted transactions leave unexplained between the opening
+    and closing balance (0 when the extraction is complete), and None when
+    either balance is missing, so the statement cannot be checked.
+    """
+    account = data.get("accountInfo") or {}
+    totals = {"Deposit": 0.0, "ATM Withdrawal": 0.0, "Check": 0.0, "Card Purchase": 0.0}
+    counts = dict.fromkeys(totals, 0)
+    for t in statement_transactions(data):
+        totals[t["type"]] += abs(t["amount"])
+        counts[t["type"]] += 1
+
+    beginning = _balance(account.get("beginningBalance"))
+    ending = _balance(account.get("endingBalance"))
+    delta = None
+    if beginning is not None and ending is not None:
+        debits = totals["ATM Withdrawal"] + totals["Check"] + totals["Card Purchase"]
+        delta = round(beginning + totals["Deposit"] - debits - ending, 2)
+    return {
+        "deposits_total": round(totals["Deposit"], 2),
+        "deposits_count": counts["Deposit"],
+        "withdrawals_total": round(totals["ATM Withdrawal"], 2),
+        "withdrawals_count": counts["ATM Withdrawal"],
+        "checks_total": round(totals["Check"], 2),
+        "checks_count": counts["Check"],
+        "card_total": round(totals["Card Purchase"], 2),
+        "card_count": counts["Card Purchase"],
+        "transaction_count": sum(counts.values()),
+        "beginning_balance": beginning,
+        "ending_balance": ending,
+        "reconciliation_delta": delta
+    }
+
+
+def clamp_page_size(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DOCUMENT_PAGE_SIZE
+    return min(limit, DOCUMENT_PAGE_MAX)
@@ -11,14 +11,15 @@ from fastapi.responses import JSONResponse
 from datetime import datetime
 import uuid
 from standardwebhooks.webhooks import Webhook
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from dodo_payments import get_dodo_client, get_product_id
 from models import PaymentSessionRequest, PaymentSessionResponse
-from auth import verify_jwt_token
+from auth_resolver import auth_resolver
+from database import get_database
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -36,56 +37,55 @@ PLAN_TO_TIER_MAPPING = {
     "enterprise": "enterprise"
 }
 
+# Monthly pages per tier (-1 means unlimited)
+PLAN_PAGE_LIMITS = {
+    "starter": 50,
+    "professional": 200,
+    "business": 500,
+    "enterprise": -1
+}
+
 def normalize_plan_name(plan: str) -> str:
     """Normalize Dodo plan name to consistent internal tier value."""
     return PLAN_TO_TIER_MAPPING.get(plan.lower(), plan.lower())
 
-# Helper function to get current user (duplicated from server.py to avoid circular import)
+# Shared with server.py: JWTs are verified locally, session tokens go through the user cache
 async def get_current_user(request: Request):
     """Get current user from JWT token or OAuth session token"""
-    # MongoDB client for session lookup
-    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-    db_name = os.getenv("DB_NAME", "test_database")
-    db = client[db_name]
-    
-    # First try to get session token from cookie
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        session = await db.user_sessions.find_one({"session_token": session_token})
-        if session and session.get("expires_at") > datetime.utcnow():
-            user = await db.users.find_one({"_id": session["user_id"]})
-            if user:
-                return {"user_id": user["_id"], "email": user["email"], "name": user.get("name", "")}
-    
-    # Fallback to Authorization header
-    auth_header = request.headers.get("Authorization")
-    if not auth_header:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.split(" ")[1]
-    
-    # Try as session token first
-    session = await db.user_sessions.find_one({"session_token": token})
-    if session and session.get("expires_at") > datetime.utcnow():
-        user = await db.users.find_one({"_id": session["user_id"]})
-        if user:
-            return {"user_id": user["_id"], "email": user["email"], "name": user.get("name", "")}
-    
-    # Try as JWT token
-    try:
-        return verify_jwt_token(token)
-    except:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return await auth_resolver.resolve(request)
+
+def forget_cached_user(user_id: str):
+    """Drop a user from the auth cache after changing their subscription, so the next request reloads it"""
+    if auth_resolver.user_cache is not None:
+        auth_resolver.user_cache.forget_user(user_id)
+
+async def activate_user_plan(db: AsyncIOMotorDatabase, user_id: str, plan: str) -> int:
+    """Put the user on an active plan with a full page balance and a new billing cycle; returns the page limit"""
+    plan = normalize_plan_name(plan)
+    pages_limit = PLAN_PAGE_LIMITS.get(plan, 50)
+    now = datetime.utcnow()
+    await db.users.update_one(
+        {"_id": user_id},
+        {
+            "$set": {
+                "subscription_status": "active",
+                "subscription_tier": plan,
+                "pages_limit": pages_limit,
+                "pages_remaining": pages_limit,
+                # A new balance replaces any pages held by open conversions
+                "quota_reservations": [],
+                # Monthly refills count 30-day cycles from activation
+                "billing_cycle_start": now,
+                "updated_at": now
+            }
+        }
+    )
+    forget_cached_user(user_id)
+    return pages_limit
 
 # Create router
 router = APIRouter(prefix="/api", tags=["dodo-payments"])
 
-# MongoDB connection
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "test_database")
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
-
 # Get frontend URL from environment variable
 # For production, this should be set to your actual domain (e.g., https://yourbankstatementconverter.com)
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -93,7 +93,8 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 @router.post("/dodo/create-subscription")
 async def create_dodo_subscription(
     request: PaymentSessionRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     Create a Dodo Payments subscription checkout session
@@ -168,7 +169,8 @@ async def create_dodo_subscription(
 
 
 @router.post("/dodo/create-portal-session")
-async def create_dodo_portal_session(current_user: dict = Depends(get_current_user)):
+async def create_dodo_portal_session(current_user: dict = Depends(get_current_user),
+                                     db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Create a Dodo Payments customer portal session
     """
@@ -204,7 +206,8 @@ async def create_dodo_portal_session(current_user: dict = Depends(get_current_us
 
 
 @router.post("/dodo/check-subscription/{subscription_id}")
-async def check_subscription_status(subscription_id: str, current_user: dict = Depends(get_current_user)):
+async def check_subscription_status(subscription_id: str, current_user: dict = Depends(get_current_user),
+                                    db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Check subscription status with Dodo Payments and update database
     This is used after payment redirect when webhook might not have fired
@@ -272,11 +275,6 @@ async def check_subscription_status(subscription_id: str, current_user: dict = D
         
         # If subscription is active, update database
         if subscription.status == "active":
-            # MongoDB setup
-            mongo_client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
-            db_name = os.getenv("DB_NAME", "test_database")
-            db = mongo_client[db_name]
-            
             # Get subscription from database
             db_subscription = await db.subscriptions.find_one({"subscription_id": subscription_id})
             
@@ -284,29 +282,8 @@ async def check_subscription_status(subscription_id: str, current_user: dict = D
                 user_id = db_subscription["user_id"]
                 plan = normalize_plan_name(db_subscription["plan"])
                 
-                # Determine pages based on plan
-                pages_limit_map = {
-                    "starter": 50,
-                    "professional": 200,
-                    "business": 500,
-                    "enterprise": -1  # -1 means unlimited
-                }
-                pages_limit = pages_limit_map.get(plan, 50)
-                pages_remaining = pages_limit if pages_limit != -1 else -1
-                
                 # Update user with subscription details
-                await db.users.update_one(
-                    {"_id": user_id},
-                    {
-                        "$set": {
-                            "subscription_status": "active",
-                            "subscription_tier": plan,
-                            "pages_limit": pages_limit,
-                            "pages_remaining": pages_remaining,
-                            "updated_at": datetime.utcnow()
-                        }
-                    }
-                )
+                pages_limit = await activate_user_plan(db, user_id, plan)
                 
                 # Update subscription status
                 await db.subscriptions.update_one(
@@ -327,7 +304,7 @@ async def check_subscription_status(subscription_id: str, current_user: dict = D
                     "subscription_status": "active",
                     "plan": plan,
                     "pages_limit": pages_limit,
-                    "pages_remaining": pages_remaining
+                    "pages_remaining": pages_limit
                 }
             else:
                 return {"status": "not_found", "message": "Subscription not found in database"}
@@ -343,7 +320,7 @@ async def check_subscription_status(subscription_id: str, current_user: dict = D
 
 
 @router.post("/webhook/dodo")
-async def dodo_webhook(request: Request):
+async def dodo_webhook(request: Request, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Handle Dodo Payments webhook events
     """
@@ -378,27 +355,27 @@ async def dodo_webhook(request: Request):
         
         # Handle subscription.active event
         if event_type == "subscription.active":
-            await handle_subscription_active(event_data)
+            await handle_subscription_active(db, event_data)
         
         # Handle subscription.renewed event
         elif event_type == "subscription.renewed":
-            await handle_subscription_renewed(event_data)
+            await handle_subscription_renewed(db, event_data)
         
         # Handle subscription.on_hold event
         elif event_type == "subscription.on_hold":
-            await handle_subscription_on_hold(event_data)
+            await handle_subscription_on_hold(db, event_data)
         
         # Handle subscription.cancelled event
         elif event_type == "subscription.cancelled":
-            await handle_subscription_cancelled(event_data)
+            await handle_subscription_cancelled(db, event_data)
         
         # Handle subscription.failed event
         elif event_type == "subscription.failed":
-            await handle_subscription_failed(event_data)
+            await handle_subscription_failed(db, event_data)
         
         # Handle payment.succeeded event
         elif event_type == "payment.succeeded":
-            await handle_payment_succeeded(event_data)
+            await handle_payment_succeeded(db, event_data)
         
         return {"status": "success"}
         
@@ -409,7 +386,7 @@ async def dodo_webhook(request: Request):
         raise HTTPException(status_code=500, detail=f"Webhook processing failed: {str(e)}")
 
 
-async def handle_subscription_active(data: dict):
+async def handle_subscription_active(db: AsyncIOMotorDatabase, data: dict):
     """Handle subscription.active event"""
     subscription_id = data.get("subscription_id")
     customer_id = data.get("customer_id")
@@ -433,19 +410,11 @@ async def handle_subscription_active(data: dict):
     # Update user's subscription status
     subscription = await db.subscriptions.find_one({"subscription_id": subscription_id})
     if subscription:
-        await db.users.update_one(
-            {"_id": subscription["user_id"]},
-            {
-                "$set": {
-                    "subscription_status": "active",
-                    "subscription_tier": subscription["plan"],
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
+        # Same plan setup as the status check, so refills are anchored to this activation
+        await activate_user_plan(db, subscription["user_id"], subscription["plan"])
 
 
-async def handle_subscription_renewed(data: dict):
+async def handle_subscription_renewed(db: AsyncIOMotorDatabase, data: dict):
     """Handle subscription.renewed event"""
     subscription_id = data.get("subscription_id")
     logger.info(f"Subscription renewed: {subscription_id}")
@@ -462,7 +431,7 @@ async def handle_subscription_renewed(data: dict):
     )
 
 
-async def handle_subscription_on_hold(data: dict):
+async def handle_subscription_on_hold(db: AsyncIOMotorDatabase, data: dict):
     """Handle subscription.on_hold event"""
     subscription_id = data.get("subscription_id")
     logger.warning(f"Subscription on hold: {subscription_id}")
@@ -484,9 +453,10 @@ async def handle_subscription_on_hold(data: dict):
             {"_id": subscription["user_id"]},
             {"$set": {"subscription_status": "on_hold"}}
         )
+        forget_cached_user(subscription["user_id"])
 
 
-async def handle_subscription_cancelled(data: dict):
+async def handle_subscription_cancelled(db: AsyncIOMotorDatabase, data: dict):
     """Handle subscription.cancelled event"""
     subscription_id = data.get("subscription_id")
     logger.info(f"Subscription cancelled: {subscription_id}")
@@ -509,9 +479,10 @@ async def handle_subscription_cancelled(data: dict):
             {"_id": subscription["user_id"]},
             {"$set": {"subscription_status": "cancelled"}}
         )
+        forget_cached_user(subscription["user_id"])
 
 
-async def handle_subscription_failed(data: dict):
+async def handle_subscription_failed(db: AsyncIOMotorDatabase, data: dict):
     """Handle subscription.failed event"""
     subscription_id = data.get("subscription_id")
     logger.error(f"Subscription failed: {subscription_id}")
@@ -527,7 +498,7 @@ async def handle_subscription_failed(data: dict):
     )
 
 
-async def handle_payment_succeeded(data: dict):
+async def handle_payment_succeeded(db: AsyncIOMotorDatabase, data: dict):
     """Handle payment.succeeded event"""
     payment_id = data.get("payment_id")
     subscription_id = data.get("subscription_id")
@@ -583,7 +554,7 @@ async def handle_payment_succeeded(data: dict):
 
 
 @router.post("/enterprise-contact")
-async def enterprise_contact(request: Request):
+async def enterprise_contact(request: Request, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Handle Enterprise tier contact form submissions
     """
@@ -0,0 +1,240 @@
+"""
+Statement Exporters
+Render BankStatementData as CSV, XLSX, OFX or QIF through generators that yield the file chunk by chunk
+"""
+import csv
+import hashlib
+import tempfile
+from io import StringIO
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+# Rows buffered per yielded CSV chunk
+CSV_ROWS_PER_CHUNK = 500
+# Bytes per chunk when streaming a finished XLSX file
+XLSX_CHUNK_BYTES = 64 * 1024
+
+STATEMENT_DATE_FORMATS = ("%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y", "%m/%d/%Y", "%m-%d-%Y", "%Y-%m-%d", "%m/%d/%y")
+
+
+def _money(amount) -> str:
+    amount = float(amount or 0)
+    return f"${amount:.2f}" if amount >= 0 else f"-${abs(amount):.2f}"
+
+
+def _amount(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_statement_date(raw) -> Optional[date]:
+    if not raw:
+        return None
+    for fmt in STATEMENT_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(raw).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_transaction_date(raw, statement_date: Optional[date]) -> Optional[date]:
+    """A transaction date; statements usually print MM-DD, so the year is taken from the statement date"""
+    parsed = parse_statement_date(raw)
+    if parsed or not raw:
+        return parsed
+    try:
+        # Parsed in a leap year so 02-29 is accepted; the statement's year is applied below
+        day = datetime.strptime("2000-" + str(raw).strip().replace("/", "-"), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    year = statement_date.year if statement_date else date.today().year
+    # A December transaction on a January statement belongs to the previous year
+    if statement_date and day.month > statement_date.month:
+        year -= 1
+    try:
+        return day.replace(year=year)
+    except ValueError:  # 29 February outside a leap year
+        return None
+
+
+def statement_transactions(data: dict) -> Iterator[dict]:
+    """Every transaction as one flat record with a signed amount (credits positive), in statement order"""
+    for t in data.get("deposits") or []:
+        yield {"date": t.get("dateCredited"), "type": "Deposit", "description": t.get("description") or "",
+               "amount": abs(_amount(t.get("amount"))), "check_number": None, "reference": None}
+    for t in data.get("atmWithdrawals") or []:
+        yield {"date": t.get("tranDate") or t.get("datePosted"), "type": "ATM Withdrawal",
+               "description": t.get("description") or "", "amount": -abs(_amount(t.get("amount"))),
+               "check_number": None, "reference": None}
+    for t in data.get("checksPaid") or []:
+        yield {"date": t.get("datePaid"), "type": "Check", "description": f"Check #{t.get('checkNumber')}",
+               "amount": -abs(_amount(t.get("amount"))), "check_number": t.get("checkNumber"),
+               "reference": t.get("referenceNumber")}
+    for t in data.get("visaPurchases") or []:
+        yield {"date": t.get("tranDate") or t.get("datePosted"), "type": "Card Purchase",
+               "description": t.get("description") or "", "amount": -abs(_amount(t.get("amount"))),
+               "check_number": None, "reference": None}
+
+
+def _csv_chunks(rows: Iterable[list]) -> Iterator[bytes]:
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % CSV_ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _csv_rows(data: dict) -> Iterator[list]:
+    account = data.get("accountInfo") or {}
+    yield ["BANK STATEMENT DATA EXTRACTION"]
+    yield []
+    yield ["ACCOUNT SUMMARY"]
+    yield ["Field", "Value"]
+    yield ["Account Number", account.get("accountNumber") or "Not found"]
+    yield ["Statement Date", account.get("statementDate") or "Not found"]
+    yield ["Beginning Balance", _money(account.get("beginningBalance"))]
+    yield ["Ending Balance", _money(account.get("endingBalance"))]
+    yield []
+
+    sections = [
+        ("deposits", "DEPOSITS & OTHER CREDITS", ["Description", "Date Credited", "Amount"],
+         lambda t: [t.get("description"), t.get("dateCredited"), _money(t.get("amount"))]),
+        ("atmWithdrawals", "ATM WITHDRAWALS & DEBITS", ["Description", "Transaction Date", "Date Posted", "Amount"],
+         lambda t: [t.get("description"), t.get("tranDate"), t.get("datePosted"), _money(abs(_amount(t.get("amount"))))]),
+        ("checksPaid", "CHECKS PAID", ["Date Paid", "Check Number", "Amount", "Reference Number"],
+         lambda t: [t.get("datePaid"), t.get("checkNumber"), _money(t.get("amount")), t.get("referenceNumber")]),
+        ("visaPurchases", "CARD PURCHASES", ["Description", "Transaction Date", "Date Posted", "Amount"],
+         lambda t: [t.get("description"), t.get("tranDate"), t.get("datePosted"), _money(abs(_amount(t.get("amount"))))]),
+    ]
+    for key, title, header, row in sections:
+        if data.get(key):
+            yield [title]
+            yield header
+            for t in data[key]:
+                yield row(t)
+            yield []
+
+    yield ["ALL TRANSACTIONS SUMMARY"]
+    yield ["Date", "Type", "Description", "Amount"]
+    for t in sorted(statement_transactions(data), key=lambda t: str(t.get("date") or "")):
+        yield [t["date"], t["type"], t["description"], _money(t["amount"])]
+
+
+def export_csv(data: dict) -> Iterator[bytes]:
+    """The comprehensive CSV the converter page offers: account summary, one section per type, then all transactions"""
+    return _csv_chunks(_csv_rows(data))
+
+
+def export_xlsx(data: dict) -> Iterator[bytes]:
+    """Workbook with an account summary sheet and a transactions sheet, built with openpyxl's write-only mode"""
+    from openpyxl import Workbook
+
+    account = data.get("accountInfo") or {}
+    statement_date = parse_statement_date(account.get("statementDate"))
+    workbook = Workbook(write_only=True)
+
+    summary = workbook.create_sheet("Account Summary")
+    summary.append(["Field", "Value"])
+    summary.append(["Account Number", account.get("accountNumber") or ""])
+    summary.append(["Statement Date", statement_date or account.get("statementDate") or ""])
+    summary.append(["Beginning Balance", _amount(account.get("beginningBalance"))])
+    summary.append(["Ending Balance", _amount(account.get("endingBalance"))])
+
+    transactions = workbook.create_sheet("Transactions")
+    transactions.append(["Date", "Type", "Description", "Amount", "Check Number", "Reference Number"])
+    for t in statement_transactions(data):
+        transactions.append([
+            parse_transaction_date(t["date"], statement_date) or t["date"] or "",
+            t["type"], t["description"], t["amount"], t["check_number"] or "", t["reference"] or ""
+        ])
+
+    # Write-only rows are flushed to temporary XML as they are appended; the zip is assembled on save
+    with tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024) as out:
+        workbook.save(out)
+        out.seek(0)
+        while True:
+            chunk = out.read(XLSX_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _fitid(index: int, t: dict) -> str:
+    """Stable transaction id, so re-importing the same statement does not duplicate transactions"""
+    key = f"{index}|{t['date']}|{t['amount']:.2f}|{t['description']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def export_ofx(data: dict) -> Iterator[bytes]:
+    """OFX 2.2 bank statement (checking account)"""
+    account = data.get("accountInfo") or {}
+    statement_date = parse_statement_date(account.get("statementDate")) or date.today()
+    records: List[dict] = list(statement_transactions(data))
+    dates = [parse_transaction_date(t["date"], statement_date) or statement_date for t in records]
+    start = min(dates, default=statement_date)
+
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+        '<?OFX OFXHEADER="200" VERSION="220" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+        "<OFX>\n"
+        "<SIGNONMSGSRSV1><SONRS><STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>"
+        f"<DTSERVER>{datetime.utcnow():%Y%m%d%H%M%S}</DTSERVER><LANGUAGE>ENG</LANGUAGE></SONRS></SIGNONMSGSRSV1>\n"
+        "<BANKMSGSRSV1><STMTTRNRS><TRNUID>0</TRNUID><STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>\n"
+        "<STMTRS><CURDEF>USD</CURDEF>\n"
+        f"<BANKACCTFROM><BANKID>000000000</BANKID><ACCTID>{escape(str(account.get('accountNumber') or 'UNKNOWN'))}</ACCTID>"
+        "<ACCTTYPE>CHECKING</ACCTTYPE></BANKACCTFROM>\n"
+        f"<BANKTRANLIST><DTSTART>{start:%Y%m%d}</DTSTART><DTEND>{statement_date:%Y%m%d}</DTEND>\n"
+    ).encode("utf-8")
+
+    trntypes = {"Deposit": "CREDIT", "ATM Withdrawal": "ATM", "Check": "CHECK", "Card Purchase": "POS"}
+    for index, (t, posted) in enumerate(zip(records, dates)):
+        check = f"<CHECKNUM>{escape(str(t['check_number']))}</CHECKNUM>" if t["check_number"] else ""
+        yield (
+            f"<STMTTRN><TRNTYPE>{trntypes[t['type']]}</TRNTYPE><DTPOSTED>{posted:%Y%m%d}</DTPOSTED>"
+            f"<TRNAMT>{t['amount']:.2f}</TRNAMT><FITID>{_fitid(index, t)}</FITID>{check}"
+            f"<NAME>{escape(t['description'][:32])}</NAME><MEMO>{escape(t['description'])}</MEMO></STMTTRN>\n"
+        ).encode("utf-8")
+
+    yield (
+        "</BANKTRANLIST>\n"
+        f"<LEDGERBAL><BALAMT>{_amount(account.get('endingBalance')):.2f}</BALAMT>"
+        f"<DTASOF>{statement_date:%Y%m%d}</DTASOF></LEDGERBAL>\n"
+        "</STMTRS></STMTTRNRS></BANKMSGSRSV1>\n</OFX>\n"
+    ).encode("utf-8")
+
+
+def export_qif(data: dict) -> Iterator[bytes]:
+    """QIF bank register"""
+    account = data.get("accountInfo") or {}
+    statement_date = parse_statement_date(account.get("statementDate"))
+    yield b"!Type:Bank\n"
+    for t in statement_transactions(data):
+        posted = parse_transaction_date(t["date"], statement_date)
+        lines = [f"D{posted:%m/%d/%Y}" if posted else f"D{t['date'] or ''}", f"T{t['amount']:.2f}"]
+        if t["check_number"]:
+            lines.append(f"N{t['check_number']}")
+        lines.append(f"P{t['description']}")
+        lines.append("^")
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# format -> how it is served and rendered
+EXPORT_FORMATS = {
+    "csv": {"media_type": "text/csv", "extension": "csv", "render": export_csv},
+    "xlsx": {
+        "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "extension": "xlsx",
+        "render": export_xlsx
+    },
+    "ofx": {"media_type": "application/x-ofx", "extension": "ofx", "render": export_ofx},
+    "qif": {"media_type": "application/qif", "extension": "qif", "render": export_qif},
+}
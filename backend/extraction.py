@@ -0,0 +1,757 @@
+"""
+AI Extraction Pipeline
+Runs the blocking Gemini SDK calls on a bounded worker pool so the event loop stays responsive
+"""
+import os
+import json
+import time
+import hashlib
+import random
+import asyncio
+import logging
+import functools
+import contextlib
+from collections import deque
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from pdf_tools import page_ranges, pdf_toolkit
+from stream_parser import IncrementalStatementParser
+from model_registry import ModelRegistry, is_quota_error
+from gemini_files import GeminiFileManager
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# Worker pool sizing - every in-flight Gemini call occupies one worker thread
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "8"))
+# Conversions allowed to wait for a free worker before new ones are rejected
+EXTRACTION_MAX_QUEUE = int(os.getenv("EXTRACTION_MAX_QUEUE", "32"))
+
+# Per-stage timeouts (seconds)
+EXTRACTION_UPLOAD_TIMEOUT = float(os.getenv("EXTRACTION_UPLOAD_TIMEOUT", "60"))
+EXTRACTION_GENERATE_TIMEOUT = float(os.getenv("EXTRACTION_GENERATE_TIMEOUT", "180"))
+
+# Adaptive cap on concurrent model calls: starts at the initial value, grows by
+# one per window of successes and is multiplied down on quota errors/timeouts
+GEMINI_CONCURRENCY_INITIAL = int(os.getenv("GEMINI_CONCURRENCY_INITIAL", str(EXTRACTION_MAX_WORKERS)))
+GEMINI_CONCURRENCY_MIN = int(os.getenv("GEMINI_CONCURRENCY_MIN", "1"))
+GEMINI_CONCURRENCY_DECREASE_FACTOR = float(os.getenv("GEMINI_CONCURRENCY_DECREASE_FACTOR", "0.7"))
+
+# Total time a model call may spend across retries, and the backoff between them
+EXTRACTION_RETRY_DEADLINE = float(os.getenv("EXTRACTION_RETRY_DEADLINE", "240"))
+EXTRACTION_RETRY_BASE_DELAY = float(os.getenv("EXTRACTION_RETRY_BASE_DELAY", "1"))
+EXTRACTION_RETRY_MAX_DELAY = float(os.getenv("EXTRACTION_RETRY_MAX_DELAY", "30"))
+
+# Page sharding for long statements: pages per shard (0 disables sharding),
+# the page count at which sharding kicks in, and concurrent shards per PDF
+EXTRACTION_SHARD_PAGES = int(os.getenv("EXTRACTION_SHARD_PAGES", "8"))
+EXTRACTION_SHARD_MIN_PAGES = int(os.getenv("EXTRACTION_SHARD_MIN_PAGES", "12"))
+EXTRACTION_SHARD_FANOUT = int(os.getenv("EXTRACTION_SHARD_FANOUT", "4"))
+
+# Transaction arrays of the BankStatementData schema
+TRANSACTION_SECTIONS = ("deposits", "atmWithdrawals", "checksPaid", "visaPurchases")
+
+EXTRACTION_PROMPT = """You are a specialized bank statement data extraction expert.
+Your task is to extract ALL transaction data from PDF bank statements with 100% accuracy.
+
+Extract and return data in this exact JSON structure:
+{
+  "accountInfo": {
+    "accountNumber": "string",
+    "statementDate": "string",
+    "beginningBalance": number,
+    "endingBalance": number
+  },
+  "deposits": [
+    {
+      "dateCredited": "MM-DD format",
+      "description": "full description",
+      "amount": number
+    }
+  ],
+  "atmWithdrawals": [
+    {
+      "tranDate": "MM-DD format",
+      "datePosted": "MM-DD format",
+      "description": "full description",
+      "amount": negative_number
+    }
+  ],
+  "checksPaid": [
+    {
+      "datePaid": "MM-DD format",
+      "checkNumber": "string",
+      "amount": number,
+      "referenceNumber": "string"
+    }
+  ],
+  "visaPurchases": [
+    {
+      "tranDate": "MM-DD format",
+      "datePosted": "MM-DD format",
+      "description": "full description",
+      "amount": negative_number
+    }
+  ]
+}
+
+CRITICAL REQUIREMENTS:
+- Extract ALL transactions with exact amounts, dates, and descriptions
+- Use exact date formats (MM-DD like "05-15")
+- Negative amounts for withdrawals/debits
+- Include complete descriptions and reference numbers
+- Return ONLY valid JSON, no additional text
+
+Extract ALL bank statement transaction data from this PDF with complete accuracy."""
+
+
+# Models to try, in order of preference
+GEMINI_MODELS = [
+    'gemini-2.5-flash',           # Newest, fastest
+    'gemini-2.5-flash-latest',    # Latest 2.5
+    'gemini-1.5-flash-latest',    # Fallback to 1.5
+    'gemini-1.5-flash',           # Stable 1.5
+    'gemini-1.5-pro'              # Last resort
+]
+
+# Changes whenever the prompt or preferred model changes, so cached results
+# produced by an older pipeline are never served
+EXTRACTION_VERSION = hashlib.sha256(
+    f"{EXTRACTION_PROMPT}\n{GEMINI_MODELS[0]}".encode("utf-8")
+).hexdigest()[:16]
+
+
+model_registry = ModelRegistry(GEMINI_MODELS)
+
+
+class ExtractionQueueFull(Exception):
+    """Raised when the extraction backlog is at capacity"""
+
+
+class ExtractionTimeout(Exception):
+    """Raised when an extraction stage exceeds its time budget"""
+
+
+class ExtractionRateLimited(ExtractionQueueFull):
+    """Raised when the model quota stays exhausted for the whole retry deadline"""
+
+
+class ExtractionExecutor:
+    """
+    Bounded thread pool for blocking extraction calls.
+
+    At most ``max_workers`` calls run at once and at most ``max_queue`` callers
+    wait for a slot; anything beyond that is rejected immediately instead of
+    piling up behind a slow model.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extraction")
+        self._slots = asyncio.Semaphore(max_workers)
+        self._waiting = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._rejected = 0
+        self._stages = {}
+
+    async def run(self, stage: str, fn, *args, timeout: float = None, **kwargs):
+        """Run ``fn`` on the worker pool, labelled as ``stage`` for metrics"""
+        if self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise ExtractionQueueFull("Too many conversions in progress, please retry shortly")
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        self._running += 1
+        started = time.monotonic()
+        try:
+            pool_future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._running -= 1
+            self._slots.release()
+            raise
+        # The slot is held until the worker thread actually finishes, even if the
+        # caller has given up on it, so the pool can never be oversubscribed.
+        pool_future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(pool_future), timeout)
+        except asyncio.TimeoutError:
+            self._timed_out += 1
+            self._record(stage, started, ok=False)
+            raise ExtractionTimeout(f"Extraction stage '{stage}' timed out after {timeout:.0f}s")
+        except Exception:
+            self._failed += 1
+            self._record(stage, started, ok=False)
+            raise
+
+        self._completed += 1
+        self._record(stage, started, ok=True)
+        return result
+
+    def _release(self):
+        self._running -= 1
+        self._slots.release()
+
+    def _record(self, stage: str, started: float, ok: bool):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stats = self._stages.setdefault(stage, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if not ok:
+            stats["errors"] += 1
+
+    def metrics(self) -> dict:
+        """Snapshot of pool utilisation and per-stage latency"""
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self._waiting,
+            "in_flight": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "timed_out": self._timed_out,
+            "rejected": self._rejected,
+            "stages": {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else 0.0,
+                    "max_ms": round(stats["max_ms"], 1),
+                }
+                for name, stats in self._stages.items()
+            },
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for model calls.
+
+    Each success raises the limit by ``1 / limit`` (about one slot per window
+    of successes); a quota error or timeout multiplies it by
+    ``decrease_factor``, at most once per window so a burst of failures from
+    calls already in flight does not collapse it. Callers beyond the limit wait
+    in FIFO order, and at most ``max_waiting`` of them before new ones are
+    rejected.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, max_waiting: int, decrease_factor: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.max_waiting = max_waiting
+        self.decrease_factor = decrease_factor
+        self._in_flight = 0
+        self._waiters = deque()
+        self._successes_since_decrease = 0
+        self._increases = 0
+        self._decreases = 0
+        self._rejected = 0
+        self._wait_timeouts = 0
+
+    async def acquire(self, timeout: float):
+        if self._in_flight < int(self.limit) and not self._waiters:
+            self._in_flight += 1
+            return
+        if len(self._waiters) >= self.max_waiting:
+            self._rejected += 1
+            raise ExtractionQueueFull("Too many conversions in progress, please retry shortly")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just as we gave up; hand it on
+                self.release(None)
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._wait_timeouts += 1
+                raise ExtractionTimeout("Timed out waiting for model capacity")
+            raise
+
+    def release(self, overloaded: bool = False):
+        """Free a slot; ``overloaded`` is True/False for a failed/successful call, None if neutral"""
+        self._in_flight -= 1
+        if overloaded:
+            if self._successes_since_decrease >= int(self.limit) or self._decreases == 0:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self._decreases += 1
+                self._successes_since_decrease = 0
+                logger.warning(f"Model concurrency limit reduced to {self.limit:.1f}")
+        elif overloaded is False:
+            self._successes_since_decrease += 1
+            if self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self._increases += 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, timeout: float):
+        """Hold a slot for one model call, adjusting the limit by its outcome"""
+        await self.acquire(timeout)
+        overloaded = None
+        try:
+            yield
+            overloaded = False
+        except Exception as e:
+            if is_quota_error(e) or isinstance(e, ExtractionTimeout):
+                overloaded = True
+            raise
+        finally:
+            self.release(overloaded)
+
+    def metrics(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "min": self.minimum,
+            "max": self.maximum,
+            "in_flight": self._in_flight,
+            "waiting": len(self._waiters),
+            "increases": self._increases,
+            "decreases": self._decreases,
+            "rejected": self._rejected,
+            "wait_timeouts": self._wait_timeouts
+        }
+
+
+extraction_executor = ExtractionExecutor(EXTRACTION_MAX_WORKERS, EXTRACTION_MAX_QUEUE)
+
+# Never above the worker count, since every model call occupies a worker thread
+gemini_limiter = AdaptiveLimiter(
+    GEMINI_CONCURRENCY_INITIAL, GEMINI_CONCURRENCY_MIN, EXTRACTION_MAX_WORKERS,
+    EXTRACTION_MAX_QUEUE, GEMINI_CONCURRENCY_DECREASE_FACTOR
+)
+
+# Uploaded-file reuse; handles are shared across processes once server.py binds a collection
+gemini_files = GeminiFileManager(extraction_executor.run, EXTRACTION_UPLOAD_TIMEOUT)
+
+
+def parse_extraction_response(response: str) -> dict:
+    """Strip markdown fences from a model response and parse the JSON payload"""
+    response_text = response.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:-3]
+    elif response_text.startswith("```"):
+        response_text = response_text[3:-3]
+
+    return json.loads(response_text.strip())
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Quota exhaustion, timeouts and transient server errors are worth retrying"""
+    if is_quota_error(error) or isinstance(error, ExtractionTimeout):
+        return True
+    try:
+        from google.api_core import exceptions as google_exceptions
+        return isinstance(error, (
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded
+        ))
+    except ImportError:
+        return False
+
+
+async def _backoff(attempt: int, deadline: float, last_error: Exception):
+    """
+    Sleep before retry ``attempt`` with full-jitter exponential backoff.
+
+    Raises the error to report instead when it is not retryable or the next
+    attempt could not start before ``deadline``.
+    """
+    if last_error is None:
+        # Nothing was attempted: either no model could be created at all, or
+        # every circuit is open and will close again after its cooldown
+        last_error = Exception("No available Gemini models found. Please check your API key and quota.")
+        if not any(state.client for state in model_registry.models):
+            raise last_error
+    elif not _is_retryable(last_error):
+        raise last_error
+
+    delay = random.uniform(0, min(EXTRACTION_RETRY_MAX_DELAY, EXTRACTION_RETRY_BASE_DELAY * 2 ** attempt))
+    if time.monotonic() + delay >= deadline:
+        if is_quota_error(last_error):
+            raise ExtractionRateLimited("The AI service is at capacity, please retry shortly") from last_error
+        raise last_error
+
+    logger.warning(f"Model call failed ({last_error}), retry {attempt + 1} in {delay:.1f}s")
+    await asyncio.sleep(delay)
+
+
+async def _generate(contents) -> str:
+    """
+    Run generate_content on the best healthy model, falling back down the ranking.
+
+    When every model fails with a retryable error the whole ranking is retried
+    with backoff until ``EXTRACTION_RETRY_DEADLINE`` runs out.
+    """
+    deadline = time.monotonic() + EXTRACTION_RETRY_DEADLINE
+    attempt = 0
+    last_error = None
+    while True:
+        for state in model_registry.candidates():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                async with gemini_limiter.slot(remaining):
+                    started = time.monotonic()
+                    try:
+                        result = await extraction_executor.run(
+                            "generate", state.client.generate_content, contents,
+                            timeout=min(EXTRACTION_GENERATE_TIMEOUT, deadline - time.monotonic())
+                        )
+                        response = result.text
+                    except ExtractionQueueFull:
+                        raise
+                    except Exception as e:
+                        model_registry.record_failure(state, e)
+                        raise
+            except ExtractionQueueFull:
+                raise
+            except Exception as e:
+                logger.warning(f"Model {state.name} failed: {e}")
+                last_error = e
+                continue
+
+            model_registry.record_success(state, (time.monotonic() - started) * 1000)
+            logger.info(f"AI Response received from {state.name} (length: {len(response)} chars)")
+            return response
+
+        await _backoff(attempt, deadline, last_error)
+        attempt += 1
+
+
+async def _extract_document(genai, pdf_path: str, prompt: str) -> dict:
+    """Send one PDF, run the extraction prompt against it and parse the result"""
+    # Inline bytes, a previously uploaded file, or a fresh upload
+    pdf_part = await gemini_files.part_for(genai, pdf_path)
+
+    # Generate content
+    logger.info("Generating AI response...")
+    response = await _generate([prompt, pdf_part])
+
+    # Parse JSON response
+    try:
+        extracted_data = parse_extraction_response(response)
+        logger.info("Successfully parsed JSON response")
+        return extracted_data
+
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parsing error: {e}")
+        logger.error(f"Raw response (first 500 chars): {response[:500]}")
+        raise Exception("AI returned invalid JSON format")
+
+
+def statement_shards(page_count: int, shard_pages: int) -> List[Tuple[int, int, int]]:
+    """
+    ``(start, end, overlap)`` page shards of a statement, 0-based and end-exclusive.
+
+    Every shard after the first also starts with the previous shard's last
+    page (``overlap`` pages), so a transaction continuing across that page
+    break is seen whole by the shard that owns the rest of it.
+    """
+    shards = []
+    for index, (start, end) in enumerate(page_ranges(page_count, shard_pages)):
+        overlap = 1 if index else 0
+        shards.append((start - overlap, end, overlap))
+    return shards
+
+
+def shard_prompt(start: int, end: int, page_count: int) -> str:
+    """Extraction prompt for a [start, end) page shard of a longer statement"""
+    return EXTRACTION_PROMPT + f"""
+
+SHARD CONTEXT:
+- This PDF contains only pages {start + 1}-{end} of a {page_count}-page statement
+- Extract only the transactions printed on these pages
+- Give every transaction a "page" field: the page of this PDF (1 for its first page) on which the transaction starts
+- Use null for any accountInfo field that does not appear on these pages"""
+
+
+def _row_page(row: dict) -> Optional[int]:
+    try:
+        return int(row.get("page"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ShardMerger:
+    """
+    Merge per-shard extraction results, fed in page order, into one statement.
+
+    Shards overlap by the pages in ``statement_shards``; rows a shard reports
+    as starting on its overlap pages belong to the previous shard and are
+    dropped, and nothing else is. Identical rows are never merged:
+    statements legitimately repeat transactions, also across page breaks.
+    The ``page`` tag is removed from the merged rows.
+    """
+
+    def __init__(self):
+        self.account_info = {}
+        self.sections = {section: [] for section in TRANSACTION_SECTIONS}
+
+    def add(self, shard: dict, overlap: int = 0) -> dict:
+        """Fold in the next shard and return the rows it contributed, per section"""
+        info = shard.get("accountInfo") or {}
+        for field, value in info.items():
+            if value in (None, ""):
+                continue
+            # The closing balance is printed at the end of the statement
+            if field == "endingBalance" or field not in self.account_info:
+                self.account_info[field] = value
+
+        added = {}
+        for section in TRANSACTION_SECTIONS:
+            added[section] = []
+            for row in shard.get(section) or []:
+                if not isinstance(row, dict):
+                    continue
+                page = _row_page(row)
+                # Rows without a usable page are kept: losing a transaction is worse than repeating one
+                if overlap and page is not None and page <= overlap:
+                    continue
+                added[section].append({field: value for field, value in row.items() if field != "page"})
+            self.sections[section].extend(added[section])
+        return added
+
+    def result(self) -> dict:
+        return {"accountInfo": self.account_info, **self.sections}
+
+
+def merge_shard_results(shards: list, overlaps: Optional[list] = None) -> dict:
+    """Merge per-shard extraction results (in page order) into one statement"""
+    merger = ShardMerger()
+    for shard, overlap in zip(shards, overlaps or [0] * len(shards)):
+        merger.add(shard, overlap)
+    return merger.result()
+
+
+async def _extract_sharded(genai, pdf_path: str, page_count: int) -> dict:
+    """Split a long statement into page shards and extract them concurrently"""
+    shards = statement_shards(page_count, EXTRACTION_SHARD_PAGES)
+    ranges = [(start, end) for start, end, _ in shards]
+    logger.info(f"Extracting {page_count}-page PDF as {len(ranges)} shards of up to {EXTRACTION_SHARD_PAGES} pages")
+
+    fanout = asyncio.Semaphore(EXTRACTION_SHARD_FANOUT)
+
+    async def extract_shard(shard_path: str, start: int, end: int) -> dict:
+        async with fanout:
+            return await _extract_document(genai, shard_path, shard_prompt(start, end, page_count))
+
+    with tempfile.TemporaryDirectory(prefix="shards-") as shard_dir:
+        shard_paths = await pdf_toolkit.split(pdf_path, ranges, shard_dir)
+        results = await asyncio.gather(*[
+            extract_shard(shard_path, start, end)
+            for shard_path, (start, end) in zip(shard_paths, ranges)
+        ])
+
+    return merge_shard_results(results, [overlap for _, _, overlap in shards])
+
+
+async def extract_with_ai(pdf_path: str, page_count: int = 1):
+    """Use Google Generative AI to extract bank statement data from PDF"""
+
+    try:
+        import google.generativeai as genai
+
+        logger.info("Using google-generativeai for PDF extraction")
+
+        # Configures the Gemini API on first use; normally done at startup
+        model_registry.initialize(GEMINI_API_KEY)
+
+        if EXTRACTION_SHARD_PAGES > 0 and page_count >= EXTRACTION_SHARD_MIN_PAGES:
+            return await _extract_sharded(genai, pdf_path, page_count)
+
+        return await _extract_document(genai, pdf_path, EXTRACTION_PROMPT)
+
+    except (ExtractionQueueFull, ExtractionTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"AI extraction error: {str(e)}")
+        raise Exception(f"AI extraction failed: {str(e)}")
+
+
+async def _stream_document(genai, pdf_path: str, prompt: str):
+    """Yield parser events for one PDF as the model streams its response"""
+    pdf_part = await gemini_files.part_for(genai, pdf_path)
+
+    loop = asyncio.get_running_loop()
+    parser = IncrementalStatementParser(TRANSACTION_SECTIONS)
+    response_parts = []
+    deadline = time.monotonic() + EXTRACTION_RETRY_DEADLINE
+    attempt = 0
+    finished = False
+    last_error = None
+
+    while not finished:
+        for state in model_registry.candidates():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            chunks = asyncio.Queue()
+            done = object()
+            generation = None
+
+            def generate(model=state.client):
+                response = model.generate_content([prompt, pdf_part], stream=True)
+                for chunk in response:
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+
+            try:
+                async with gemini_limiter.slot(remaining):
+                    started = time.monotonic()
+                    generation = asyncio.ensure_future(extraction_executor.run(
+                        "generate_stream", generate,
+                        timeout=min(EXTRACTION_GENERATE_TIMEOUT, deadline - time.monotonic())
+                    ))
+                    generation.add_done_callback(lambda _, queue=chunks, marker=done: queue.put_nowait(marker))
+                    try:
+                        while True:
+                            text = await chunks.get()
+                            if text is done:
+                                break
+                            response_parts.append(text)
+                            for event in parser.feed(text):
+                                yield event
+                        await generation
+                    except ExtractionQueueFull:
+                        raise
+                    except Exception as e:
+                        model_registry.record_failure(state, e)
+                        raise
+            except ExtractionQueueFull:
+                raise
+            except Exception as e:
+                logger.warning(f"Model {state.name} failed while streaming: {e}")
+                # Rows already sent to the client cannot be taken back, so only a
+                # model that failed before producing output can be swapped out
+                if response_parts:
+                    raise
+                last_error = e
+                continue
+            finally:
+                if generation is not None and not generation.done():
+                    generation.cancel()
+
+            model_registry.record_success(state, (time.monotonic() - started) * 1000)
+            finished = True
+            break
+
+        if not finished:
+            await _backoff(attempt, deadline, last_error)
+            attempt += 1
+
+    # The complete response is authoritative; the incrementally parsed rows are
+    # only a fallback for output that is truncated or otherwise not valid JSON
+    response = "".join(response_parts)
+    try:
+        data = parse_extraction_response(response)
+    except json.JSONDecodeError:
+        logger.warning(f"Streamed response was not valid JSON ({len(response)} chars), keeping parsed rows")
+        data = parser.data
+    yield ("complete", None, data)
+
+
+async def _stream_sharded(genai, pdf_path: str, page_count: int):
+    """Extract shards concurrently, yielding each shard's rows once all earlier shards are in"""
+    shards = statement_shards(page_count, EXTRACTION_SHARD_PAGES)
+    ranges = [(start, end) for start, end, _ in shards]
+    fanout = asyncio.Semaphore(EXTRACTION_SHARD_FANOUT)
+
+    async def extract_shard(shard_path: str, start: int, end: int) -> dict:
+        async with fanout:
+            return await _extract_document(genai, shard_path, shard_prompt(start, end, page_count))
+
+    with tempfile.TemporaryDirectory(prefix="shards-") as shard_dir:
+        shard_paths = await pdf_toolkit.split(pdf_path, ranges, shard_dir)
+        tasks = [
+            asyncio.ensure_future(extract_shard(shard_path, start, end))
+            for shard_path, (start, end) in zip(shard_paths, ranges)
+        ]
+        try:
+            merger = ShardMerger()
+            for index, (task, (_, _, overlap)) in enumerate(zip(tasks, shards)):
+                added = merger.add(await task, overlap)
+                if index == 0:
+                    yield ("accountInfo", None, dict(merger.account_info))
+                for section in TRANSACTION_SECTIONS:
+                    for row in added[section]:
+                        yield ("transaction", section, row)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield ("complete", None, merger.result())
+
+
+async def replay_extraction(data: dict):
+    """Emit the streaming events for an already extracted statement (e.g. a cache hit)"""
+    yield ("accountInfo", None, data.get("accountInfo") or {})
+    for section in TRANSACTION_SECTIONS:
+        for row in data.get(section) or []:
+            yield ("transaction", section, row)
+    yield ("complete", None, data)
+
+
+async def stream_extraction(pdf_path: str, page_count: int = 1):
+    """
+    Extract a statement incrementally.
+
+    Yields ``("accountInfo", None, info)`` and ``("transaction", section, row)``
+    events as data becomes available, then ``("complete", None, data)`` with the
+    full statement.
+    """
+    try:
+        import google.generativeai as genai
+
+        model_registry.initialize(GEMINI_API_KEY)
+
+        if EXTRACTION_SHARD_PAGES > 0 and page_count >= EXTRACTION_SHARD_MIN_PAGES:
+            events = _stream_sharded(genai, pdf_path, page_count)
+        else:
+            events = _stream_document(genai, pdf_path, EXTRACTION_PROMPT)
+
+        async for event in events:
+            yield event
+
+    except (ExtractionQueueFull, ExtractionTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"AI streaming extraction error: {str(e)}")
+        raise Exception(f"AI extraction failed: {str(e)}")
@@ -0,0 +1,152 @@
+"""
+Extraction Result Cache
+Content-addressed cache of AI extraction results, keyed by the SHA-256 of the uploaded PDF
+"""
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ASCENDING
+
+from extraction import EXTRACTION_VERSION
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# In-process tier: number of results kept per worker
+EXTRACTION_CACHE_MEMORY_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", "256"))
+# Persistent tier: how long a result stays valid, and total stored payload size
+EXTRACTION_CACHE_TTL_HOURS = float(os.getenv("EXTRACTION_CACHE_TTL_HOURS", "168"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Minimum seconds between size-eviction passes over the persistent tier
+EXTRACTION_CACHE_EVICT_INTERVAL = float(os.getenv("EXTRACTION_CACHE_EVICT_INTERVAL", "60"))
+
+
+def extraction_cache_key(content_hash: str) -> str:
+    """Cache key for a PDF's SHA-256 under the current prompt/model version"""
+    return f"{content_hash}:{EXTRACTION_VERSION}"
+
+
+class ExtractionCache:
+    """
+    Two-tier cache: an in-process LRU in front of a Mongo collection.
+
+    Payloads are stored as JSON text so every hit hands the caller a fresh copy
+    and arbitrary model output never has to satisfy Mongo's key rules. Memory
+    entries carry the persistent entry's expiry, so neither tier serves a
+    result past the TTL.
+    """
+
+    def __init__(self, collection, memory_entries: int, ttl_hours: float, max_bytes: int):
+        self.collection = collection
+        self.memory_entries = memory_entries
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._last_eviction = 0.0
+        self._memory_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index([("last_accessed", ASCENDING)])
+
+    async def get(self, key: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        cached = self._memory.get(key)
+        if cached is not None:
+            expires_at, payload = cached
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return json.loads(payload)
+            del self._memory[key]
+
+        entry = await self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_accessed": now}, "$inc": {"hits": 1}},
+            projection={"payload": 1, "expires_at": 1}
+        )
+        if not entry:
+            self._misses += 1
+            return None
+
+        self._persistent_hits += 1
+        expires_at = entry["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        self._remember(key, entry["payload"], expires_at)
+        return json.loads(entry["payload"])
+
+    async def put(self, key: str, data: dict):
+        payload = json.dumps(data, separators=(",", ":"))
+        now = datetime.now(timezone.utc)
+        self._remember(key, payload, now + self.ttl)
+
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "payload": payload,
+                    "size_bytes": len(payload),
+                    "hits": 0,
+                    "created_at": now,
+                    "last_accessed": now,
+                    "expires_at": now + self.ttl
+                },
+                upsert=True
+            )
+            await self._evict_if_due()
+        except Exception as e:
+            # A cache write failure must never fail the conversion itself
+            logger.warning(f"Failed to persist extraction cache entry: {e}")
+
+    def _remember(self, key: str, payload: str, expires_at: datetime):
+        self._memory[key] = (expires_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _evict_if_due(self):
+        """Trim least-recently-used entries once the stored payload exceeds max_bytes"""
+        if time.monotonic() - self._last_eviction < EXTRACTION_CACHE_EVICT_INTERVAL:
+            return
+        self._last_eviction = time.monotonic()
+
+        totals = await self.collection.aggregate([
+            {"$group": {"_id": None, "bytes": {"$sum": "$size_bytes"}}}
+        ]).to_list(length=1)
+        total_bytes = totals[0]["bytes"] if totals else 0
+        if total_bytes <= self.max_bytes:
+            return
+
+        excess = total_bytes - self.max_bytes
+        victims = []
+        async for entry in self.collection.find(
+            {}, projection={"size_bytes": 1}
+        ).sort("last_accessed", ASCENDING):
+            victims.append(entry["_id"])
+            excess -= entry.get("size_bytes", 0)
+            if excess <= 0:
+                break
+
+        if victims:
+            await self.collection.delete_many({"_id": {"$in": victims}})
+            self._evicted += len(victims)
+            logger.info(f"Evicted {len(victims)} extraction cache entries to stay under {self.max_bytes} bytes")
+
+    def metrics(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self._memory_hits,
+            "persistent_hits": self._persistent_hits,
+            "misses": self._misses,
+            "evicted": self._evicted
+        }
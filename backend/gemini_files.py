@@ -0,0 +1,218 @@
+"""
+Gemini File Manager
+Reuses uploaded Gemini files by content hash, sends small PDFs inline and deletes stale uploads
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# PDFs up to this size are sent inline with the request instead of being uploaded
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Uploaded files not used for this long are deleted by the sweeper
+GEMINI_FILE_IDLE_MINUTES = float(os.getenv("GEMINI_FILE_IDLE_MINUTES", "60"))
+# Seconds between sweeps
+GEMINI_FILE_SWEEP_INTERVAL = float(os.getenv("GEMINI_FILE_SWEEP_INTERVAL", "600"))
+
+# Gemini keeps uploads for 48 hours; handles this close to expiry are not reused
+EXPIRY_MARGIN = timedelta(hours=1)
+DEFAULT_FILE_LIFETIME = timedelta(hours=48)
+PDF_MIME_TYPE = "application/pdf"
+# Display name prefix marking uploads made by this API; the orphan sweep leaves other files alone
+DISPLAY_NAME_PREFIX = "statement-converter-"
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class GeminiFileManager:
+    """
+    Maps PDF content hashes to files already uploaded to the Gemini File API.
+
+    Handles live in the ``gemini_files`` collection so every API process can
+    reuse an upload; until a collection is bound they are kept in memory. A
+    handle is claimed and its ``last_used_at`` refreshed in one update, and the
+    sweeper only deletes handles idle past the cutoff, so a file is never
+    deleted out from under a request that just picked it up.
+
+    ``runner`` runs blocking SDK calls, e.g. ``ExtractionExecutor.run``.
+    """
+
+    def __init__(self, runner, upload_timeout: float, inline_max_bytes: int = GEMINI_INLINE_MAX_BYTES):
+        self.runner = runner
+        self.upload_timeout = upload_timeout
+        self.inline_max_bytes = inline_max_bytes
+        self.collection = None
+        self._memory = {}
+        self._sweeper = None
+        self._inline = 0
+        self._uploads = 0
+        self._reused = 0
+        self._deleted = 0
+
+    def bind(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        if self.collection is None:
+            return
+        await self.collection.create_index([("last_used_at", ASCENDING)])
+        # Gemini has already deleted the file by then, so the handle can simply go
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def part_for(self, genai, pdf_path: str):
+        """Content part referencing ``pdf_path``: inline bytes, a reused upload or a fresh one"""
+        size = os.path.getsize(pdf_path)
+        if size <= self.inline_max_bytes:
+            data = await asyncio.to_thread(_read_bytes, pdf_path)
+            self._inline += 1
+            return {"inline_data": {"mime_type": PDF_MIME_TYPE, "data": data}}
+
+        content_hash = await asyncio.to_thread(_file_sha256, pdf_path)
+        handle = await self._claim(content_hash)
+        if handle:
+            self._reused += 1
+            logger.info(f"Reusing uploaded file {handle['name']} for {content_hash[:12]}")
+            return {"file_data": {"mime_type": PDF_MIME_TYPE, "file_uri": handle["uri"]}}
+
+        logger.info(f"Uploading PDF file: {pdf_path}")
+        uploaded_file = await self.runner(
+            "upload", genai.upload_file, pdf_path, mime_type=PDF_MIME_TYPE,
+            display_name=f"{DISPLAY_NAME_PREFIX}{content_hash[:16]}", timeout=self.upload_timeout
+        )
+        self._uploads += 1
+        logger.info(f"File uploaded successfully: {uploaded_file.name}")
+        await self._remember(content_hash, uploaded_file, size)
+        return uploaded_file
+
+    async def _claim(self, content_hash: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        if self.collection is None:
+            handle = self._memory.get(content_hash)
+            if handle and handle["expires_at"] > now + EXPIRY_MARGIN:
+                handle["last_used_at"] = now
+                return handle
+            return None
+
+        return await self.collection.find_one_and_update(
+            {"_id": content_hash, "expires_at": {"$gt": now + EXPIRY_MARGIN}},
+            {"$set": {"last_used_at": now}}
+        )
+
+    async def _remember(self, content_hash: str, uploaded_file, size: int):
+        now = datetime.now(timezone.utc)
+        handle = {
+            "_id": content_hash,
+            "name": uploaded_file.name,
+            "uri": uploaded_file.uri,
+            "size_bytes": size,
+            "created_at": now,
+            "last_used_at": now,
+            "expires_at": _utc(getattr(uploaded_file, "expiration_time", None)) or now + DEFAULT_FILE_LIFETIME
+        }
+        if self.collection is None:
+            self._memory[content_hash] = handle
+            return
+
+        # Another process may have uploaded the same PDF meanwhile and be using
+        # it right now; the first live handle wins and ours is left untracked,
+        # to be removed by the orphan sweep once it is idle
+        try:
+            await self.collection.replace_one(
+                {"_id": content_hash, "expires_at": {"$lte": now + EXPIRY_MARGIN}}, handle, upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(GEMINI_FILE_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Gemini file sweep failed: {e}")
+
+    async def sweep(self):
+        """Delete uploads idle past the cutoff, then any untracked remote files this API uploaded"""
+        cutoff = datetime.now(timezone.utc) - timedelta(minutes=GEMINI_FILE_IDLE_MINUTES)
+
+        if self.collection is None:
+            for content_hash, handle in list(self._memory.items()):
+                if handle["last_used_at"] < cutoff:
+                    del self._memory[content_hash]
+                    await self._delete_remote(handle["name"])
+            # Without shared handles other processes' uploads look untracked
+            return
+
+        while True:
+            handle = await self.collection.find_one_and_delete({"last_used_at": {"$lt": cutoff}})
+            if handle is None:
+                break
+            await self._delete_remote(handle["name"])
+        tracked = {handle["name"] async for handle in self.collection.find({}, {"name": 1})}
+
+        import google.generativeai as genai
+
+        remote_files = await self.runner("sweep", lambda: list(genai.list_files()), timeout=self.upload_timeout)
+        for remote in remote_files:
+            if not (getattr(remote, "display_name", None) or "").startswith(DISPLAY_NAME_PREFIX):
+                # Not ours: another application may share the API key
+                continue
+            created = _utc(getattr(remote, "create_time", None))
+            # Uploads whose handle was lost are never reused; the age check spares ones still being recorded
+            if remote.name not in tracked and created and created < cutoff:
+                await self._delete_remote(remote.name)
+
+    async def _delete_remote(self, name: str):
+        import google.generativeai as genai
+
+        try:
+            await self.runner("delete", genai.delete_file, name, timeout=self.upload_timeout)
+            self._deleted += 1
+            logger.info(f"Deleted Gemini file {name}")
+        except Exception as e:
+            logger.warning(f"Failed to delete Gemini file {name}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "inline": self._inline,
+            "uploads": self._uploads,
+            "reused": self._reused,
+            "deleted": self._deleted,
+            "tracked_in_memory": len(self._memory)
+        }
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
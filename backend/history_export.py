@@ -0,0 +1,234 @@
+"""
+Transaction History Export
+A user's transactions across all stored conversions as Parquet or Arrow, streamed row group by row group
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from pymongo import ASCENDING
+
+from document_history import encode_cursor, decode_cursor, DOCUMENT_EXPORT_BATCH
+from exporters import parse_statement_date, parse_transaction_date, statement_transactions
+from result_store import ResultNotStored
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Rows per Parquet row group / Arrow record batch; also the unit the response is streamed in
+EXPORT_ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "50000"))
+
+EXPORT_MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+# Oldest first, so a watermark marks everything exported so far
+EXPORT_SORT = [("conversion_date", ASCENDING), ("_id", ASCENDING)]
+EXPORT_PROJECTION = {"original_filename": 1, "conversion_date": 1, "result_file_id": 1}
+
+# Low-cardinality string columns, dictionary-encoded in both Parquet and Arrow output
+DICTIONARY_COLUMNS = ["category", "description", "account_number", "document_id", "source_filename"]
+
+
+def columnar_export_available() -> bool:
+    """pyarrow is optional; only this export needs it"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_schema():
+    """Export columns; DICTIONARY_COLUMNS are dictionary-typed so Arrow output is encoded like Parquet's"""
+    import pyarrow as pa
+
+    def text(name: str):
+        return pa.dictionary(pa.int32(), pa.string()) if name in DICTIONARY_COLUMNS else pa.string()
+
+    return pa.schema([
+        ("date", pa.date32()),
+        ("amount", pa.float64()),
+        ("category", text("category")),
+        ("description", text("description")),
+        ("check_number", text("check_number")),
+        ("account_number", text("account_number")),
+        ("statement_date", pa.date32()),
+        ("document_id", text("document_id")),
+        ("source_filename", text("source_filename")),
+        ("conversion_date", pa.timestamp("ms", tz="UTC")),
+    ])
+
+
+def export_query(user_id: str, since: Optional[str], until: dict) -> dict:
+    """Documents with a stored result after watermark ``since`` up to and including document ``until``"""
+    bound = until["conversion_date"]
+    query = {
+        "user_id": user_id,
+        "result_file_id": {"$ne": None},
+        "$and": [{"$or": [
+            {"conversion_date": {"$lt": bound}},
+            {"conversion_date": bound, "_id": {"$lte": until["_id"]}}
+        ]}]
+    }
+    if since:
+        conversion_date, document_id = decode_cursor(since)
+        query["$and"].append({"$or": [
+            {"conversion_date": {"$gt": conversion_date}},
+            {"conversion_date": conversion_date, "_id": {"$gt": document_id}}
+        ]})
+    return query
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class _ChunkSink:
+    """Write-only file for pyarrow writers that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class HistoryExport:
+    """
+    One export run: the user's documents up to the newest one at the time of the request.
+
+    ``watermark`` identifies that newest document; passing it back as ``since``
+    exports only documents converted afterwards, so repeat pulls read new
+    results only. Documents are read in keyset order and their transactions
+    flattened into typed columns, written as one Parquet row group (or Arrow
+    record batch) per ``EXPORT_ROW_GROUP_ROWS`` rows and streamed as each is
+    finished.
+    """
+
+    def __init__(self, documents, result_store, user_id: str, format: str, since: Optional[str], newest: dict):
+        self.documents = documents
+        self.result_store = result_store
+        self.user_id = user_id
+        self.format = format
+        self.since = since
+        self.query = export_query(user_id, since, newest)
+        self.watermark = encode_cursor(newest)
+        self.documents_exported = 0
+        self.rows_exported = 0
+
+    @classmethod
+    async def prepare(cls, documents, result_store, user_id: str, format: str,
+                      since: Optional[str] = None) -> Optional["HistoryExport"]:
+        """The export run for the user, or None when there is nothing newer than ``since``"""
+        after = decode_cursor(since) if since else None
+        newest = await documents.find_one(
+            {"user_id": user_id, "result_file_id": {"$ne": None}},
+            {"conversion_date": 1}, sort=[("conversion_date", -1), ("_id", -1)]
+        )
+        if newest is None:
+            return None
+        if after and (_utc(newest["conversion_date"]), newest["_id"]) <= (_utc(after[0]), after[1]):
+            return None
+        return cls(documents, result_store, user_id, format, since, newest)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        import pyarrow as pa
+
+        schema = export_schema()
+        sink = _ChunkSink()
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = pq.ParquetWriter(sink, schema, compression="zstd", use_dictionary=DICTIONARY_COLUMNS)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+
+        columns = {name: [] for name in schema.names}
+
+        def write_batch():
+            batch = pa.RecordBatch.from_pydict(columns, schema=schema)
+            if self.format == "parquet":
+                # One row group per batch
+                writer.write_table(pa.Table.from_batches([batch]), row_group_size=len(batch))
+            else:
+                writer.write_batch(batch)
+            for values in columns.values():
+                values.clear()
+
+        def finish():
+            if columns["date"]:
+                write_batch()
+            writer.close()
+
+        cursor = self.documents.find(self.query, EXPORT_PROJECTION).sort(EXPORT_SORT)
+        async for document in cursor.batch_size(DOCUMENT_EXPORT_BATCH):
+            try:
+                data = await self.result_store.load(document)
+            except ResultNotStored:
+                continue
+            except Exception as e:
+                logger.warning(f"Skipping document {document['_id']} in history export: {e}")
+                continue
+
+            self._append(columns, document, data)
+            self.documents_exported += 1
+            if len(columns["date"]) >= EXPORT_ROW_GROUP_ROWS:
+                await asyncio.to_thread(write_batch)
+                yield sink.drain()
+
+        await asyncio.to_thread(finish)
+        yield sink.drain()
+
+    def _append(self, columns: dict, document: dict, data: dict):
+        account = data.get("accountInfo") or {}
+        statement_date = parse_statement_date(account.get("statementDate"))
+        conversion_date = _utc(document["conversion_date"])
+        for t in statement_transactions(data):
+            columns["date"].append(parse_transaction_date(t["date"], statement_date))
+            columns["amount"].append(t["amount"])
+            columns["category"].append(t["type"])
+            columns["description"].append(t["description"])
+            columns["check_number"].append(str(t["check_number"]) if t["check_number"] else None)
+            columns["account_number"].append(str(account.get("accountNumber") or "") or None)
+            columns["statement_date"].append(statement_date)
+            columns["document_id"].append(document["_id"])
+            columns["source_filename"].append(document.get("original_filename"))
+            columns["conversion_date"].append(conversion_date)
+            self.rows_exported += 1
+
+
+async def record_watermark(watermarks, user_id: str, format: str, watermark: str):
+    """Remember the last completed export, for ``since=last``"""
+    await watermarks.update_one(
+        {"_id": f"{user_id}:{format}"},
+        {"$set": {"user_id": user_id, "watermark": watermark, "exported_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def last_watermark(watermarks, user_id: str, format: str) -> Optional[str]:
+    record = await watermarks.find_one({"_id": f"{user_id}:{format}"})
+    return record["watermark"] if record else None
@@ -0,0 +1,147 @@
+"""
+Index Manager
+Declares the indexes the API's queries rely on, creates them at startup, and verifies query plans
+
+Verify that no hot query collection-scans (exits 1 if one does):
+
+    python indexes.py --mongo-url mongodb://localhost:27017 --db-name test_database --create
+"""
+import os
+import sys
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from document_history import HISTORY_SORT
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Indexes for the core collections. Services that own a collection
+# (quota, job queue, caches, ...) create theirs in their own ensure_indexes.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        # OAuth login replaces the user's session by user_id
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Expired sessions are removed by MongoDB
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "documents": [
+        # Keyset pagination of the history on (conversion_date, _id), newest first
+        IndexModel([("user_id", ASCENDING), ("conversion_date", DESCENDING), ("_id", DESCENDING)],
+                   name="user_history_keyset"),
+    ],
+    "subscriptions": [
+        IndexModel([("subscription_id", ASCENDING)], name="subscription_id"),
+        IndexModel([("user_id", ASCENDING), ("payment_provider", ASCENDING)], name="user_provider"),
+    ],
+    "anonymous_conversions": [
+        # One index per $or branch, so the fingerprint-or-IP lookup is an OR of two index scans
+        IndexModel([("browser_fingerprint", ASCENDING)], name="browser_fingerprint"),
+        IndexModel([("ip_address", ASCENDING)], name="ip_address"),
+    ],
+}
+
+# Queries on request paths: (name, collection, filter, sort). Values are placeholders;
+# only the shape matters to the planner.
+HOT_QUERIES = [
+    ("login", "users", {"email": "user@example.com"}, None),
+    ("session lookup", "user_sessions", {"session_token": "token"}, None),
+    ("session replace", "user_sessions", {"user_id": "user"}, None),
+    ("document history", "documents", {"user_id": "user"}, HISTORY_SORT),
+    ("document history page", "documents",
+     {"user_id": "user", "$or": [{"conversion_date": {"$lt": datetime(2024, 1, 1)}},
+                                 {"conversion_date": datetime(2024, 1, 1), "_id": {"$lt": "document"}}]},
+     HISTORY_SORT),
+    ("document by owner", "documents", {"_id": "document", "user_id": "user"}, None),
+    ("subscription webhook", "subscriptions", {"subscription_id": "subscription"}, None),
+    ("customer portal", "subscriptions", {"user_id": "user", "payment_provider": "dodo"}, None),
+    ("anonymous limit", "anonymous_conversions",
+     {"$or": [{"browser_fingerprint": "fingerprint"}, {"ip_address": "127.0.0.1"}]}, None),
+]
+
+
+async def ensure_indexes(db) -> List[str]:
+    """
+    Create every declared index, returning the names created or already present.
+
+    A collection whose indexes cannot be built (e.g. duplicate emails blocking
+    the unique index) is logged and skipped so the API still starts.
+    """
+    names = []
+    for collection, models in INDEXES.items():
+        try:
+            names.extend(await db[collection].create_indexes(models))
+        except OperationFailure as e:
+            logger.error(f"Could not create indexes on {collection}: {e}")
+    return names
+
+
+def plan_stages(plan) -> List[str]:
+    """Every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+async def explain_query(db, collection: str, query: dict, sort: Optional[list] = None) -> List[str]:
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    explanation = await cursor.explain()
+    return plan_stages(explanation["queryPlanner"]["winningPlan"])
+
+
+async def verify_query_plans(db) -> bool:
+    """Explain each hot query and print its winning plan; False if any of them collection-scans"""
+    ok = True
+    for name, collection, query, sort in HOT_QUERIES:
+        stages = await explain_query(db, collection, query, sort)
+        scans = "COLLSCAN" in stages
+        ok = ok and not scans
+        print(f"{'FAIL' if scans else 'ok':<6}{name:<24}{collection}.find: {' <- '.join(stages)}")
+    return ok
+
+
+async def main(args) -> int:
+    from database import MongoProvider
+
+    mongo = MongoProvider(args.mongo_url, args.db_name)
+    await mongo.connect()
+    try:
+        if args.create:
+            await ensure_indexes(mongo.database)
+        ok = await verify_query_plans(mongo.database)
+    finally:
+        mongo.close()
+    if not ok:
+        print("Some hot queries do a collection scan; run with --create or check INDEXES")
+    return 0 if ok else 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Verify that the API's hot queries use indexes")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "test_database"))
+    parser.add_argument("--create", action="store_true", help="create the declared indexes before verifying")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
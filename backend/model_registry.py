@@ -0,0 +1,189 @@
+"""
+Gemini Model Registry
+Process-wide model clients with rolling health statistics, latency-aware routing and circuit breaking
+"""
+import os
+import time
+import logging
+from collections import deque
+from typing import List, Optional
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Samples kept per model for latency percentiles and error rate
+MODEL_STATS_WINDOW = int(os.getenv("MODEL_STATS_WINDOW", "50"))
+# Consecutive failures that open a model's circuit
+MODEL_FAILURE_THRESHOLD = int(os.getenv("MODEL_FAILURE_THRESHOLD", "3"))
+# Seconds a tripped model is skipped, and the longer cooldown after quota exhaustion
+MODEL_COOLDOWN_SECONDS = float(os.getenv("MODEL_COOLDOWN_SECONDS", "30"))
+MODEL_QUOTA_COOLDOWN_SECONDS = float(os.getenv("MODEL_QUOTA_COOLDOWN_SECONDS", "300"))
+# Alternative API base URL (e.g. the local stand-in in bench/fake_gemini.py); unset for Google
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+def is_quota_error(error: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED responses from the Gemini API"""
+    try:
+        from google.api_core import exceptions as google_exceptions
+        if isinstance(error, google_exceptions.ResourceExhausted):
+            return True
+    except ImportError:
+        pass
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "resource exhausted" in message
+
+
+def is_unavailable_model_error(error: Exception) -> bool:
+    """True when the API reports the model itself does not exist for this key"""
+    try:
+        from google.api_core import exceptions as google_exceptions
+        return isinstance(error, google_exceptions.NotFound)
+    except ImportError:
+        return False
+
+
+def _percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ModelState:
+    """Client and rolling health statistics for one Gemini model"""
+
+    def __init__(self, name: str, preference: int, window: int):
+        self.name = name
+        self.preference = preference
+        self.client = None
+        self.latencies_ms = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.quota_exhausted_until = 0.0
+        self.requests = 0
+        self.last_error = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def available(self, now: float) -> bool:
+        if self.client is None:
+            return False
+        if self.circuit == CIRCUIT_OPEN and now >= self.open_until:
+            # Let a trial request through; its outcome closes or re-opens the circuit
+            self.circuit = CIRCUIT_HALF_OPEN
+        return self.circuit != CIRCUIT_OPEN
+
+    def score(self) -> Optional[float]:
+        """Lower is better: expected latency, inflated by errors and lower preference; None until measured"""
+        p95 = _percentile(list(self.latencies_ms), 0.95)
+        if p95 is None:
+            return None
+        return p95 * (1 + 4 * self.error_rate) * (1 + 0.25 * self.preference)
+
+    def rank(self) -> tuple:
+        """Sort key: measured models by score, then untried ones in preference order"""
+        score = self.score()
+        return (0, score) if score is not None else (1, self.preference)
+
+
+class ModelRegistry:
+    """
+    Builds each configured model once and routes requests to the best healthy one.
+
+    Models are ranked by rolling p95 latency and error rate, weighted towards the
+    configured preference order. Models without latency samples come after
+    every measured healthy one, in preference order, so traffic never shifts
+    to an untried fallback just because the preferred model got slower. A model that keeps failing, or reports quota
+    exhaustion, has its circuit opened and is skipped until its cooldown ends.
+    """
+
+    def __init__(self, model_names: List[str], window: int = MODEL_STATS_WINDOW):
+        self.models = [ModelState(name, index, window) for index, name in enumerate(model_names)]
+        self.initialized = False
+
+    def initialize(self, api_key: str):
+        """Configure the Gemini SDK and create the model clients (once per process)"""
+        if self.initialized:
+            return
+        import google.generativeai as genai
+
+        if GEMINI_API_ENDPOINT:
+            import google.generativeai.client as genai_client
+
+            # The File API client bootstraps from a discovery document that the
+            # SDK always fetches from Google unless redirected here
+            genai_client.GENAI_API_DISCOVERY_URL = f"{GEMINI_API_ENDPOINT.rstrip('/')}/$discovery/rest"
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+            logger.warning(f"Using Gemini API endpoint {GEMINI_API_ENDPOINT}")
+        else:
+            genai.configure(api_key=api_key)
+        for state in self.models:
+            try:
+                state.client = genai.GenerativeModel(state.name)
+            except Exception as e:
+                logger.warning(f"Model {state.name} not available: {e}")
+        self.initialized = True
+        logger.info(f"Model registry initialized with {[m.name for m in self.models if m.client]}")
+
+    def candidates(self) -> List[ModelState]:
+        """Healthy models, best first"""
+        now = time.monotonic()
+        healthy = [state for state in self.models if state.available(now)]
+        return sorted(healthy, key=lambda state: state.rank())
+
+    def record_success(self, state: ModelState, elapsed_ms: float):
+        state.requests += 1
+        state.latencies_ms.append(elapsed_ms)
+        state.outcomes.append(True)
+        state.consecutive_failures = 0
+        if state.circuit != CIRCUIT_CLOSED:
+            logger.info(f"Model {state.name} recovered, closing circuit")
+        state.circuit = CIRCUIT_CLOSED
+
+    def record_failure(self, state: ModelState, error: Exception):
+        state.requests += 1
+        state.outcomes.append(False)
+        state.consecutive_failures += 1
+        state.last_error = str(error)[:200]
+        now = time.monotonic()
+
+        if is_quota_error(error):
+            state.quota_exhausted_until = now + MODEL_QUOTA_COOLDOWN_SECONDS
+            self._open(state, MODEL_QUOTA_COOLDOWN_SECONDS, "quota exhausted")
+        elif is_unavailable_model_error(error):
+            self._open(state, MODEL_QUOTA_COOLDOWN_SECONDS, "model not found")
+        elif state.circuit == CIRCUIT_HALF_OPEN or state.consecutive_failures >= MODEL_FAILURE_THRESHOLD:
+            self._open(state, MODEL_COOLDOWN_SECONDS, f"{state.consecutive_failures} consecutive failures")
+
+    def _open(self, state: ModelState, cooldown: float, reason: str):
+        state.circuit = CIRCUIT_OPEN
+        state.open_until = time.monotonic() + cooldown
+        logger.warning(f"Model {state.name} circuit opened for {cooldown:.0f}s: {reason}")
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            state.name: {
+                "circuit": state.circuit,
+                "cooldown_remaining_s": round(max(0.0, state.open_until - now), 1),
+                "quota_exhausted": state.quota_exhausted_until > now,
+                "requests": state.requests,
+                "error_rate": round(state.error_rate, 3),
+                "p50_ms": round(_percentile(list(state.latencies_ms), 0.5) or 0.0, 1),
+                "p95_ms": round(_percentile(list(state.latencies_ms), 0.95) or 0.0, 1),
+                "last_error": state.last_error
+            }
+            for state in self.models
+        }
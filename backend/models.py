@@ -58,6 +58,21 @@ class TokenResponse(BaseModel):
     token_type: str
     user: UserResponse
 
+class DocumentSummary(BaseModel):
+    deposits_total: float
+    deposits_count: int
+    withdrawals_total: float
+    withdrawals_count: int
+    checks_total: float
+    checks_count: int
+    card_total: float
+    card_count: int
+    transaction_count: int
+    # None when the statement does not print the balance; the delta is then unknown too
+    beginning_balance: Optional[float] = None
+    ending_balance: Optional[float] = None
+    reconciliation_delta: Optional[float] = None
+
 class DocumentResponse(BaseModel):
     id: str
     original_filename: str
@@ -67,6 +82,34 @@ class DocumentResponse(BaseModel):
     conversion_date: datetime
     download_count: int
     status: str
+    summary: Optional[DocumentSummary] = None  # None for documents converted before summaries were kept
+
+class DashboardTotals(BaseModel):
+    deposits_total: float = 0.0
+    withdrawals_total: float = 0.0
+    checks_total: float = 0.0
+    card_total: float = 0.0
+    transaction_count: int = 0
+    unreconciled_documents: int = 0  # documents whose transactions do not add up to the closing balance
+
+class DashboardResponse(BaseModel):
+    documents: int
+    pages_converted: int
+    totals: DashboardTotals  # over documents that have a summary
+    recent_documents: List[DocumentResponse]
+
+class ConversionJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, processing, completed, failed
+    stage: str
+    percent: int
+    original_filename: str
+    page_count: Optional[int] = None
+    pages_used: Optional[int] = None
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
 
 class PagesCheckRequest(BaseModel):
     page_count: int
@@ -0,0 +1,164 @@
+"""
+Password Hasher
+bcrypt hashing and verification on a bounded process pool, with a separate admission limit for logins
+"""
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from auth import get_password_hash, verify_password
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Worker processes for bcrypt; kept small so a login burst cannot take every core from conversions
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Hash operations allowed to wait for a worker before new ones are rejected
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "64"))
+# Logins admitted at once (waiting or hashing); the rest are turned away before touching the pool
+PASSWORD_LOGIN_MAX_PENDING = int(os.getenv("PASSWORD_LOGIN_MAX_PENDING", "32"))
+# Seconds a single hash operation may take
+PASSWORD_TASK_TIMEOUT = float(os.getenv("PASSWORD_TASK_TIMEOUT", "10"))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class LoginThrottled(PasswordHasherBusy):
+    """Raised when too many logins are already being verified"""
+
+
+def _warm_up() -> int:
+    # Loads passlib's bcrypt backend once per worker so the first login is not slowed down
+    verify_password("warm-up", get_password_hash("warm-up"))
+    return os.getpid()
+
+
+class PasswordHasher:
+    """
+    Process pool for bcrypt.
+
+    Each hash or verification costs a few hundred milliseconds of CPU, which
+    would otherwise stall the event loop for every request in the worker. At
+    most ``max_workers`` operations run at once and at most ``max_queue`` wait
+    for a worker; anything beyond that is rejected immediately. Logins are
+    additionally capped at ``login_max_pending``, so a credential-stuffing burst
+    is turned away at the door and leaves room in the queue for signups.
+    """
+
+    def __init__(self, max_workers: int = PASSWORD_POOL_WORKERS, max_queue: int = PASSWORD_POOL_MAX_QUEUE,
+                 login_max_pending: int = PASSWORD_LOGIN_MAX_PENDING, timeout: float = PASSWORD_TASK_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.login_max_pending = login_max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._slots = asyncio.Semaphore(max_workers)
+        self._waiting = 0
+        self._running = 0
+        self._logins = 0
+        self._rejected = 0
+        self._logins_throttled = 0
+        self._restarts = 0
+        self._stats = {}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def start(self):
+        """Spawn the workers up front so the first logins do not pay for it"""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*[loop.run_in_executor(pool, _warm_up) for _ in range(self.max_workers)])
+        logger.info(f"Password hasher started with {self.max_workers} worker processes")
+
+    async def _run(self, operation: str, fn, *args):
+        if self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise PasswordHasherBusy("Authentication is busy, please retry shortly")
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        stats = self._stats.setdefault(operation, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        started = time.monotonic()
+        self._running += 1
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor(), fn, *args), self.timeout)
+        except BrokenProcessPool:
+            # A worker died; replace the pool for later calls
+            stats["errors"] += 1
+            self._pool = None
+            self._restarts += 1
+            raise
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            self._running -= 1
+            self._slots.release()
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, password, hashed_password)
+
+    async def verify_login(self, password: str, hashed_password: str) -> bool:
+        """``verify`` under the login admission limit, raising LoginThrottled when it is reached"""
+        if self._logins >= self.login_max_pending:
+            self._logins_throttled += 1
+            raise LoginThrottled("Too many login attempts in progress, please retry shortly")
+
+        self._logins += 1
+        try:
+            return await self.verify(password, hashed_password)
+        finally:
+            self._logins -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self._waiting,
+            "in_flight": self._running,
+            "rejected": self._rejected,
+            "logins_pending": self._logins,
+            "login_max_pending": self.login_max_pending,
+            "logins_throttled": self._logins_throttled,
+            "restarts": self._restarts,
+            "operations": {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else 0.0,
+                    "max_ms": round(stats["max_ms"], 1)
+                }
+                for name, stats in self._stats.items()
+            }
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,240 @@
+"""
+PDF Toolkit
+CPU-bound PDF work (page counting, splitting, text-layer extraction, metadata) on a process pool
+"""
+import os
+import re
+import mmap
+import time
+import asyncio
+import logging
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Worker processes for PDF parsing (defaults to one per core)
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", str(os.cpu_count() or 2)))
+# Seconds a single PDF operation may take before the request gives up on it
+PDF_TASK_TIMEOUT = float(os.getenv("PDF_TASK_TIMEOUT", "120"))
+
+LINEARIZED_DICT = re.compile(rb"/Linearized\b.*?>>", re.DOTALL)
+PAGES_NODE = re.compile(rb"/Type\s*/Pages\b")
+COUNT_ENTRY = re.compile(rb"/Count\s+(\d+)")
+
+
+@contextlib.contextmanager
+def mapped_pdf(pdf_path: str):
+    """Memory-map a PDF read-only; the mapping doubles as a seekable stream for PyPDF2"""
+    with open(pdf_path, "rb") as pdf_file:
+        with mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def page_ranges(page_count: int, shard_pages: int) -> List[Tuple[int, int]]:
+    """Split ``page_count`` pages into consecutive 0-based [start, end) ranges"""
+    shard_pages = max(1, shard_pages)
+    return [(start, min(start + shard_pages, page_count)) for start in range(0, page_count, shard_pages)]
+
+
+def fast_page_count(data) -> Optional[int]:
+    """
+    Read the page count from the file structure without parsing the page tree.
+
+    Uses the linearization dictionary when the file has not been modified
+    since it was linearized, otherwise the root ``/Pages`` node's ``/Count``.
+    Returns None whenever that could be wrong - incremental updates (older
+    page trees may still be in the file) or compressed object streams (the
+    page tree may not be visible as plain text) - so the caller can fall back
+    to a full parse.
+    """
+    linearized = LINEARIZED_DICT.search(data[:1024])
+    if linearized:
+        length = re.search(rb"/L\s+(\d+)", linearized.group(0))
+        pages = re.search(rb"/N\s+(\d+)", linearized.group(0))
+        if length and pages and int(length.group(1)) == len(data):
+            return int(pages.group(1))
+        return None
+
+    if data.find(b"startxref") != data.rfind(b"startxref") or data.find(b"/ObjStm") != -1:
+        return None
+
+    counts = []
+    for match in PAGES_NODE.finditer(data):
+        # Look for /Count inside the same indirect object as the /Type entry
+        start = max(data.rfind(b" obj", 0, match.start()), 0)
+        end = data.find(b"endobj", match.end())
+        count = COUNT_ENTRY.search(data[start:end if end != -1 else match.end() + 1024])
+        if count:
+            counts.append(int(count.group(1)))
+    # The root of the page tree counts every page below it
+    return max(counts) if counts else None
+
+
+def count_pages(pdf_path: str) -> int:
+    """Page count, from the trailer/xref structure when possible, else a full PyPDF2 parse"""
+    with mapped_pdf(pdf_path) as data:
+        count = fast_page_count(data)
+        if count:
+            return count
+
+        import PyPDF2
+        return len(PyPDF2.PdfReader(data).pages)
+
+
+def split_pdf(pdf_path: str, ranges: List[Tuple[int, int]], out_dir: str) -> List[str]:
+    """Write each [start, end) page range of ``pdf_path`` to its own PDF in ``out_dir``"""
+    import PyPDF2
+
+    with mapped_pdf(pdf_path) as data:
+        reader = PyPDF2.PdfReader(data)
+        paths = []
+        for start, end in ranges:
+            writer = PyPDF2.PdfWriter()
+            for page_index in range(start, end):
+                writer.add_page(reader.pages[page_index])
+
+            shard_path = os.path.join(out_dir, f"pages-{start + 1}-{end}.pdf")
+            with open(shard_path, "wb") as shard_file:
+                writer.write(shard_file)
+            paths.append(shard_path)
+    return paths
+
+
+def needs_password(pdf_path: str) -> bool:
+    """True when the PDF is encrypted with a user password, i.e. the empty password does not open it"""
+    import PyPDF2
+    from PyPDF2 import PasswordType
+
+    with mapped_pdf(pdf_path) as data:
+        reader = PyPDF2.PdfReader(data)
+        return reader.is_encrypted and reader.decrypt("") == PasswordType.NOT_DECRYPTED
+
+
+def pdf_metadata(pdf_path: str) -> dict:
+    """Version, page count, encryption, linearization and document info of a PDF"""
+    import PyPDF2
+
+    with mapped_pdf(pdf_path) as data:
+        version = re.match(rb"%PDF-(\d\.\d)", data[:16])
+        metadata = {
+            "size_bytes": len(data),
+            "pdf_version": version.group(1).decode() if version else None,
+            "linearized": bool(LINEARIZED_DICT.search(data[:1024])),
+            "incremental_updates": max(0, len(re.findall(rb"startxref", data)) - 1),
+        }
+        reader = PyPDF2.PdfReader(data)
+        metadata["encrypted"] = reader.is_encrypted
+        metadata["page_count"] = fast_page_count(data) or len(reader.pages)
+        info = {}
+        if not reader.is_encrypted and reader.metadata:
+            for key, value in reader.metadata.items():
+                info[key.lstrip("/")] = str(value)
+        metadata["info"] = info
+    return metadata
+
+
+def _warm_up() -> int:
+    import PyPDF2  # noqa: F401 - imported once per worker so the first real task is not slowed down
+    return os.getpid()
+
+
+class PdfToolkit:
+    """
+    Process pool for CPU-bound PDF work.
+
+    PyPDF2 is pure Python, so parsing holds the GIL; running it in separate
+    processes keeps the event loop responsive while large scanned PDFs are
+    parsed and lets concurrent uploads use every core. Workers are started
+    with ``spawn`` so they do not inherit the server's threads or sockets.
+    """
+
+    def __init__(self, max_workers: int = PDF_POOL_WORKERS, timeout: float = PDF_TASK_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = None
+        self._stats = {}
+        self._in_flight = 0
+        self._restarts = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def start(self):
+        """Spawn the workers up front so the first requests do not pay for it"""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*[loop.run_in_executor(pool, _warm_up) for _ in range(self.max_workers)])
+        logger.info(f"PDF toolkit started with {self.max_workers} worker processes")
+
+    async def _run(self, operation: str, fn, *args, timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        stats = self._stats.setdefault(operation, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        started = time.monotonic()
+        self._in_flight += 1
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor(), fn, *args), timeout or self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); replace the pool for later calls
+            stats["errors"] += 1
+            self._pool = None
+            self._restarts += 1
+            raise
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            elapsed_ms = (time.monotonic() - started) * 1000
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    async def page_count(self, pdf_path: str) -> int:
+        return await self._run("page_count", count_pages, pdf_path)
+
+    async def split(self, pdf_path: str, ranges: List[Tuple[int, int]], out_dir: str) -> List[str]:
+        return await self._run("split", split_pdf, pdf_path, ranges, out_dir)
+
+    async def text_layer(self, pdf_path: str, timeout: Optional[float] = None) -> dict:
+        from text_extraction import extract_from_text_layer
+
+        return await self._run("text_layer", extract_from_text_layer, pdf_path, timeout=timeout)
+
+    async def needs_password(self, pdf_path: str) -> bool:
+        return await self._run("needs_password", needs_password, pdf_path)
+
+    async def metadata(self, pdf_path: str) -> dict:
+        return await self._run("metadata", pdf_metadata, pdf_path)
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "in_flight": self._in_flight,
+            "restarts": self._restarts,
+            "operations": {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else 0.0,
+                    "max_ms": round(stats["max_ms"], 1)
+                }
+                for name, stats in self._stats.items()
+            }
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+pdf_toolkit = PdfToolkit()
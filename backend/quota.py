@@ -0,0 +1,323 @@
+"""
+Page Quota
+Page balances: daily and monthly refills, and per-conversion reservations that are committed or refunded
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from pymongo import ReturnDocument, UpdateMany
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# How long a reservation may stay open before the sweeper refunds it (covers crashed workers)
+QUOTA_RESERVATION_SECONDS = float(os.getenv("QUOTA_RESERVATION_SECONDS", "1800"))
+# Seconds between sweeps for expired reservations
+QUOTA_SWEEP_INTERVAL = float(os.getenv("QUOTA_SWEEP_INTERVAL", "300"))
+# Seconds between runs of the monthly paid-plan refill
+QUOTA_REFILL_INTERVAL = float(os.getenv("QUOTA_REFILL_INTERVAL", "3600"))
+
+# pages_remaining value of plans without a page limit
+UNLIMITED_PAGES = -1
+DAILY_FREE_TIER = "daily_free"
+DAILY_FREE_PAGES = 7
+DAILY_RESET_INTERVAL = timedelta(hours=24)
+BILLING_CYCLE = timedelta(days=30)
+
+
+def daily_reset_stage(now: datetime) -> dict:
+    """Pipeline stage that refills daily-free users whose last reset is at least 24 hours old"""
+    due = {"$and": [
+        {"$eq": ["$subscription_tier", DAILY_FREE_TIER]},
+        {"$lte": [{"$ifNull": ["$daily_reset_time", None]}, now - DAILY_RESET_INTERVAL]}
+    ]}
+    return {"$set": {
+        "pages_remaining": {"$cond": [due, DAILY_FREE_PAGES, "$pages_remaining"]},
+        "daily_reset_time": {"$cond": [due, now, "$daily_reset_time"]},
+        # Pages held by open reservations belonged to the previous day
+        "quota_reservations": {"$cond": [due, [], {"$ifNull": ["$quota_reservations", []]}]}
+    }}
+
+
+def daily_reset_due(user: dict) -> bool:
+    """Whether ``daily_reset_stage`` would reset this (e.g. cached) user document"""
+    if str(user.get("subscription_tier")) != DAILY_FREE_TIER:
+        return False
+    last_reset = user.get("daily_reset_time")
+    if last_reset is None:
+        return True
+    if last_reset.tzinfo is None:
+        last_reset = last_reset.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - last_reset >= DAILY_RESET_INTERVAL
+
+
+def _reset_at(user: dict) -> Optional[datetime]:
+    reset_at = user.get("daily_reset_time")
+    if reset_at is not None and reset_at.tzinfo is None:
+        reset_at = reset_at.replace(tzinfo=timezone.utc)
+    return reset_at
+
+
+class InsufficientPages(Exception):
+    """The user does not have enough pages left for the conversion"""
+
+    def __init__(self, needed: int, remaining: int):
+        super().__init__(f"Insufficient pages. You need {needed} pages but only have {remaining} remaining.")
+        self.needed = needed
+        self.remaining = remaining
+
+
+class UserNotFound(Exception):
+    pass
+
+
+class PageReservation:
+    """
+    Pages held against a user's balance while a conversion runs.
+
+    The pages are already deducted; ``commit`` makes that final and ``refund``
+    gives them back. Both are idempotent and only the first call has an effect.
+    """
+
+    def __init__(self, engine: "QuotaEngine", user_id: str, reservation_id: str, pages: int, charged: int):
+        self.engine = engine
+        self.user_id = user_id
+        self.reservation_id = reservation_id
+        self.pages = pages
+        self.charged = charged
+        self.settled = False
+
+    async def commit(self):
+        if not self.settled:
+            self.settled = True
+            await self.engine._commit(self.user_id, self.reservation_id)
+
+    async def refund(self):
+        if not self.settled:
+            self.settled = True
+            await self.engine._refund(self.user_id, self.reservation_id, self.charged)
+
+
+class QuotaEngine:
+    """
+    Page accounting with reservations embedded in the user document.
+
+    ``reserve`` applies any due daily reset, checks the balance and deducts the
+    pages in a single conditional ``find_one_and_update``, so concurrent
+    conversions cannot both pass the check and overdraw. The reservation is recorded in the user's
+    ``quota_reservations`` array; committing pulls it, refunding pulls it and
+    adds the pages back in the same update. Reservations left open by a
+    crashed process are refunded by the sweeper once they expire, unless the
+    document they were for was saved.
+    """
+
+    def __init__(self, users, documents, reservation_seconds: float = QUOTA_RESERVATION_SECONDS,
+                 on_user_change: Optional[Callable[[str], None]] = None):
+        self.users = users
+        self.documents = documents
+        self.reservation_seconds = reservation_seconds
+        # Told about every user this engine modifies, e.g. to drop cached copies
+        self.on_user_change = on_user_change or (lambda user_id: None)
+        self._sweeper = None
+        self._refiller = None
+        self._reserved = 0
+        self._rejected = 0
+        self._committed = 0
+        self._refunded = 0
+        self._swept = 0
+        self._refilled = 0
+
+    async def ensure_indexes(self):
+        await self.users.create_index("quota_reservations.expires_at", sparse=True)
+        await self.users.create_index([("subscription_status", 1), ("billing_cycle_start", 1)])
+
+    async def load_user(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        """
+        Fetch a user with any due daily reset applied, in one round trip.
+
+        The reset is an aggregation-pipeline update that only changes daily-free
+        users whose last reset is 24 hours old; everyone else is returned as is.
+        Cached copies are only invalidated when the reset actually happened.
+        """
+        now = datetime.now(timezone.utc)
+        # MongoDB keeps milliseconds; truncating lets the stored reset time be matched exactly
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        if projection is not None:
+            projection = {**projection, "daily_reset_time": 1}
+        user = await self.users.find_one_and_update(
+            query, [daily_reset_stage(now)],
+            projection=projection, return_document=ReturnDocument.AFTER
+        )
+        if user is not None and _reset_at(user) == now:
+            self.on_user_change(user["_id"])
+        return user
+
+    async def reserve(self, user_id: str, pages: int, document_id: Optional[str] = None) -> PageReservation:
+        """Deduct ``pages`` from the user's balance, raising InsufficientPages if it is too low"""
+        now = datetime.now(timezone.utc)
+        reservation_id = str(uuid.uuid4())
+        unlimited = {"$eq": ["$pages_remaining", UNLIMITED_PAGES]}
+        charged = {"$cond": [unlimited, 0, pages]}
+        enough = [{"pages_remaining": UNLIMITED_PAGES}, {"pages_remaining": {"$gte": pages}}]
+        if pages <= DAILY_FREE_PAGES:
+            # A due daily reset (applied by the first pipeline stage) makes room too
+            enough.append({
+                "subscription_tier": DAILY_FREE_TIER,
+                "daily_reset_time": {"$not": {"$gt": now - DAILY_RESET_INTERVAL}}
+            })
+
+        user = await self.users.find_one_and_update(
+            {"_id": user_id, "$or": enough},
+            [
+                daily_reset_stage(now),
+                {"$set": {
+                    "pages_remaining": {"$subtract": ["$pages_remaining", charged]},
+                    "quota_reservations": {"$concatArrays": [
+                        "$quota_reservations",
+                        [{
+                            "_id": reservation_id,
+                            "pages": charged,
+                            "document_id": document_id,
+                            "expires_at": now + timedelta(seconds=self.reservation_seconds)
+                        }]
+                    ]}
+                }}
+            ],
+            projection={"pages_remaining": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            user = await self.load_user({"_id": user_id}, {"pages_remaining": 1})
+            if user is None:
+                raise UserNotFound(user_id)
+            self._rejected += 1
+            raise InsufficientPages(pages, user["pages_remaining"])
+
+        self._reserved += 1
+        self.on_user_change(user_id)
+        charged_pages = 0 if user["pages_remaining"] == UNLIMITED_PAGES else pages
+        return PageReservation(self, user_id, reservation_id, pages, charged_pages)
+
+    async def _commit(self, user_id: str, reservation_id: str):
+        await self.users.update_one({"_id": user_id}, {"$pull": {"quota_reservations": {"_id": reservation_id}}})
+        self.on_user_change(user_id)
+        self._committed += 1
+
+    async def _refund(self, user_id: str, reservation_id: str, charged: int):
+        # Matching on the reservation means a reservation already swept, committed
+        # or cleared by a reset is never refunded twice
+        result = await self.users.update_one(
+            {"_id": user_id, "quota_reservations._id": reservation_id},
+            {"$inc": {"pages_remaining": charged}, "$pull": {"quota_reservations": {"_id": reservation_id}}}
+        )
+        if result.modified_count:
+            self.on_user_change(user_id)
+        self._refunded += result.modified_count
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+        self._refiller = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        tasks = [task for task in (self._sweeper, self._refiller) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sweeper = self._refiller = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(QUOTA_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Quota reservation sweep failed: {e}")
+
+    async def sweep(self):
+        """Settle reservations whose process never did: commit if the document was saved, else refund"""
+        now = datetime.now(timezone.utc)
+        cursor = self.users.find({"quota_reservations.expires_at": {"$lt": now}}, {"quota_reservations": 1})
+        async for user in cursor:
+            for reservation in user["quota_reservations"]:
+                expires_at = reservation["expires_at"]
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                if expires_at >= now:
+                    continue
+
+                document_id = reservation.get("document_id")
+                saved = document_id and await self.documents.find_one({"_id": document_id}, {"_id": 1})
+                if saved:
+                    await self._commit(user["_id"], reservation["_id"])
+                else:
+                    await self._refund(user["_id"], reservation["_id"], reservation["pages"])
+                    logger.warning(f"Refunded {reservation['pages']} pages from expired reservation {reservation['_id']}")
+                self._swept += 1
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await self.refill_monthly()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Monthly page refill failed: {e}")
+            await asyncio.sleep(QUOTA_REFILL_INTERVAL)
+
+    async def refill_monthly(self) -> int:
+        """
+        Refill active paid plans whose 30-day billing cycle has ended.
+
+        Due users are bucketed by the day their cycle started and each bucket is
+        refilled by one ``UpdateMany`` in a single unordered ``bulk_write``. The
+        update advances ``billing_cycle_start`` by whole cycles, so it stays
+        anchored to the original day and a user is refilled once per cycle no
+        matter how many processes run this.
+        """
+        now = datetime.now(timezone.utc)
+        due = {
+            "subscription_status": "active",
+            "subscription_tier": {"$ne": DAILY_FREE_TIER},
+            "pages_limit": {"$gt": 0},
+            "billing_cycle_start": {"$lte": now - BILLING_CYCLE}
+        }
+        buckets = await self.users.aggregate([
+            {"$match": due},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$billing_cycle_start"}}}}
+        ]).to_list(None)
+        if not buckets:
+            return 0
+
+        cycle_ms = BILLING_CYCLE.total_seconds() * 1000
+        elapsed_cycles = {"$floor": {"$divide": [{"$subtract": [now, "$billing_cycle_start"]}, cycle_ms]}}
+        refill = [{"$set": {
+            "pages_remaining": "$pages_limit",
+            "billing_cycle_start": {"$add": ["$billing_cycle_start", {"$multiply": [elapsed_cycles, cycle_ms]}]},
+            "quota_reservations": []
+        }}]
+        operations = []
+        for bucket in buckets:
+            day = datetime.strptime(bucket["_id"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+            bucket_filter = dict(due, billing_cycle_start={"$gte": day, "$lt": day + timedelta(days=1), "$lte": now - BILLING_CYCLE})
+            operations.append(UpdateMany(bucket_filter, refill))
+
+        result = await self.users.bulk_write(operations, ordered=False)
+        self._refilled += result.modified_count
+        logger.info(f"Refilled pages for {result.modified_count} users across {len(buckets)} billing-cycle buckets")
+        return result.modified_count
+
+    def metrics(self) -> dict:
+        return {
+            "reserved": self._reserved,
+            "rejected": self._rejected,
+            "committed": self._committed,
+            "refunded": self._refunded,
+            "swept": self._swept,
+            "refilled": self._refilled
+        }
@@ -0,0 +1,150 @@
+"""
+Result Store
+Extracted statement data kept gzip-compressed in GridFS, plus cached download artifacts rendered from it
+"""
+import os
+import gzip
+import json
+import zlib
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Iterable
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# gzip level for stored results and artifacts (1 fastest, 9 smallest)
+RESULT_COMPRESSION_LEVEL = int(os.getenv("RESULT_COMPRESSION_LEVEL", "6"))
+
+
+class ResultNotStored(Exception):
+    """The document has no stored result (e.g. converted before results were kept)"""
+
+
+def _compress(payload: bytes) -> bytes:
+    return gzip.compress(payload, compresslevel=RESULT_COMPRESSION_LEVEL)
+
+
+def _compress_chunks(chunks: Iterable[bytes]) -> bytes:
+    """gzip a rendered file as its chunks are produced, so only the compressed output is held"""
+    compressor = zlib.compressobj(RESULT_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    parts = [compressor.compress(chunk) for chunk in chunks]
+    parts.append(compressor.flush())
+    return b"".join(parts)
+
+
+class ResultStore:
+    """
+    Conversion results and their download artifacts, in the ``conversion_results`` GridFS bucket.
+
+    Each recorded document links its result through ``result_file_id``; the
+    result is the extracted JSON, gzip-compressed. Download formats are
+    rendered from it once and stored the same way under
+    ``artifacts.<format>``, so repeat downloads only stream stored chunks.
+    Blobs are served still compressed to clients that accept gzip and
+    decompressed chunk by chunk otherwise, so memory use does not grow with
+    the file.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self._bucket = None
+        self._saved = 0
+        self._artifacts_rendered = 0
+        self._artifact_hits = 0
+
+    @property
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        # Built on first use: GridFS needs the live database, which exists only once the app has started
+        if self._bucket is None:
+            self._bucket = AsyncIOMotorGridFSBucket(self.documents.database, bucket_name="conversion_results")
+        return self._bucket
+
+    async def save(self, document_id: str, data: dict):
+        """Store a conversion's extracted data; returns the GridFS file id to link from the document"""
+        payload = await asyncio.to_thread(
+            lambda: _compress(json.dumps(data, separators=(",", ":"), default=str).encode("utf-8"))
+        )
+        file_id = await self.bucket.upload_from_stream(
+            f"{document_id}.json.gz", payload,
+            metadata={"document_id": document_id, "kind": "result", "encoding": "gzip"}
+        )
+        self._saved += 1
+        return file_id
+
+    async def load(self, document: dict) -> dict:
+        """The extracted data of a recorded document"""
+        if not document.get("result_file_id"):
+            raise ResultNotStored(document["_id"])
+        grid_out = await self.bucket.open_download_stream(document["result_file_id"])
+        payload = await grid_out.read()
+        return await asyncio.to_thread(lambda: json.loads(gzip.decompress(payload)))
+
+    async def artifact(self, document: dict, format: str, render: Callable[[dict], Iterable[bytes]]):
+        """
+        GridFS file id of the document rendered as ``format``, rendering it on first request.
+
+        Concurrent first requests may both render; only one link is kept and
+        the losing copy is deleted.
+        """
+        file_id = (document.get("artifacts") or {}).get(format)
+        if file_id:
+            self._artifact_hits += 1
+            return file_id
+
+        data = await self.load(document)
+        payload = await asyncio.to_thread(lambda: _compress_chunks(render(data)))
+        file_id = await self.bucket.upload_from_stream(
+            f"{document['_id']}.{format}.gz", payload,
+            metadata={"document_id": document["_id"], "kind": format, "encoding": "gzip"}
+        )
+        linked = await self.documents.find_one_and_update(
+            {"_id": document["_id"], f"artifacts.{format}": {"$exists": False}},
+            {"$set": {f"artifacts.{format}": file_id}},
+            projection={"_id": 1}
+        )
+        if linked is None:
+            await self.bucket.delete(file_id)
+            current = await self.documents.find_one({"_id": document["_id"]}, {f"artifacts.{format}": 1})
+            file_id = ((current or {}).get("artifacts") or {}).get(format)
+            if not file_id:
+                raise ResultNotStored(document["_id"])
+        self._artifacts_rendered += 1
+        return file_id
+
+    async def stream(self, file_id, decompress: bool = False) -> AsyncIterator[bytes]:
+        """Chunks of a stored blob, gunzipped on the fly when ``decompress`` is set"""
+        grid_out = await self.bucket.open_download_stream(file_id)
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            if decoder is not None:
+                chunk = decoder.decompress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if decoder is not None:
+            tail = decoder.flush()
+            if tail:
+                yield tail
+
+    async def delete(self, document: dict):
+        """Remove a document's result and artifacts"""
+        file_ids = [document.get("result_file_id"), *(document.get("artifacts") or {}).values()]
+        for file_id in filter(None, file_ids):
+            try:
+                await self.bucket.delete(file_id)
+            except NoFile:
+                pass
+
+    def metrics(self) -> dict:
+        return {
+            "results_saved": self._saved,
+            "artifacts_rendered": self._artifacts_rendered,
+            "artifact_hits": self._artifact_hits
+        }
@@ -1,15 +1,18 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Request, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.security import HTTPAuthorizationCredentials
+from contextlib import asynccontextmanager
 from pymongo.errors import DuplicateKeyError
 import os
 from dotenv import load_dotenv
-import tempfile
 import asyncio
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 import uuid
+import hmac
+from urllib.parse import quote
 from bson import ObjectId
 import logging
 from pathlib import Path
@@ -20,15 +23,45 @@ import httpx
 # Removed Stripe integration - now using Dodo Payments
 
 # Import our modules
-from auth import get_password_hash, verify_password, create_access_token, verify_token, verify_jwt_token
+from auth import create_access_token, verify_token, security
 from models import (
     UserSignup, UserLogin, UserResponse, TokenResponse, DocumentResponse,
     PagesCheckRequest, PagesCheckResponse, SubscriptionTier, SubscriptionPlan,
     UserUpdate, PasswordReset, PasswordChange, BillingInterval, GoogleUserData, UserSession,
-    AnonymousConversionCheck, AnonymousConversionResponse, AnonymousConversionRecord,
+    AnonymousConversionCheck, AnonymousConversionResponse, AnonymousConversionRecord, ConversionJobResponse,
+    DashboardResponse, DashboardTotals,
     SubscriptionPackage, PaymentSessionRequest, PaymentSessionResponse, PaymentTransaction, WebhookEventResponse
 )
 import dodo_routes
+from extraction import (
+    extract_with_ai, stream_extraction, replay_extraction, extraction_executor, model_registry, gemini_files,
+    gemini_limiter,
+    ExtractionQueueFull, ExtractionTimeout
+)
+from conversion_jobs import ConversionJobQueue, CONVERSION_JOB_WORKERS
+from single_flight import SingleFlight
+from uploads import receive_pdf_upload, upload_limit_for_tier, PDF_UPLOAD_OPENAPI
+from text_extraction import TEXT_LAYER_MIN_CONFIDENCE, TEXT_LAYER_TIMEOUT
+from pdf_tools import pdf_toolkit
+from database import MongoProvider
+from indexes import ensure_indexes
+from result_store import ResultStore, ResultNotStored
+from exporters import EXPORT_FORMATS
+from history_export import (
+    HistoryExport, EXPORT_MEDIA_TYPES, columnar_export_available, record_watermark, last_watermark
+)
+from document_history import (
+    history_query, encode_cursor, clamp_page_size, InvalidCursor, HISTORY_PROJECTION, HISTORY_SORT,
+    DOCUMENT_EXPORT_BATCH, DASHBOARD_RECENT_DOCUMENTS, statement_summary
+)
+from quota import QuotaEngine, PageReservation, InsufficientPages, UserNotFound, UNLIMITED_PAGES, daily_reset_due
+from user_cache import UserCache
+from auth_resolver import auth_resolver
+from password_hasher import password_hasher, PasswordHasherBusy, LoginThrottled
+from extraction_cache import (
+    ExtractionCache, extraction_cache_key, EXTRACTION_CACHE_MEMORY_ENTRIES,
+    EXTRACTION_CACHE_TTL_HOURS, EXTRACTION_CACHE_MAX_BYTES
+)
 
 
 ROOT_DIR = Path(__file__).parent
@@ -38,6 +71,8 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
+# Bearer token for /api/metrics; the endpoint is disabled while unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 if not JWT_SECRET_KEY:
     raise ValueError("JWT_SECRET_KEY environment variable is required")
@@ -77,8 +112,9 @@ SUBSCRIPTION_PACKAGES = {
     }
 }
 
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# One client per process, opened in the lifespan; collection handles resolve against it on use
+mongo = MongoProvider(mongo_url, os.environ['DB_NAME'])
+db = mongo.db
 
 # Collections
 users_collection = db.users
@@ -87,9 +123,70 @@ subscriptions_collection = db.subscriptions
 user_sessions_collection = db.user_sessions
 anonymous_conversions_collection = db.anonymous_conversions
 payment_transactions_collection = db.payment_transactions
+export_watermarks_collection = db.export_watermarks
+
+# Coalesces concurrent extractions of the same PDF, across workers via leases
+extraction_flights = SingleFlight(db.extraction_leases)
+user_cache = UserCache(users_collection, user_sessions_collection)
+quota = QuotaEngine(users_collection, documents_collection, on_user_change=user_cache.forget_user)
+# Extracted data of recorded conversions, and the download files rendered from it
+result_store = ResultStore(documents_collection)
+
+# Conversions attempted / served by the local text-layer parser
+text_layer_metrics = {"attempted": 0, "accepted": 0, "failed": 0}
+
+# Cache of extraction results, keyed by PDF content hash
+extraction_cache = ExtractionCache(
+    db.extraction_cache,
+    memory_entries=EXTRACTION_CACHE_MEMORY_ENTRIES,
+    ttl_hours=EXTRACTION_CACHE_TTL_HOURS,
+    max_bytes=EXTRACTION_CACHE_MAX_BYTES
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared MongoDB client and start background services; stop them on shutdown"""
+    try:
+        await mongo.connect()
+        app.state.mongo = mongo
+        await ensure_indexes(db)
+        await extraction_cache.ensure_indexes()
+        await extraction_flights.ensure_indexes()
+        await quota.ensure_indexes()
+        quota.start()
+        user_cache.start()
+        auth_resolver.bind(user_cache, db.revoked_tokens)
+        await auth_resolver.ensure_indexes()
+        auth_resolver.start()
+        if GEMINI_API_KEY:
+            model_registry.initialize(GEMINI_API_KEY)
+        await conversion_jobs.ensure_indexes()
+        conversion_jobs.start()
+        gemini_files.bind(db.gemini_files)
+        await gemini_files.ensure_indexes()
+        # Without a key there are no uploads to clean up, and listing files would fail every sweep
+        if GEMINI_API_KEY:
+            gemini_files.start()
+        await pdf_toolkit.start()
+        await password_hasher.start()
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {e}")
+        raise
+    
+    yield
+    
+    await conversion_jobs.stop()
+    await quota.stop()
+    await user_cache.stop()
+    await auth_resolver.stop()
+    await gemini_files.stop()
+    extraction_executor.shutdown()
+    pdf_toolkit.shutdown()
+    password_hasher.shutdown()
+    mongo.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -139,7 +236,10 @@ async def signup(user_data: UserSignup):
     
     # Create new user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     
     now = datetime.now(timezone.utc)
     user_doc = {
@@ -157,7 +257,11 @@ async def signup(user_data: UserSignup):
         "updated_at": now
     }
     
-    await users_collection.insert_one(user_doc)
+    try:
+        await users_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent signup for the same email (unique index on users.email)
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create access token
     access_token = create_access_token(data={"sub": user_id, "email": user_data.email})
@@ -180,15 +284,17 @@ async def signup(user_data: UserSignup):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     """Login user"""
-    user = await users_collection.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    # Loaded with any due daily page reset applied
+    user = await quota.load_user({"email": credentials.email})
+    try:
+        verified = user is not None and await password_hasher.verify_login(credentials.password, user["password_hash"])
+    except LoginThrottled as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    # Check if daily free user needs reset
-    if user["subscription_tier"] == SubscriptionTier.DAILY_FREE:
-        await check_and_reset_daily_pages(user["_id"])
-        user = await users_collection.find_one({"_id": user["_id"]})  # Refresh user data
-    
     # Create access token
     access_token = create_access_token(data={"sub": user["_id"], "email": user["email"]})
     
@@ -207,8 +313,10 @@ async def login(credentials: UserLogin):
     return TokenResponse(access_token=access_token, token_type="bearer", user=user_response)
 
 @api_router.post("/auth/logout")
-async def logout(current_user: dict = Depends(verify_token)):
-    """Logout user (client should delete token)"""
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Logout user: the token is revoked, so it stops working even if the client keeps it"""
+    verify_token(credentials)
+    await auth_resolver.revoke(credentials.credentials)
     return {"message": "Logged out successfully"}
 
 # Google OAuth Authentication using Emergent Auth
@@ -243,6 +351,7 @@ async def get_session_data(request: Request):
                     {"_id": user_id},
                     {"$set": {"picture": oauth_data.get("picture")}}
                 )
+                user_cache.forget_user(user_id)
         else:
             # Create new user from OAuth data
             user_id = str(uuid.uuid4())
@@ -281,6 +390,8 @@ async def get_session_data(request: Request):
             session_doc,
             upsert=True
         )
+        # The previous session token for this user no longer exists
+        user_cache.forget_user_sessions(user_id)
         
         # Get updated user data
         user = await users_collection.find_one({"_id": user_id})
@@ -313,74 +424,39 @@ async def oauth_logout(request: Request, response: Response):
             session_token = auth_header.split(" ")[1]
     
     if session_token:
-        # Delete session from database
-        await user_sessions_collection.delete_one({"session_token": session_token})
+        # Delete session from database; only a token we issued is revoked
+        session = await user_sessions_collection.find_one_and_delete(
+            {"session_token": session_token}, projection={"expires_at": 1}
+        )
+        await auth_resolver.revoke(session_token, session["expires_at"] if session else None)
         
         # Clear cookie
         response.delete_cookie("session_token", path="/", secure=True, samesite="none")
     
     return {"message": "Logged out successfully"}
 
-# Helper function to get current user from session token (for OAuth users)
-async def get_current_user_from_session(session_token: str) -> Optional[dict]:
-    """Get user from session token"""
-    session = await user_sessions_collection.find_one({"session_token": session_token})
-    if not session:
-        return None
-    
-    # Handle timezone-aware comparison
-    expires_at = session["expires_at"]
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    
-    if expires_at < datetime.now(timezone.utc):
-        return None
-    
-    user = await users_collection.find_one({"_id": session["user_id"]})
-    if user:
-        return {"user_id": user["_id"], "email": user["email"]}
-    return None
+async def load_request_user(request: Request, user_id: str) -> Optional[dict]:
+    """The user's document, loaded at most once per request, with any due daily reset applied"""
+    user = await user_cache.for_request(request, user_id)
+    if user is not None and daily_reset_due(user):
+        user = await quota.load_user({"_id": user_id})
+        request.state.users[user_id] = user
+        if user is not None:
+            user_cache.remember_user(user)
+    return user
 
-# Updated auth dependency to support both JWT and OAuth session tokens
+# Auth dependency supporting both JWT and OAuth session tokens
 async def get_current_user(request: Request):
     """Get current user from JWT token or OAuth session token"""
-    # First try to get session token from cookie
-    session_token = request.cookies.get("session_token")
-    if session_token:
-        user = await get_current_user_from_session(session_token)
-        if user:
-            return user
-    
-    # Fallback to Authorization header (for both JWT and session tokens)
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.split(" ")[1]
-    
-    # Try as session token first
-    user = await get_current_user_from_session(token)
-    if user:
-        return user
-    
-    # Try as JWT token
-    try:
-        return verify_jwt_token(token)
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return await auth_resolver.resolve(request)
 
 @api_router.get("/user/profile", response_model=UserResponse)
-async def get_profile(current_user: dict = Depends(get_current_user)):
+async def get_profile(request: Request, current_user: dict = Depends(get_current_user)):
     """Get current user profile"""
-    user = await users_collection.find_one({"_id": current_user["user_id"]})
+    user = await load_request_user(request, current_user["user_id"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if daily free user needs reset
-    if user["subscription_tier"] == SubscriptionTier.DAILY_FREE:
-        await check_and_reset_daily_pages(user["_id"])
-        user = await users_collection.find_one({"_id": user["_id"]})
-    
     return UserResponse(
         id=user["_id"],
         email=user["email"],
@@ -403,8 +479,9 @@ async def update_profile(updates: UserUpdate, current_user: dict = Depends(get_c
         {"_id": current_user["user_id"]},
         {"$set": update_data}
     )
+    user_cache.forget_user(current_user["user_id"])
     
-    user = await users_collection.find_one({"_id": current_user["user_id"]})
+    user = await user_cache.get_user(current_user["user_id"])
     return UserResponse(
         id=user["_id"],
         email=user["email"],
@@ -418,9 +495,9 @@ async def update_profile(updates: UserUpdate, current_user: dict = Depends(get_c
     )
 
 @api_router.post("/user/pages/check", response_model=PagesCheckResponse)
-async def check_pages(pages_request: PagesCheckRequest, current_user: dict = Depends(get_current_user)):
+async def check_pages(request: Request, pages_request: PagesCheckRequest, current_user: dict = Depends(get_current_user)):
     """Check if user has enough pages for conversion"""
-    user = await users_collection.find_one({"_id": current_user["user_id"]})
+    user = await load_request_user(request, current_user["user_id"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -432,13 +509,8 @@ async def check_pages(pages_request: PagesCheckRequest, current_user: dict = Dep
     
     logger.info(f"check_pages: user_id={current_user['user_id']}, tier={tier}, is_daily_free={is_daily_free}, pages_remaining={user['pages_remaining']}, requested={pages_request.page_count}")
     
-    # Check if daily free user needs reset
-    if is_daily_free:
-        await check_and_reset_daily_pages(user["_id"])
-        user = await users_collection.find_one({"_id": user["_id"]})
-        logger.info(f"check_pages after reset: pages_remaining={user['pages_remaining']}")
-    
-    can_convert = user["pages_remaining"] >= pages_request.page_count
+    unlimited = user["pages_remaining"] == UNLIMITED_PAGES
+    can_convert = unlimited or user["pages_remaining"] >= pages_request.page_count
     
     if is_daily_free:
         daily_reset_time = user["daily_reset_time"]
@@ -452,6 +524,8 @@ async def check_pages(pages_request: PagesCheckRequest, current_user: dict = Dep
             billing_cycle_start = billing_cycle_start.replace(tzinfo=timezone.utc)
         next_reset = billing_cycle_start + timedelta(days=30)
         message = f"You have {user['pages_remaining']} pages remaining this month."
+        if unlimited:
+            message = "Your plan includes unlimited pages."
     
     if not can_convert:
         if is_daily_free:
@@ -471,92 +545,263 @@ async def check_pages(pages_request: PagesCheckRequest, current_user: dict = Dep
 # NOTE: Transactions listing endpoint removed per request — transaction records may still
 # be stored by webhook handlers but are no longer exposed via this API.
 
-@api_router.post("/process-pdf")
-async def process_pdf_with_ai(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+@api_router.post("/process-pdf", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def process_pdf_with_ai(request: Request, current_user: dict = Depends(get_current_user)):
     """Process PDF bank statement using AI for enhanced accuracy"""
     
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
     
+    upload = None
     try:
-        # First count pages in the PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-        
-        # Count pages (simple implementation - you can enhance this)
-        page_count = await count_pdf_pages(tmp_file_path)
-        
-        # Check if user has enough pages
-        user = await users_collection.find_one({"_id": current_user["user_id"]})
-        tier = user["subscription_tier"]
-        # Check if daily_free (handle both enum and string values)
-        tier_str = str(tier).lower() if tier else ""
-        is_daily_free = "daily_free" in tier_str
-        
-        logger.info(f"process_pdf: user_id={current_user['user_id']}, tier={tier}, is_daily_free={is_daily_free}, page_count={page_count}, pages_remaining={user['pages_remaining']}")
-        
-        # Reset daily pages if needed
-        if is_daily_free:
-            await check_and_reset_daily_pages(user["_id"])
-            user = await users_collection.find_one({"_id": user["_id"]})
-            logger.info(f"process_pdf after reset: pages_remaining={user['pages_remaining']}")
-        
-        if user["pages_remaining"] < page_count:
-            logger.error(f"Insufficient pages: need {page_count}, have {user['pages_remaining']}")
-            os.unlink(tmp_file_path)
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient pages. You need {page_count} pages but only have {user['pages_remaining']} remaining."
-            )
-        
-        # Process with AI
-        extracted_data = await extract_with_ai(tmp_file_path)
+        # Stream the upload to disk, rejecting bad files before any other work
+        upload = await receive_pdf_upload(request, await upload_limit_for_user(request, current_user["user_id"]))
         
-        # Deduct pages after successful conversion
-        await users_collection.update_one(
-            {"_id": current_user["user_id"]},
-            {"$inc": {"pages_remaining": -page_count}}
+        extracted_data, page_count, _ = await convert_for_user(
+            current_user["user_id"], upload.filename, upload.path, upload.size, upload.sha256
         )
         
-        # Save document record
-        doc_id = str(uuid.uuid4())
-        document_doc = {
-            "_id": doc_id,
-            "user_id": current_user["user_id"],
-            "original_filename": file.filename,
-            "file_size": len(content),
-            "page_count": page_count,
-            "pages_deducted": page_count,
-            "conversion_date": datetime.now(timezone.utc),
-            "download_count": 0,
-            "status": "completed"
-        }
-        await documents_collection.insert_one(document_doc)
-        
-        # Clean up temp file
-        os.unlink(tmp_file_path)
-        
         return {"success": True, "data": extracted_data, "pages_used": page_count}
         
+    except HTTPException:
+        raise
+    except ExtractionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ExtractionTimeout as e:
+        logger.error(f"PDF processing timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
         logger.error(f"PDF processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    finally:
+        # Clean up temp file
+        if upload:
+            upload.cleanup()
 
-@api_router.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(current_user: dict = Depends(get_current_user)):
-    """Get user's document history"""
-    documents = await documents_collection.find(
-        {"user_id": current_user["user_id"]}
-    ).sort("conversion_date", -1).to_list(length=100)
+async def upload_limit_for_user(request: Request, user_id: str) -> int:
+    """Largest PDF the user's plan may upload"""
+    user = await user_cache.for_request(request, user_id)
+    return upload_limit_for_tier(user.get("subscription_tier") if user else None)
+
+async def convert_for_user(user_id: str, filename: str, pdf_path: str, file_size: int, content_hash: str,
+                           doc_id: Optional[str] = None, report_progress=None):
+    """Reserve the user's pages, extract the PDF, then record the document and commit the pages.
+    
+    Returns ``(extracted_data, page_count, doc_id)``. Passing a fixed ``doc_id``
+    makes the call safe to retry: a conversion already recorded is not charged twice.
+    """
+    # Count pages (simple implementation - you can enhance this)
+    page_count = await count_pdf_pages(pdf_path)
+    doc_id = doc_id or str(uuid.uuid4())
+    
+    # Pages are held while the extraction runs and refunded if it fails
+    reservation = await reserve_pages(user_id, page_count, doc_id)
+    try:
+        if report_progress:
+            await report_progress("extracting", 10, page_count=page_count)
+        
+        # Process with AI (repeat uploads of the same file are served from cache)
+        extracted_data = await extract_statement(pdf_path, content_hash, page_count)
+        
+        if report_progress:
+            await report_progress("saving", 90)
+        
+        doc_id = await record_conversion(user_id, filename, file_size, page_count, reservation, extracted_data, doc_id)
+    except BaseException:
+        await asyncio.shield(reservation.refund())
+        raise
+    return extracted_data, page_count, doc_id
+
+async def reserve_pages(user_id: str, page_count: int, doc_id: Optional[str] = None) -> PageReservation:
+    """Deduct the conversion's pages up front, raising a 400 if the user does not have enough"""
+    try:
+        return await quota.reserve(user_id, page_count, document_id=doc_id)
+    except UserNotFound:
+        raise HTTPException(status_code=404, detail="User not found")
+    except InsufficientPages as e:
+        logger.error(f"Insufficient pages: need {e.needed}, have {e.remaining}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def record_conversion(user_id: str, filename: str, file_size: int, page_count: int,
+                            reservation: PageReservation, extracted_data: dict, doc_id: Optional[str] = None) -> str:
+    """Store the extracted data, save the document record linking it, and commit the pages reserved for it"""
+    doc_id = doc_id or str(uuid.uuid4())
+    try:
+        result_file_id = await result_store.save(doc_id, extracted_data)
+    except Exception as e:
+        # The user still gets the data in the response; only later downloads are unavailable
+        logger.error(f"Failed to store result for document {doc_id}: {e}")
+        result_file_id = None
+    
+    # Save document record
+    document_doc = {
+        "_id": doc_id,
+        "user_id": user_id,
+        "original_filename": filename,
+        "file_size": file_size,
+        "page_count": page_count,
+        "pages_deducted": reservation.charged,
+        "conversion_date": datetime.now(timezone.utc),
+        "download_count": 0,
+        "status": "completed",
+        "result_file_id": result_file_id,
+        # Totals for history and dashboard views, so they never need the stored result
+        "summary": statement_summary(extracted_data)
+    }
+    try:
+        await documents_collection.insert_one(document_doc)
+    except DuplicateKeyError:
+        logger.warning(f"Document {doc_id} already recorded, not deducting pages again")
+        await result_store.delete(document_doc)
+        await reservation.refund()
+        return doc_id
+    
+    await reservation.commit()
+    return doc_id
+
+@api_router.post("/process-pdf/stream", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def process_pdf_stream(request: Request, format: str = "ndjson",
+                             current_user: dict = Depends(get_current_user)):
+    """Process PDF and stream account info and transactions as they are extracted.
+    
+    Emits one event per line (``format=ndjson``) or Server-Sent Events (``format=sse``):
+    ``accountInfo`` first, then ``transaction`` events, then a final ``complete``
+    event with the full data, or an ``error`` event. Pages are reserved before the
+    stream starts and refunded if the extraction does not complete.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
+    
+    user_id = current_user["user_id"]
+    upload = await receive_pdf_upload(request, await upload_limit_for_user(request, user_id))
+    try:
+        page_count = await count_pdf_pages(upload.path)
+        doc_id = str(uuid.uuid4())
+        reservation = await reserve_pages(user_id, page_count, doc_id)
+    except Exception:
+        upload.cleanup()
+        raise
+    
+    cache_key = extraction_cache_key(upload.sha256)
+    
+    def encode(event: dict) -> str:
+        payload = json.dumps(event, default=str)
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+    
+    async def events():
+        try:
+            data = await extraction_cache.get(cache_key)
+            from_cache = data is not None
+            if data is None:
+                data = await try_text_layer(upload.path)
+            source = replay_extraction(data) if data is not None else stream_extraction(upload.path, page_count)
+            
+            async for kind, section, value in source:
+                if kind == "accountInfo":
+                    yield encode({"type": "accountInfo", "data": value})
+                elif kind == "transaction":
+                    yield encode({"type": "transaction", "section": section, "data": value})
+                else:
+                    if not from_cache:
+                        await extraction_cache.put(cache_key, value)
+                    await record_conversion(user_id, upload.filename, upload.size, page_count, reservation, value, doc_id)
+                    yield encode({"type": "complete", "data": value, "pages_used": page_count, "document_id": doc_id})
+        
+        except Exception as e:
+            logger.error(f"Streaming PDF processing error: {str(e)}")
+            yield encode({"type": "error", "detail": f"Failed to process PDF: {str(e)}"})
+        finally:
+            # Give the pages back unless the conversion was recorded (also on client disconnect)
+            await asyncio.shield(reservation.refund())
+            # Clean up temp file
+            upload.cleanup()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        # Stop reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Asynchronous conversion jobs - submit, then poll for status and result
+async def process_conversion_job(job: dict, pdf_path: str, report_progress):
+    """Job queue processor: run one queued conversion to completion"""
+    await report_progress("counting_pages", 5)
+    _, page_count, doc_id = await convert_for_user(
+        job["user_id"], job["filename"], pdf_path, job["file_size"], job["content_hash"],
+        doc_id=job["_id"], report_progress=report_progress
+    )
+    # The data stays in the result store; the job only points at its document
+    return {"page_count": page_count, "pages_used": page_count, "document_id": doc_id}
+
+conversion_jobs = ConversionJobQueue(db, process_conversion_job, workers=CONVERSION_JOB_WORKERS)
+
+def conversion_job_response(job: dict) -> ConversionJobResponse:
+    return ConversionJobResponse(
+        job_id=job["_id"],
+        status=job["status"],
+        stage=job.get("progress", {}).get("stage", job["status"]),
+        percent=job.get("progress", {}).get("percent", 0),
+        original_filename=job["filename"],
+        page_count=job.get("page_count"),
+        pages_used=job.get("pages_used"),
+        document_id=job.get("document_id"),
+        error=job.get("error"),
+        created_at=job["created_at"],
+        completed_at=job.get("completed_at")
+    )
+
+@api_router.post("/jobs/process-pdf", response_model=ConversionJobResponse, status_code=202,
+                 openapi_extra=PDF_UPLOAD_OPENAPI)
+async def submit_conversion_job(request: Request, current_user: dict = Depends(get_current_user)):
+    """Queue a PDF for conversion and return a job id immediately"""
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured")
     
-    return [DocumentResponse(
+    upload = await receive_pdf_upload(request, await upload_limit_for_user(request, current_user["user_id"]))
+    try:
+        job = await conversion_jobs.submit(
+            current_user["user_id"], upload.filename, upload.path, upload.size, upload.sha256
+        )
+    finally:
+        upload.cleanup()
+    return conversion_job_response(job)
+
+@api_router.get("/jobs/{job_id}", response_model=ConversionJobResponse)
+async def get_conversion_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get status and progress of a conversion job"""
+    job = await conversion_jobs.get(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return conversion_job_response(job)
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_conversion_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the extracted data of a completed conversion job"""
+    job = await conversion_jobs.get(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job.get("error") or "Conversion failed")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is still {job['status']}")
+    
+    document = await owned_document(job["document_id"], current_user["user_id"])
+    try:
+        data = await result_store.load(document)
+    except ResultNotStored:
+        raise HTTPException(status_code=404, detail="No stored result for this job")
+    
+    return {"success": True, "data": data, "pages_used": job["pages_used"], "document_id": job["document_id"]}
+
+def document_response(doc: dict) -> DocumentResponse:
+    return DocumentResponse(
         id=doc["_id"],
         original_filename=doc["original_filename"],
         file_size=doc["file_size"],
@@ -564,27 +809,87 @@ async def get_documents(current_user: dict = Depends(get_current_user)):
         pages_deducted=doc["pages_deducted"],
         conversion_date=doc["conversion_date"],
         download_count=doc.get("download_count", 0),
-        status=doc["status"]
-    ) for doc in documents]
+        status=doc["status"],
+        summary=doc.get("summary")
+    )
 
-@api_router.get("/documents/{doc_id}/download")
-async def download_document(doc_id: str, current_user: dict = Depends(get_current_user)):
-    """Download converted document (mock implementation)"""
-    document = await documents_collection.find_one({
-        "_id": doc_id,
-        "user_id": current_user["user_id"]
-    })
+@api_router.get("/documents", response_model=List[DocumentResponse])
+async def get_documents(response: Response, limit: Optional[int] = None, cursor: Optional[str] = None,
+                        format: str = "json", current_user: dict = Depends(get_current_user)):
+    """Get user's document history, newest first.
     
+    Returns one page of ``limit`` documents; when there are more, the
+    ``X-Next-Cursor`` response header holds the token to pass as ``cursor`` for
+    the next page. ``format=ndjson`` instead streams every document from
+    ``cursor`` onwards, one JSON object per line, for full-history exports.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+    try:
+        query = history_query(current_user["user_id"], cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if format == "ndjson":
+        async def lines():
+            documents = documents_collection.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT)
+            async for doc in documents.batch_size(DOCUMENT_EXPORT_BATCH):
+                yield document_response(doc).model_dump_json() + "\n"
+        
+        return StreamingResponse(lines(), media_type="application/x-ndjson",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    
+    page_size = clamp_page_size(limit)
+    # One extra document tells whether another page follows
+    documents = await documents_collection.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT).to_list(
+        length=page_size + 1
+    )
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        response.headers["X-Next-Cursor"] = encode_cursor(documents[-1])
+    
+    return [document_response(doc) for doc in documents]
+
+def content_disposition(filename: str) -> str:
+    """Attachment header for a user-supplied filename: a printable-ASCII fallback plus the RFC 6266 UTF-8 form"""
+    fallback = "".join(ch if " " <= ch <= "~" and ch not in '"\\' else "_" for ch in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def stored_blob_response(request: Request, file_id, media_type: str, filename: str) -> StreamingResponse:
+    """Stream a stored gzip blob, passing it through compressed when the client accepts gzip"""
+    passthrough = "gzip" in request.headers.get("accept-encoding", "").lower()
+    headers = {"Content-Disposition": content_disposition(filename), "Vary": "Accept-Encoding"}
+    if passthrough:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(result_store.stream(file_id, decompress=not passthrough), media_type=media_type, headers=headers)
+
+async def owned_document(doc_id: str, user_id: str) -> dict:
+    document = await documents_collection.find_one(
+        {"_id": doc_id, "user_id": user_id},
+        {"original_filename": 1, "result_file_id": 1, "artifacts": 1}
+    )
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+def export_format(format: str) -> dict:
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    return EXPORT_FORMATS[format]
+
+@api_router.get("/documents/{doc_id}/export")
+async def export_document(request: Request, doc_id: str, format: str = "csv",
+                          current_user: dict = Depends(get_current_user)):
+    """Download a past conversion as CSV, XLSX, OFX or QIF.
     
-    # In a real implementation, you'd retrieve the actual converted file
-    # For now, we'll return a sample CSV
-    sample_csv = """Account Summary,Value,
-Account Number,000009752,
-Statement Date,June 5 2003,
-Beginning Balance,$7126.11,
-Ending Balance,$10521.19,"""
+    Each format is rendered once from the stored result; later downloads stream the stored file.
+    """
+    exporter = export_format(format)
+    document = await owned_document(doc_id, current_user["user_id"])
+    try:
+        file_id = await result_store.artifact(document, format, exporter["render"])
+    except ResultNotStored:
+        raise HTTPException(status_code=404, detail="No stored result for this document")
     
     # Update download count
     await documents_collection.update_one(
@@ -592,26 +897,119 @@ Ending Balance,$10521.19,"""
         {"$inc": {"download_count": 1}}
     )
     
-    from fastapi.responses import Response
-    return Response(
-        content=sample_csv,
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={document['original_filename'].replace('.pdf', '-converted.csv')}"}
+    filename = document["original_filename"].replace(".pdf", f"-converted.{exporter['extension']}")
+    return stored_blob_response(request, file_id, exporter["media_type"], filename)
+
+@api_router.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard(current_user: dict = Depends(get_current_user)):
+    """Conversion totals and the latest documents, from the summaries stored with each document"""
+    user_id = current_user["user_id"]
+    summed = ["deposits_total", "withdrawals_total", "checks_total", "card_total", "transaction_count"]
+    group = {"_id": None, "documents": {"$sum": 1}, "pages_converted": {"$sum": "$page_count"}}
+    group.update({field: {"$sum": f"$summary.{field}"} for field in summed})
+    # Statements without both balances have no delta (null or absent) and cannot be unreconciled
+    delta = "$summary.reconciliation_delta"
+    group["unreconciled_documents"] = {
+        "$sum": {"$cond": [{"$and": [{"$ne": [{"$ifNull": [delta, None]}, None]}, {"$ne": [delta, 0]}]}, 1, 0]}
+    }
+    totals = await documents_collection.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$project": {"page_count": 1, "summary": 1}},
+        {"$group": group}
+    ]).to_list(length=1)
+    totals = totals[0] if totals else {"documents": 0, "pages_converted": 0}
+    
+    recent = await documents_collection.find(history_query(user_id), HISTORY_PROJECTION).sort(HISTORY_SORT).to_list(
+        length=DASHBOARD_RECENT_DOCUMENTS
+    )
+    
+    return DashboardResponse(
+        documents=totals["documents"],
+        pages_converted=totals["pages_converted"],
+        totals=DashboardTotals(
+            **{field: round(totals.get(field, 0), 2) for field in summed},
+            unreconciled_documents=totals.get("unreconciled_documents", 0)
+        ),
+        recent_documents=[document_response(doc) for doc in recent]
     )
 
+@api_router.get("/documents/{doc_id}/download")
+async def download_document(request: Request, doc_id: str, current_user: dict = Depends(get_current_user)):
+    """Download the converted statement as CSV"""
+    return await export_document(request, doc_id, "csv", current_user)
+
+@api_router.post("/export")
+async def export_statement(data: BankStatementData, format: str = "csv", filename: str = "statement",
+                           current_user: dict = Depends(get_current_user)):
+    """Render extracted data (e.g. a /process-pdf response) without storing it"""
+    exporter = export_format(format)
+    return StreamingResponse(
+        # A sync generator: Starlette iterates it in the thread pool, off the event loop
+        exporter["render"](data.model_dump()),
+        media_type=exporter["media_type"],
+        headers={"Content-Disposition": content_disposition(f"{filename}.{exporter['extension']}")}
+    )
+
+@api_router.get("/documents/{doc_id}/result")
+async def get_document_result(request: Request, doc_id: str, current_user: dict = Depends(get_current_user)):
+    """The extracted data of a past conversion, as returned by /process-pdf"""
+    document = await owned_document(doc_id, current_user["user_id"])
+    if not document.get("result_file_id"):
+        raise HTTPException(status_code=404, detail="No stored result for this document")
+    
+    filename = document["original_filename"].replace(".pdf", ".json")
+    return stored_blob_response(request, document["result_file_id"], "application/json", filename)
+
 @api_router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str, current_user: dict = Depends(get_current_user)):
-    """Delete a document"""
-    result = await documents_collection.delete_one({
+    """Delete a document and its stored result"""
+    document = await documents_collection.find_one_and_delete({
         "_id": doc_id,
         "user_id": current_user["user_id"]
     })
     
-    if result.deleted_count == 0:
+    if document is None:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    await result_store.delete(document)
     return {"message": "Document deleted successfully"}
 
+@api_router.get("/transactions/export")
+async def export_transactions(format: str = "parquet", since: Optional[str] = None,
+                              current_user: dict = Depends(get_current_user)):
+    """Every transaction from the user's stored conversions, as Parquet or an Arrow IPC stream.
+    
+    The ``X-Export-Watermark`` response header marks the newest document included;
+    pass it back as ``since`` (or pass ``since=last`` to continue from the previous
+    completed export) to get only transactions from documents converted afterwards.
+    Returns 204 when there is nothing new.
+    """
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_MEDIA_TYPES)}")
+    if not columnar_export_available():
+        raise HTTPException(status_code=501, detail="Columnar export is not available on this server (pyarrow is not installed)")
+    
+    user_id = current_user["user_id"]
+    if since == "last":
+        since = await last_watermark(export_watermarks_collection, user_id, format)
+    try:
+        export = await HistoryExport.prepare(documents_collection, result_store, user_id, format, since)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid since watermark")
+    if export is None:
+        return Response(status_code=204, headers={"X-Export-Watermark": since} if since else None)
+    
+    async def body():
+        async for chunk in export.chunks():
+            yield chunk
+        await record_watermark(export_watermarks_collection, user_id, format, export.watermark)
+        logger.info(f"Exported {export.rows_exported} transactions from {export.documents_exported} documents as {format}")
+    
+    return StreamingResponse(body(), media_type=EXPORT_MEDIA_TYPES[format], headers={
+        "X-Export-Watermark": export.watermark,
+        "Content-Disposition": f'attachment; filename="transactions.{format}"'
+    })
+
 # Anonymous conversion tracking endpoints
 @api_router.post("/anonymous/check", response_model=AnonymousConversionResponse)
 async def check_anonymous_conversion(request: Request, conversion_check: AnonymousConversionCheck):
@@ -647,16 +1045,14 @@ async def check_anonymous_conversion(request: Request, conversion_check: Anonymo
         logger.error(f"Anonymous conversion check error: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to check conversion limit")
 
-@api_router.post("/anonymous/convert")
-async def anonymous_convert_pdf(request: Request, file: UploadFile = File(...)):
+@api_router.post("/anonymous/convert", openapi_extra=PDF_UPLOAD_OPENAPI)
+async def anonymous_convert_pdf(request: Request):
     """Process PDF for anonymous users (1 free conversion)"""
     
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="AI processing service not available")
     
+    upload = None
     try:
         # Get client info
         ip_address = request.client.host
@@ -680,24 +1076,21 @@ async def anonymous_convert_pdf(request: Request, file: UploadFile = File(...)):
                 detail="Free conversion limit reached. Please sign up for unlimited conversions."
             )
         
-        # Process PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
+        # Stream the upload to disk, rejecting bad files before any other work
+        upload = await receive_pdf_upload(request, upload_limit_for_tier(None))
         
         # Count pages
-        page_count = await count_pdf_pages(tmp_file_path)
+        page_count = await count_pdf_pages(upload.path)
         
         # Extract data with AI
-        extracted_data = await extract_with_ai(tmp_file_path)
+        extracted_data = await extract_statement(upload.path, upload.sha256, page_count)
         
         # Record the anonymous conversion
         conversion_record = {
             "browser_fingerprint": browser_fingerprint,
             "ip_address": ip_address,
-            "filename": file.filename,
-            "file_size": len(content),
+            "filename": upload.filename,
+            "file_size": upload.size,
             "page_count": page_count,
             "conversion_date": datetime.now(timezone.utc),
             "user_agent": user_agent
@@ -705,9 +1098,6 @@ async def anonymous_convert_pdf(request: Request, file: UploadFile = File(...)):
         
         await anonymous_conversions_collection.insert_one(conversion_record)
         
-        # Clean up temp file
-        os.unlink(tmp_file_path)
-        
         return {
             "success": True, 
             "data": extracted_data, 
@@ -717,14 +1107,50 @@ async def anonymous_convert_pdf(request: Request, file: UploadFile = File(...)):
         
     except HTTPException:
         raise
+    except ExtractionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ExtractionTimeout as e:
+        logger.error(f"Anonymous PDF processing timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
         logger.error(f"Anonymous PDF processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+    finally:
+        # Clean up temp file
+        if upload:
+            upload.cleanup()
 
 # Dodo Payments - Integrated via dodo_routes.py (removed Stripe)
 
+def require_metrics_token(request: Request):
+    """Metrics expose service internals: only scrapers holding METRICS_TOKEN may read them"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth_header = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+@api_router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    """Runtime metrics for the conversion pipeline"""
+    return {
+        "mongo_pool": mongo.metrics(),
+        "extraction": extraction_executor.metrics(),
+        "model_concurrency": gemini_limiter.metrics(),
+        "models": model_registry.metrics(),
+        "gemini_files": gemini_files.metrics(),
+        "extraction_cache": extraction_cache.metrics(),
+        "extraction_flights": extraction_flights.metrics(),
+        "quota": quota.metrics(),
+        "user_cache": user_cache.metrics(),
+        "auth": auth_resolver.metrics(),
+        "password_hasher": password_hasher.metrics(),
+        "text_layer": text_layer_metrics,
+        "pdf_tools": pdf_toolkit.metrics(),
+        "conversion_jobs": conversion_jobs.metrics(),
+        "results": result_store.metrics()
+    }
+
 @api_router.get("/pricing/plans")
 async def get_pricing_plans():
     """Get available pricing plans"""
@@ -984,163 +1410,55 @@ async def blog_wp_includes(request: Request, path: str):
     return await proxy_blog_request(request, f"wp-includes/{path}")
 
 async def count_pdf_pages(pdf_path: str) -> int:
-    """Count pages in PDF file"""
+    """Count pages in PDF file; 503 if the PDF workers time out or crash, 400 if the file cannot be parsed"""
     try:
-        import PyPDF2
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            return len(reader.pages)
+        return await pdf_toolkit.page_count(pdf_path)
+    except (asyncio.TimeoutError, BrokenProcessPool) as e:
+        logger.error(f"PDF toolkit unavailable while counting pages: {e!r}")
+        raise HTTPException(status_code=503, detail="PDF processing is busy, please try again shortly")
     except Exception as e:
-        print(f"Error counting PDF pages: {e}")
-        return 1  # Default to 1 page if counting fails
+        logger.error(f"Error counting PDF pages: {e}")
+        raise HTTPException(status_code=400, detail="The uploaded PDF could not be read")
 
-async def check_and_reset_daily_pages(user_id: str):
-    """Check if daily free tier user needs page reset"""
-    user = await users_collection.find_one({"_id": user_id})
-    if not user or user["subscription_tier"] != SubscriptionTier.DAILY_FREE:
-        return
+async def extract_statement(pdf_path: str, content_hash: str, page_count: int):
+    """Extract statement data, reusing a cached result for identical uploads"""
+    cache_key = extraction_cache_key(content_hash)
+    cached = await extraction_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Extraction cache hit for {content_hash[:12]}")
+        return cached
     
-    now = datetime.now(timezone.utc)
-    last_reset = user.get("daily_reset_time", now)
-    
-    # Ensure last_reset has timezone info
-    if last_reset and last_reset.tzinfo is None:
-        last_reset = last_reset.replace(tzinfo=timezone.utc)
-    
-    # Check if 24 hours have passed
-    if (now - last_reset).total_seconds() >= 24 * 3600:  # 24 hours
-        await users_collection.update_one(
-            {"_id": user_id},
-            {
-                "$set": {
-                    "pages_remaining": 7,  # Reset to 7 pages
-                    "daily_reset_time": now
-                }
-            }
-        )
+    async def extract():
+        # Digitally generated statements can usually be parsed without the model
+        extracted_data = await try_text_layer(pdf_path)
+        if extracted_data is None:
+            extracted_data = await extract_with_ai(pdf_path, page_count)
+        await extraction_cache.put(cache_key, extracted_data)
+        return extracted_data
+    
+    # Identical uploads in flight at the same time (double clicks, client
+    # retries) share one extraction; page accounting stays with each caller
+    return await extraction_flights.do(cache_key, extract, lambda: extraction_cache.get(cache_key))
 
-async def extract_with_ai(pdf_path: str):
-    """Use Google Generative AI to extract bank statement data from PDF"""
+async def try_text_layer(pdf_path: str) -> Optional[dict]:
+    """Parse the PDF's text layer locally, returning the data only if it is confident enough.
     
+    This is only a fast path: any failure (timeout, crashed worker, unparsable PDF) means falling back to AI.
+    """
+    text_layer_metrics["attempted"] += 1
     try:
-        import google.generativeai as genai
-        
-        logger.info("Using google-generativeai for PDF extraction")
-        
-        # Configure Gemini API
-        genai.configure(api_key=GEMINI_API_KEY)
-        
-        # Upload the PDF file
-        logger.info(f"Uploading PDF file: {pdf_path}")
-        uploaded_file = genai.upload_file(pdf_path)
-        logger.info(f"File uploaded successfully: {uploaded_file.name}")
-        
-        # Create the model - try multiple models with fallback
-        model = None
-        models_to_try = [
-            'gemini-2.5-flash',           # Newest, fastest
-            'gemini-2.5-flash-latest',    # Latest 2.5
-            'gemini-1.5-flash-latest',    # Fallback to 1.5
-            'gemini-1.5-flash',           # Stable 1.5
-            'gemini-1.5-pro'              # Last resort
-        ]
-        
-        for model_name in models_to_try:
-            try:
-                model = genai.GenerativeModel(model_name)
-                logger.info(f"Successfully initialized model: {model_name}")
-                break
-            except Exception as model_error:
-                logger.warning(f"Model {model_name} not available: {model_error}")
-                continue
-        
-        if model is None:
-            raise Exception("No available Gemini models found. Please check your API key and quota.")
-        
-        # Create the prompt
-        prompt = """You are a specialized bank statement data extraction expert. 
-Your task is to extract ALL transaction data from PDF bank statements with 100% accuracy.
-
-Extract and return data in this exact JSON structure:
-{
-  "accountInfo": {
-    "accountNumber": "string",
-    "statementDate": "string", 
-    "beginningBalance": number,
-    "endingBalance": number
-  },
-  "deposits": [
-    {
-      "dateCredited": "MM-DD format",
-      "description": "full description",
-      "amount": number
-    }
-  ],
-  "atmWithdrawals": [
-    {
-      "tranDate": "MM-DD format",
-      "datePosted": "MM-DD format", 
-      "description": "full description",
-      "amount": negative_number
-    }
-  ],
-  "checksPaid": [
-    {
-      "datePaid": "MM-DD format",
-      "checkNumber": "string",
-      "amount": number,
-      "referenceNumber": "string"
-    }
-  ],
-  "visaPurchases": [
-    {
-      "tranDate": "MM-DD format",
-      "datePosted": "MM-DD format",
-      "description": "full description", 
-      "amount": negative_number
-    }
-  ]
-}
-
-CRITICAL REQUIREMENTS:
-- Extract ALL transactions with exact amounts, dates, and descriptions
-- Use exact date formats (MM-DD like "05-15")
-- Negative amounts for withdrawals/debits
-- Include complete descriptions and reference numbers
-- Return ONLY valid JSON, no additional text
-
-Extract ALL bank statement transaction data from this PDF with complete accuracy."""
-        
-        # Generate content
-        logger.info("Generating AI response...")
-        result = model.generate_content([prompt, uploaded_file])
-        response = result.text
-        logger.info(f"AI Response received (length: {len(response)} chars)")
-        
-        # Parse JSON response
-        import json
-        try:
-            # Clean response and extract JSON
-            response_text = response.strip()
-            if response_text.startswith("```json"):
-                response_text = response_text[7:-3]
-            elif response_text.startswith("```"):
-                response_text = response_text[3:-3]
-            
-            response_text = response_text.strip()
-            
-            extracted_data = json.loads(response_text)
-            logger.info("Successfully parsed JSON response")
-            return extracted_data
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error: {e}")
-            logger.error(f"Raw response (first 500 chars): {response[:500]}")
-            raise Exception("AI returned invalid JSON format")
-            
+        result = await pdf_toolkit.text_layer(pdf_path, timeout=TEXT_LAYER_TIMEOUT)
     except Exception as e:
-        logger.error(f"AI extraction error: {str(e)}")
-        raise Exception(f"AI extraction failed: {str(e)}")
+        text_layer_metrics["failed"] += 1
+        logger.warning(f"Text-layer extraction failed, using AI: {e!r}")
+        return None
+    if result["confidence"] >= TEXT_LAYER_MIN_CONFIDENCE:
+        text_layer_metrics["accepted"] += 1
+        logger.info(f"Text-layer extraction accepted (confidence {result['confidence']})")
+        return result["data"]
+    
+    logger.info(f"Text-layer confidence {result['confidence']} below threshold ({'; '.join(result['reasons'])}), using AI")
+    return None
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -1154,6 +1472,7 @@ app.add_middleware(
     allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Export-Watermark"],
 )
 
 # Configure logging
@@ -1163,18 +1482,3 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Startup and shutdown events
-@app.on_event("startup")
-async def startup_db_client():
-    global client, db
-    try:
-        client = AsyncIOMotorClient(mongo_url)
-        db = client[os.environ['DB_NAME']]
-        logger.info("Connected to MongoDB successfully")
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
-        raise
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
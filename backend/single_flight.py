@@ -0,0 +1,160 @@
+"""
+Single-Flight Coordination
+Coalesces concurrent identical work within a process and, through Mongo leases, across processes
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from pymongo.errors import DuplicateKeyError
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# How long a lease is held without renewal before other processes take over
+SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "60"))
+# Seconds between checks while another process holds the lease
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "1"))
+# Longest a caller waits on another process before doing the work itself
+SINGLE_FLIGHT_MAX_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_MAX_WAIT_SECONDS", "300"))
+
+
+class SingleFlight:
+    """
+    Run one piece of work per key at a time.
+
+    Callers in the same process share an ``asyncio.Future``. The process doing
+    the work also holds a lease document in ``collection``; callers in other
+    processes poll ``lookup`` (normally a shared cache) until the result shows
+    up there, and take over the work if the lease is released or lapses
+    without one. The lease is renewed while the work runs, so only a dead
+    process lets it lapse.
+    """
+
+    def __init__(self, collection, lease_seconds: float = SINGLE_FLIGHT_LEASE_SECONDS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._inflight = {}
+        self._leaders = 0
+        self._coalesced_local = 0
+        self._coalesced_remote = 0
+        self._takeovers = 0
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def do(self, key: str, work: Callable[[], Awaitable], lookup: Callable[[], Awaitable]):
+        """Return ``work()``'s result, sharing it with concurrent callers using the same key"""
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.shield(future)
+                self._coalesced_local += 1
+                return result
+            except asyncio.CancelledError:
+                # The leading caller was cancelled, not us: try to lead instead
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run(key, work, lookup)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark as retrieved; callers that were waiting have already seen it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run(self, key: str, work, lookup):
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + SINGLE_FLIGHT_MAX_WAIT_SECONDS
+        acquired = await self._acquire(key)
+        waited = False
+        while not acquired:
+            if loop.time() >= give_up_at:
+                logger.warning(f"Gave up waiting on another process for {key}, running it here")
+                self._leaders += 1
+                return await work()
+            waited = True
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+            result = await lookup()
+            if result is not None:
+                self._coalesced_remote += 1
+                return result
+            acquired = await self._acquire(key)
+
+        renewal = asyncio.create_task(self._renew(key))
+        try:
+            if waited:
+                # The previous holder failed or died; it may still have stored a
+                # result just before its lease went away
+                self._takeovers += 1
+                result = await lookup()
+                if result is not None:
+                    return result
+            self._leaders += 1
+            return await work()
+        finally:
+            renewal.cancel()
+            await self._release(key)
+
+    async def _acquire(self, key: str) -> bool:
+        now = datetime.now(timezone.utc)
+        lease = {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease_seconds)}
+        try:
+            await self.collection.insert_one({"_id": key, **lease})
+            return True
+        except DuplicateKeyError:
+            pass
+        except Exception as e:
+            # Coordination is an optimisation; never fail the work because of it
+            logger.warning(f"Failed to acquire lease for {key}, proceeding without it: {e}")
+            return True
+        # Take over a lease whose holder stopped renewing it
+        taken = await self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$lt": now}}, {"$set": lease}
+        )
+        return taken is not None
+
+    async def _renew(self, key: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.collection.update_one(
+                    {"_id": key, "owner": self.owner},
+                    {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                logger.warning(f"Failed to renew lease for {key}: {e}")
+
+    async def _release(self, key: str):
+        try:
+            await self.collection.delete_one({"_id": key, "owner": self.owner})
+        except Exception as e:
+            logger.warning(f"Failed to release lease for {key}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self._leaders,
+            "coalesced_local": self._coalesced_local,
+            "coalesced_remote": self._coalesced_remote,
+            "takeovers": self._takeovers
+        }
@@ -0,0 +1,101 @@
+"""
+Incremental Statement Parser
+Picks complete accountInfo and transaction objects out of a partially received model response
+"""
+import json
+import logging
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+class IncrementalStatementParser:
+    """
+    Streaming reader for the BankStatementData JSON produced by the model.
+
+    Text is fed in arbitrary chunks. Every time the ``accountInfo`` object or an
+    element of one of the transaction arrays closes, it is decoded and returned
+    as an event, so rows can be shown long before the full response arrives.
+    Anything before the opening brace (such as a markdown fence) is ignored, and
+    an element still open when the stream ends is simply never emitted.
+    """
+
+    def __init__(self, sections):
+        self.sections = set(sections)
+        self.data = {"accountInfo": {}, **{section: [] for section in sections}}
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self._key = None
+        self._last_string = None
+        self._string_chars = []
+        self._capture_depth = None
+        self._capture = []
+
+    def feed(self, text: str) -> list:
+        """Consume a chunk of model output, returning ``(kind, section, value)`` events"""
+        events = []
+        for ch in text:
+            if not self._started:
+                if ch != "{":
+                    continue
+                self._started = True
+
+            if self._capture_depth is not None:
+                self._capture.append(ch)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    self._string_chars.append(ch)
+                elif ch == "\\":
+                    self._escaped = True
+                    self._string_chars.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self._string_chars)
+                else:
+                    self._string_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif ch == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif ch in "{[":
+                self._depth += 1
+                if self._capture_depth is None and self._should_capture(ch):
+                    self._capture_depth = self._depth
+                    self._capture = [ch]
+            elif ch in "}]":
+                if self._capture_depth == self._depth:
+                    event = self._decode_capture()
+                    if event:
+                        events.append(event)
+                self._depth -= 1
+        return events
+
+    def _should_capture(self, ch: str) -> bool:
+        # accountInfo is the object directly under the root; transactions are the
+        # objects directly inside a section array
+        if ch == "{" and self._depth == 2 and self._key == "accountInfo":
+            return True
+        return ch == "{" and self._depth == 3 and self._key in self.sections
+
+    def _decode_capture(self):
+        raw = "".join(self._capture)
+        self._capture_depth = None
+        self._capture = []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping undecodable streamed element (first 100 chars): {raw[:100]}")
+            return None
+
+        if self._key == "accountInfo":
+            self.data["accountInfo"] = value
+            return ("accountInfo", None, value)
+        self.data[self._key].append(value)
+        return ("transaction", self._key, value)
@@ -0,0 +1,87 @@
+import os
+import sys
+import asyncio
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pa = pytest.importorskip("pyarrow")
+
+from history_export import DICTIONARY_COLUMNS, HistoryExport, export_schema
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, sort):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class FakeDocuments:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        return FakeCursor(self.documents)
+
+
+class FakeResultStore:
+    def __init__(self, results):
+        self.results = results
+
+    async def load(self, document):
+        return self.results[document["_id"]]
+
+
+def run_export(format: str) -> bytes:
+    document = {"_id": "doc-1", "original_filename": "march.pdf", "conversion_date": datetime(2024, 4, 1)}
+    statement = {
+        "accountInfo": {"accountNumber": "1234", "statementDate": "03/31/2024"},
+        "deposits": [{"date": "03/01", "description": "PAYROLL", "amount": 1000.0}],
+        "atmWithdrawals": [],
+        "checksPaid": [],
+        "visaPurchases": [{"date": "03/02", "description": "COFFEE", "amount": 3.5}],
+    }
+    export = HistoryExport(
+        FakeDocuments([document]), FakeResultStore({"doc-1": statement}), "user-1", format, None, document
+    )
+
+    async def collect():
+        return b"".join([chunk async for chunk in export.chunks()])
+
+    return asyncio.run(collect())
+
+
+def test_schema_dictionary_encodes_repeated_text_columns():
+    schema = export_schema()
+    for name in DICTIONARY_COLUMNS:
+        assert pa.types.is_dictionary(schema.field(name).type), name
+    assert schema.field("check_number").type == pa.string()
+
+
+def test_arrow_stream_carries_dictionary_columns():
+    reader = pa.ipc.open_stream(run_export("arrow"))
+    assert reader.schema.equals(export_schema())
+    table = reader.read_all()
+    assert table.num_rows == 2
+    assert table.column("description").to_pylist() == ["PAYROLL", "COFFEE"]
+
+
+def test_parquet_round_trips_dictionary_columns():
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(pa.BufferReader(run_export("parquet")))
+    assert pa.types.is_dictionary(table.schema.field("description").type)
+    assert table.column("source_filename").to_pylist() == ["march.pdf", "march.pdf"]
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_registry import ModelRegistry
+
+
+def registry(*names):
+    models = ModelRegistry(list(names))
+    for state in models.models:
+        state.client = object()
+    return models
+
+
+def names(states):
+    return [state.name for state in states]
+
+
+def test_untried_models_rank_by_preference():
+    models = registry("preferred", "fallback", "last-resort")
+    assert names(models.candidates()) == ["preferred", "fallback", "last-resort"]
+
+
+def test_slow_measured_model_stays_ahead_of_untried_fallbacks():
+    models = registry("preferred", "fallback", "last-resort")
+    preferred = models.models[0]
+    for _ in range(5):
+        models.record_success(preferred, 120000.0)
+    assert names(models.candidates()) == ["preferred", "fallback", "last-resort"]
+
+
+def test_measured_models_rank_by_score():
+    models = registry("preferred", "fallback", "last-resort")
+    preferred, fallback, _ = models.models
+    for _ in range(5):
+        models.record_success(preferred, 9000.0)
+        models.record_success(fallback, 1000.0)
+    assert names(models.candidates()) == ["fallback", "preferred", "last-resort"]
+
+
+def test_open_circuit_drops_model_from_candidates():
+    models = registry("preferred", "fallback")
+    preferred = models.models[0]
+    models.record_failure(preferred, Exception("429 quota exceeded"))
+    assert names(models.candidates()) == ["fallback"]
@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import merge_shard_results, statement_shards
+
+
+def shard(deposits, **info):
+    return {"accountInfo": info, "deposits": deposits}
+
+
+def row(date, description, amount, page=None):
+    tagged = {"date": date, "description": description, "amount": amount}
+    if page is not None:
+        tagged["page"] = page
+    return tagged
+
+
+def test_shards_after_the_first_overlap_the_previous_page():
+    assert statement_shards(20, 8) == [(0, 8, 0), (7, 16, 1), (15, 20, 1)]
+    assert statement_shards(5, 8) == [(0, 5, 0)]
+
+
+def test_repeated_identical_rows_within_a_shard_are_kept():
+    fee = row("01/05", "MONTHLY FEE", 5.0)
+    merged = merge_shard_results([shard([fee, dict(fee), dict(fee)])])
+    assert merged["deposits"] == [fee, fee, fee]
+
+
+def test_repeated_transaction_at_a_shard_boundary_is_kept():
+    # Two equal card purchases on the same day, one each side of the page split
+    merged = merge_shard_results([
+        shard([row("01/09", "COFFEE", 3.0, page=7), row("01/10", "CARD PURCHASE", 12.5, page=8)]),
+        shard([
+            # The overlap page (page 1 of the second shard) repeats the first shard's last page
+            row("01/10", "CARD PURCHASE", 12.5, page=1),
+            row("01/10", "CARD PURCHASE", 12.5, page=2),
+            row("01/11", "RENT", 900.0, page=2),
+        ]),
+    ], overlaps=[0, 1])
+    assert merged["deposits"] == [
+        row("01/09", "COFFEE", 3.0),
+        row("01/10", "CARD PURCHASE", 12.5),
+        row("01/10", "CARD PURCHASE", 12.5),
+        row("01/11", "RENT", 900.0),
+    ]
+
+
+def test_only_rows_starting_on_the_overlap_page_are_dropped():
+    merged = merge_shard_results([
+        shard([row("01/10", "CARD PURCHASE", 12.5, page=8)]),
+        shard([row("01/10", "CARD PURCHASE STORE 42", 12.5, page=1), row("01/12", "PAYROLL", 100.0, page=2)]),
+    ], overlaps=[0, 1])
+    assert merged["deposits"] == [row("01/10", "CARD PURCHASE", 12.5), row("01/12", "PAYROLL", 100.0)]
+
+
+def test_rows_without_a_page_are_kept():
+    fee = row("01/05", "MONTHLY FEE", 5.0)
+    merged = merge_shard_results([shard([fee]), shard([dict(fee), row("01/06", "FEE", 1.0, page="n/a")])], overlaps=[0, 1])
+    assert merged["deposits"] == [fee, fee, row("01/06", "FEE", 1.0)]
+
+
+def test_account_info_takes_first_values_and_last_ending_balance():
+    merged = merge_shard_results([
+        shard([], accountNumber="123", beginningBalance=10, endingBalance=None),
+        shard([], accountNumber=None, endingBalance=50),
+    ])
+    assert merged["accountInfo"] == {"accountNumber": "123", "beginningBalance": 10, "endingBalance": 50}
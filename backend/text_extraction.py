@@ -0,0 +1,233 @@
+"""
+Text-Layer Statement Parser
+Deterministic extraction for digitally generated PDFs, used before falling back to the AI model
+"""
+import os
+import re
+import logging
+from typing import List, Optional
+
+from pdf_tools import mapped_pdf
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Results at or above this confidence skip the AI model entirely
+TEXT_LAYER_MIN_CONFIDENCE = float(os.getenv("TEXT_LAYER_MIN_CONFIDENCE", "0.85"))
+# Pages with fewer extractable characters than this are treated as scanned images
+TEXT_LAYER_MIN_CHARS_PER_PAGE = int(os.getenv("TEXT_LAYER_MIN_CHARS_PER_PAGE", "80"))
+# Seconds the text-layer parse may take before the conversion falls back to the AI model
+TEXT_LAYER_TIMEOUT = float(os.getenv("TEXT_LAYER_TIMEOUT", "15"))
+
+DATE = r"\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?"
+AMOUNT = r"\(?-?\$?\s?\d{1,3}(?:,\d{3})*\.\d{2}\)?-?"
+
+TRANSACTION_LINE = re.compile(
+    rf"^(?P<date>{DATE})\s+(?:(?P<date2>{DATE})\s+)?(?P<description>.*?)\s+"
+    rf"(?P<amount>{AMOUNT})(?:\s+(?P<balance>{AMOUNT}))?$"
+)
+CHECK_NUMBER_FIRST = re.compile(
+    rf"(?P<check>\d{{3,}})\s*\*?\s+(?P<date>{DATE})\s+(?P<amount>{AMOUNT})(?:\s+(?P<reference>\d{{6,}}))?"
+)
+CHECK_DATE_FIRST = re.compile(
+    rf"(?P<date>{DATE})\s+(?P<check>\d{{3,}})\s*\*?\s+(?P<amount>{AMOUNT})(?:\s+(?P<reference>\d{{6,}}))?"
+)
+CANDIDATE_LINE = re.compile(rf"^{DATE}\s.*{AMOUNT}$")
+
+ACCOUNT_NUMBER = re.compile(r"account\s*(?:number|no\.?|#)\s*:?\s*([0-9Xx*\-]{4,})", re.IGNORECASE)
+STATEMENT_DATE = re.compile(
+    r"statement\s*(?:date|period|ending)\s*:?\s*([A-Za-z]+\.?\s+\d{1,2},?\s+\d{4}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
+    re.IGNORECASE
+)
+BEGINNING_BALANCE = re.compile(rf"\b(?:beginning|opening|previous)\s+balance\D*?({AMOUNT})", re.IGNORECASE)
+ENDING_BALANCE = re.compile(rf"\b(?:ending|closing|new)\s+balance\D*?({AMOUNT})", re.IGNORECASE)
+
+# Section headings, checked in order - the first match wins
+SECTION_HEADINGS = [
+    ("checksPaid", re.compile(r"\bchecks?\b(?:\s+paid)?", re.IGNORECASE)),
+    ("visaPurchases", re.compile(r"\b(?:visa|card\s+purchases?|debit\s+card|pos\s+purchases?)\b", re.IGNORECASE)),
+    ("atmWithdrawals", re.compile(r"\b(?:atm|withdrawals?|debits?)\b", re.IGNORECASE)),
+    ("deposits", re.compile(r"\b(?:deposits?|credits?|additions)\b", re.IGNORECASE)),
+]
+
+
+def parse_amount(text: str) -> float:
+    """Parse '$1,234.56', '(12.00)' or '12.00-' into a float"""
+    cleaned = text.strip()
+    negative = cleaned.startswith("(") or cleaned.endswith("-") or cleaned.startswith("-")
+    value = float(re.sub(r"[^\d.]", "", cleaned))
+    return -value if negative else value
+
+
+def normalize_date(text: str) -> str:
+    """'5/3' or '05/03/2024' -> '05-03'"""
+    month, day = re.split(r"[/-]", text)[:2]
+    return f"{int(month):02d}-{int(day):02d}"
+
+
+def extract_text_lines(pdf_path: str) -> List[List[str]]:
+    """
+    Read the text layer page by page and rebuild visual lines.
+
+    Text fragments are grouped by their baseline position and ordered left to
+    right, so column layouts come out as one line per table row.
+    """
+    import PyPDF2
+
+    pages = []
+    with mapped_pdf(pdf_path) as data:
+        reader = PyPDF2.PdfReader(data)
+        for page in reader.pages:
+            fragments = []
+
+            def visit(text, cm, tm, font_dict, font_size):
+                if not text or not text.strip():
+                    return
+                # Text-space origin mapped through the current transformation matrix
+                x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+                y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+                for offset, part in enumerate(text.split("\n")):
+                    if part.strip():
+                        fragments.append((round(y) - offset, x, part.strip()))
+
+            plain_text = page.extract_text(visitor_text=visit) or ""
+            if fragments:
+                rows = {}
+                for y, x, text in fragments:
+                    # Fragments within a couple of points share a baseline
+                    key = next((existing for existing in rows if abs(existing - y) <= 2), y)
+                    rows.setdefault(key, []).append((x, text))
+                lines = [
+                    " ".join(text for _, text in sorted(parts))
+                    for _, parts in sorted(rows.items(), key=lambda item: -item[0])
+                ]
+            else:
+                lines = [line.strip() for line in plain_text.splitlines() if line.strip()]
+            pages.append(lines)
+    return pages
+
+
+def _heading_section(line: str) -> Optional[str]:
+    if re.search(AMOUNT, line) or len(line) > 60 or line.lower().startswith("total"):
+        return None
+    for section, pattern in SECTION_HEADINGS:
+        if pattern.search(line):
+            return section
+    return None
+
+
+def parse_statement_lines(pages: List[List[str]]) -> dict:
+    """
+    Parse text-layer lines into the BankStatementData schema.
+
+    Returns ``{"data": ..., "confidence": 0..1, "reasons": [...]}``. Confidence
+    is dominated by whether the parsed transactions reconcile the beginning
+    balance to the ending balance, which is what makes a local parse safe to
+    serve without the model.
+    """
+    data = {
+        "accountInfo": {"accountNumber": None, "statementDate": None, "beginningBalance": None, "endingBalance": None},
+        "deposits": [],
+        "atmWithdrawals": [],
+        "checksPaid": [],
+        "visaPurchases": []
+    }
+    info = data["accountInfo"]
+    reasons = []
+
+    page_count = max(1, len(pages))
+    char_count = sum(len(line) for lines in pages for line in lines)
+    if char_count < TEXT_LAYER_MIN_CHARS_PER_PAGE * page_count:
+        return {"data": data, "confidence": 0.0, "reasons": ["no usable text layer"]}
+
+    section = None
+    candidates = 0
+    parsed = 0
+    for lines in pages:
+        for line in lines:
+            if info["accountNumber"] is None and (match := ACCOUNT_NUMBER.search(line)):
+                info["accountNumber"] = match.group(1)
+            if info["statementDate"] is None and (match := STATEMENT_DATE.search(line)):
+                info["statementDate"] = match.group(1)
+            if info["beginningBalance"] is None and (match := BEGINNING_BALANCE.search(line)):
+                info["beginningBalance"] = parse_amount(match.group(1))
+            if (match := ENDING_BALANCE.search(line)):
+                info["endingBalance"] = parse_amount(match.group(1))
+
+            heading = _heading_section(line)
+            if heading:
+                section = heading
+                continue
+
+            is_candidate = bool(CANDIDATE_LINE.match(line))
+            candidates += is_candidate
+
+            if section == "checksPaid":
+                checks = list(CHECK_NUMBER_FIRST.finditer(line)) or list(CHECK_DATE_FIRST.finditer(line))
+                for match in checks:
+                    data["checksPaid"].append({
+                        "datePaid": normalize_date(match.group("date")),
+                        "checkNumber": match.group("check"),
+                        "amount": abs(parse_amount(match.group("amount"))),
+                        "referenceNumber": match.group("reference") or ""
+                    })
+                parsed += is_candidate and bool(checks)
+                continue
+
+            match = TRANSACTION_LINE.match(line)
+            if not match or section is None:
+                continue
+
+            amount = abs(parse_amount(match.group("amount")))
+            tran_date = normalize_date(match.group("date"))
+            posted_date = normalize_date(match.group("date2")) if match.group("date2") else tran_date
+            description = match.group("description").strip()
+            if section == "deposits":
+                data["deposits"].append({"dateCredited": tran_date, "description": description, "amount": amount})
+            else:
+                data[section].append({
+                    "tranDate": tran_date,
+                    "datePosted": posted_date,
+                    "description": description,
+                    "amount": -amount
+                })
+            parsed += is_candidate
+
+    transaction_count = sum(len(data[key]) for key in ("deposits", "atmWithdrawals", "checksPaid", "visaPurchases"))
+    found_fields = sum(value is not None for value in info.values())
+
+    confidence = 0.2 * found_fields / 4
+    if transaction_count:
+        confidence += 0.2
+    else:
+        reasons.append("no transactions found")
+    coverage = parsed / candidates if candidates else 0.0
+    confidence += 0.2 * coverage
+    if coverage < 1.0:
+        reasons.append(f"parsed {parsed} of {candidates} transaction-like lines")
+
+    if info["beginningBalance"] is not None and info["endingBalance"] is not None and transaction_count:
+        net = (
+            sum(row["amount"] for row in data["deposits"])
+            + sum(row["amount"] for row in data["atmWithdrawals"])
+            + sum(row["amount"] for row in data["visaPurchases"])
+            - sum(row["amount"] for row in data["checksPaid"])
+        )
+        delta = round(info["beginningBalance"] + net - info["endingBalance"], 2)
+        if abs(delta) < 0.01:
+            confidence += 0.4
+        else:
+            reasons.append(f"balances do not reconcile (off by {delta:.2f})")
+    else:
+        reasons.append("missing balances for reconciliation")
+
+    return {"data": data, "confidence": round(confidence, 3), "reasons": reasons}
+
+
+def extract_from_text_layer(pdf_path: str) -> dict:
+    """Parse a PDF's text layer; never raises, low confidence signals 'use the model'"""
+    try:
+        return parse_statement_lines(extract_text_lines(pdf_path))
+    except Exception as e:
+        logger.warning(f"Text-layer extraction failed: {e}")
+        return {"data": None, "confidence": 0.0, "reasons": [f"text layer unreadable: {e}"]}
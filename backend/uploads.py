@@ -0,0 +1,247 @@
+"""
+Streaming PDF Uploads
+Writes multipart uploads straight to disk in chunks, validating the PDF and enforcing size caps as bytes arrive
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from pdf_tools import pdf_toolkit
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Largest accepted PDF per kind of uploader
+UPLOAD_MAX_BYTES_ANONYMOUS = int(os.getenv("UPLOAD_MAX_BYTES_ANONYMOUS", str(10 * MB)))
+UPLOAD_MAX_BYTES_FREE = int(os.getenv("UPLOAD_MAX_BYTES_FREE", str(10 * MB)))
+UPLOAD_MAX_BYTES_PAID = int(os.getenv("UPLOAD_MAX_BYTES_PAID", str(50 * MB)))
+UPLOAD_MAX_BYTES_ENTERPRISE = int(os.getenv("UPLOAD_MAX_BYTES_ENTERPRISE", str(200 * MB)))
+
+# Multipart framing and small form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# The PDF header may be preceded by up to 1 KB of junk; the trailer sits in the last few KB
+PDF_HEADER_WINDOW = 1024
+PDF_TRAILER_WINDOW = 4096
+
+# Documents the hand-parsed request body for endpoints that use receive_pdf_upload
+PDF_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"]
+        }}}
+    }
+}
+
+
+def upload_limit_for_tier(tier: Optional[str]) -> int:
+    """Maximum upload size for a subscription tier (None for anonymous users)"""
+    if tier is None:
+        return UPLOAD_MAX_BYTES_ANONYMOUS
+    tier = str(getattr(tier, "value", tier)).lower()
+    if tier == "daily_free":
+        return UPLOAD_MAX_BYTES_FREE
+    if tier == "enterprise":
+        return UPLOAD_MAX_BYTES_ENTERPRISE
+    return UPLOAD_MAX_BYTES_PAID
+
+
+class PdfStreamValidator:
+    """
+    Cheap structural checks on a PDF fed in arbitrary chunks.
+
+    The header is checked as soon as the first kilobyte arrives, so a bad
+    upload is rejected without waiting for the rest of it. The trailer can only
+    be checked at the end. ``encrypted`` notes an encryption dictionary; many
+    such PDFs carry only an owner password and open normally, so whether one
+    is actually locked is decided once the whole file is on disk.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._head = b""
+        self._header_checked = False
+        self._tail = b""
+        self.encrypted = False
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. The maximum size for your plan is {self.max_bytes // MB} MB."
+            )
+
+        if not self._header_checked:
+            self._head += chunk[:PDF_HEADER_WINDOW]
+            if len(self._head) >= PDF_HEADER_WINDOW:
+                self._check_header()
+
+        # Keep enough of the previous chunk that a marker split across chunks is still seen
+        if not self.encrypted and b"/Encrypt" in self._tail[-16:] + chunk:
+            self.encrypted = True
+        self._tail = (self._tail + chunk)[-PDF_TRAILER_WINDOW:]
+
+    def _check_header(self):
+        self._header_checked = True
+        if b"%PDF-" not in self._head[:PDF_HEADER_WINDOW]:
+            raise HTTPException(status_code=400, detail="The uploaded file is not a valid PDF")
+
+    def finish(self):
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="The uploaded file is empty")
+        if not self._header_checked:
+            self._check_header()
+        if b"%%EOF" not in self._tail or b"startxref" not in self._tail:
+            raise HTTPException(status_code=400, detail="The uploaded PDF is incomplete or corrupted")
+
+
+async def reject_locked_pdf(pdf_path: str):
+    """400 when the PDF cannot be opened without a password"""
+    try:
+        locked = await pdf_toolkit.needs_password(pdf_path)
+    except (asyncio.TimeoutError, BrokenProcessPool) as e:
+        logger.error(f"Could not check PDF encryption: {e!r}")
+        raise HTTPException(status_code=503, detail="PDF processing is busy, please try again shortly")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="The uploaded PDF is incomplete or corrupted") from e
+    if locked:
+        raise HTTPException(
+            status_code=400,
+            detail="This PDF is password protected. Please remove the password and upload it again."
+        )
+
+
+class ReceivedUpload:
+    """A PDF written to a temporary file; the caller owns ``path`` and must delete it"""
+
+    def __init__(self, filename: str, path: str, size: int, sha256: str):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+async def receive_pdf_upload(request: Request, max_bytes: int, field_name: str = "file") -> ReceivedUpload:
+    """
+    Stream the ``field_name`` part of a multipart request body to a temporary file.
+
+    The body is consumed chunk by chunk as it arrives, so memory use does not
+    depend on the file size. The SHA-256 is computed on the way through, and
+    oversized, non-PDF or truncated uploads are rejected with a 4xx as soon as
+    that is detectable. PDFs with an encryption dictionary are rejected only if
+    the empty password does not open them.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"File too large. The maximum size for your plan is {max_bytes // MB} MB."
+        )
+
+    state = {"headers": {}, "field": None, "value": b"", "filename": None, "file": None, "found": False}
+    validator = PdfStreamValidator(max_bytes)
+    digest = hashlib.sha256()
+    other_field_bytes = 0
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] = (state["field"] or b"") + data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = None, b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode("utf-8", "replace") != field_name or state["found"]:
+            return
+        filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+        if not filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are supported")
+        state["found"] = True
+        state["filename"] = filename
+        state["file"] = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+
+    def on_part_data(data, start, end):
+        nonlocal other_field_bytes
+        chunk = data[start:end]
+        if state["file"] is None:
+            other_field_bytes += len(chunk)
+            if other_field_bytes > MULTIPART_OVERHEAD_BYTES:
+                raise HTTPException(status_code=400, detail="Unexpected form data in upload")
+            return
+        validator.feed(chunk)
+        digest.update(chunk)
+        state["file"].write(chunk)
+
+    def on_part_end():
+        if state["file"] is not None:
+            state["file"].close()
+            state["path"] = state["file"].name
+            state["file"] = None
+
+    parser = MultipartParser(options[b"boundary"], callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end
+    })
+
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail="Malformed upload") from e
+
+        if not state.get("path"):
+            raise HTTPException(status_code=400, detail="No PDF file was uploaded")
+        validator.finish()
+        if validator.encrypted:
+            await reject_locked_pdf(state["path"])
+    except BaseException as e:
+        if state["file"] is not None:
+            state["file"].close()
+            state["path"] = state["file"].name
+        if state.get("path") and os.path.exists(state["path"]):
+            os.unlink(state["path"])
+        if isinstance(e, HTTPException):
+            logger.info(f"Rejected upload: {e.detail}")
+        raise
+
+    return ReceivedUpload(state["filename"], state["path"], validator.size, digest.hexdigest())
@@ -0,0 +1,195 @@
+"""
+User and Session Cache
+In-process TTL/LRU cache of user documents and validated sessions, invalidated through Mongo change streams
+"""
+import os
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request
+from pymongo.errors import OperationFailure
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Entries kept per kind (users, sessions) in each worker
+USER_CACHE_ENTRIES = int(os.getenv("USER_CACHE_ENTRIES", "10000"))
+# Upper bound on staleness when change streams are unavailable (standalone MongoDB)
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class UserCache:
+    """
+    Two caches in front of ``users`` and ``user_sessions``.
+
+    Entries expire after a short TTL and are dropped as soon as this process
+    writes the document, or when a change stream on the two collections
+    reports that another process did. A lost change stream clears everything,
+    since events may have been missed while it was down. Session lookups that
+    find nothing are not cached, so a new login is visible immediately.
+    """
+
+    def __init__(self, users, sessions, entries: int = USER_CACHE_ENTRIES,
+                 user_ttl: float = USER_CACHE_TTL_SECONDS, session_ttl: float = SESSION_CACHE_TTL_SECONDS):
+        self.users = users
+        self.sessions = sessions
+        self.entries = entries
+        self.user_ttl = user_ttl
+        self.session_ttl = session_ttl
+        self._users = OrderedDict()
+        self._sessions = OrderedDict()
+        # Reverse maps so session deletes (which only carry _id) and per-user logouts find their tokens
+        self._session_tokens = {}
+        self._user_tokens = {}
+        self._watcher = None
+        self._watching = False
+        self._hits = {"user": 0, "session": 0}
+        self._misses = {"user": 0, "session": 0}
+        self._invalidations = 0
+
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        entry = self._users.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._users.move_to_end(user_id)
+            self._hits["user"] += 1
+            return copy.deepcopy(entry[1])
+
+        self._misses["user"] += 1
+        user = await self.users.find_one({"_id": user_id})
+        if user is not None:
+            self.remember_user(user)
+        return user
+
+    def remember_user(self, user: dict):
+        self._users[user["_id"]] = (time.monotonic() + self.user_ttl, copy.deepcopy(user))
+        self._users.move_to_end(user["_id"])
+        while len(self._users) > self.entries:
+            self._users.popitem(last=False)
+
+    def forget_user(self, user_id: str):
+        if self._users.pop(user_id, None) is not None:
+            self._invalidations += 1
+
+    async def get_session(self, token: str) -> Optional[dict]:
+        entry = self._sessions.get(token)
+        if entry is not None and entry[0] > time.monotonic():
+            self._sessions.move_to_end(token)
+            self._hits["session"] += 1
+            return entry[1]
+
+        self._misses["session"] += 1
+        session = await self.sessions.find_one(
+            {"session_token": token}, {"user_id": 1, "expires_at": 1}
+        )
+        if session is not None:
+            self._remember_session(token, session)
+        return session
+
+    def _remember_session(self, token: str, session: dict):
+        self._sessions[token] = (time.monotonic() + self.session_ttl, session)
+        self._sessions.move_to_end(token)
+        self._session_tokens[session["_id"]] = token
+        self._user_tokens.setdefault(session["user_id"], set()).add(token)
+        while len(self._sessions) > self.entries:
+            _, (_, evicted) = self._sessions.popitem(last=False)
+            self._unlink_session(evicted)
+
+    def _unlink_session(self, session: dict):
+        token = self._session_tokens.pop(session["_id"], None)
+        tokens = self._user_tokens.get(session["user_id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[session["user_id"]]
+
+    def forget_session(self, token: str):
+        entry = self._sessions.pop(token, None)
+        if entry is not None:
+            self._unlink_session(entry[1])
+            self._invalidations += 1
+
+    def forget_user_sessions(self, user_id: str):
+        for token in list(self._user_tokens.get(user_id, ())):
+            self.forget_session(token)
+
+    def clear(self):
+        self._users.clear()
+        self._sessions.clear()
+        self._session_tokens.clear()
+        self._user_tokens.clear()
+
+    async def for_request(self, request: Request, user_id: str) -> Optional[dict]:
+        """
+        Load a user at most once per request.
+
+        The first call caches the document on ``request.state``; later calls in
+        the same request (auth dependency, handler, helpers) get the same dict.
+        """
+        loaded = getattr(request.state, "users", None)
+        if loaded is None:
+            loaded = request.state.users = {}
+        if user_id not in loaded:
+            loaded[user_id] = await self.get_user(user_id)
+        return loaded[user_id]
+
+    def start(self):
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": [self.users.name, self.sessions.name]}}}]
+        while True:
+            try:
+                async with self.users.database.watch(pipeline) as stream:
+                    # Anything cached before the stream opened may have changed unseen
+                    self.clear()
+                    self._watching = True
+                    async for change in stream:
+                        self._apply(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Change streams unavailable; user cache entries expire by TTL only")
+                    return
+                logger.warning(f"User cache change stream failed: {e}")
+            except Exception as e:
+                logger.warning(f"User cache change stream failed: {e}")
+            finally:
+                self._watching = False
+            self.clear()
+            await asyncio.sleep(5)
+
+    def _apply(self, change: dict):
+        key = change.get("documentKey", {}).get("_id")
+        collection = change.get("ns", {}).get("coll")
+        if key is None:
+            # drop, rename, invalidate, ...
+            self.clear()
+        elif collection == self.users.name:
+            self.forget_user(key)
+        elif key in self._session_tokens:
+            self.forget_session(self._session_tokens[key])
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self._users),
+            "sessions": len(self._sessions),
+            "hits": dict(self._hits),
+            "misses": dict(self._misses),
+            "invalidations": self._invalidations,
+            "change_stream": self._watching
+        }
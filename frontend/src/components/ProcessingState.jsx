@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 
-const ProcessingState = ({ filename }) => {
+const ProcessingState = ({ filename, accountInfo, transactionCount = 0 }) => {
   const [progress, setProgress] = useState(0);
   const [currentStep, setCurrentStep] = useState('Reading PDF');
   
@@ -79,6 +79,20 @@ const ProcessingState = ({ filename }) => {
         </p>
       </div>
 
+      {/* Live extraction results */}
+      {(accountInfo || transactionCount > 0) && (
+        <div className="max-w-md mx-auto mb-6 bg-green-50 border border-green-200 rounded-lg p-4 text-left" data-testid="live-results">
+          {accountInfo?.accountNumber && (
+            <p className="text-sm text-gray-700" data-testid="live-account-number">
+              Account: <span className="font-medium">{accountInfo.accountNumber}</span>
+            </p>
+          )}
+          <p className="text-sm text-gray-700" data-testid="live-transaction-count">
+            <span className="font-medium">{transactionCount}</span> transactions extracted so far
+          </p>
+        </div>
+      )}
+
       {/* Current Step */}
       <div className="space-y-4" data-testid="current-step-container">
         <div className="flex items-center justify-center space-x-2">
@@ -20,6 +20,8 @@ const Converter = () => {
   const [isAnonymous, setIsAnonymous] = useState(false);
   const [anonymousData, setAnonymousData] = useState(null);
   const [browserFingerprint, setBrowserFingerprint] = useState(null);
+  const [liveAccountInfo, setLiveAccountInfo] = useState(null);
+  const [liveTransactionCount, setLiveTransactionCount] = useState(0);
   const paymentHandledRef = useRef(false); // Track if payment success was already handled
 
   const { user, token, refreshUser, checkPages, isAuthenticated } = useAuth();
@@ -301,7 +303,8 @@ const Converter = () => {
 
       const backendUrl = process.env.REACT_APP_BACKEND_URL || import.meta.env.REACT_APP_BACKEND_URL;
 
-      let endpoint = '/api/process-pdf';
+      // Authenticated conversions stream rows as they are extracted
+      let endpoint = '/api/process-pdf/stream';
       let headers = {};
 
       if (isAnonymous) {
@@ -322,7 +325,7 @@ const Converter = () => {
         throw new Error(errorData.detail || 'Failed to process PDF');
       }
 
-      const result = await response.json();
+      const result = isAnonymous ? await response.json() : await readConversionStream(response);
       console.log('AI Extraction Result:', result);
 
       if (!result.success || !result.data) {
@@ -359,6 +362,50 @@ const Converter = () => {
     }
   };
 
+  // Read the NDJSON event stream from /api/process-pdf/stream, showing rows as
+  // they arrive, and resolve with the same shape as /api/process-pdf
+  const readConversionStream = async (response) => {
+    setLiveAccountInfo(null);
+    setLiveTransactionCount(0);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    const handleLine = (line) => {
+      if (!line.trim()) return null;
+      const event = JSON.parse(line);
+      if (event.type === 'accountInfo') {
+        setLiveAccountInfo(event.data);
+      } else if (event.type === 'transaction') {
+        setLiveTransactionCount(prev => prev + 1);
+      } else if (event.type === 'error') {
+        throw new Error(event.detail || 'Failed to process PDF');
+      } else if (event.type === 'complete') {
+        return { success: true, data: event.data, pages_used: event.pages_used };
+      }
+      return null;
+    };
+
+    while (true) {
+      const { done, value } = await reader.read();
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        const result = handleLine(line);
+        if (result) return result;
+      }
+
+      if (done) {
+        const result = handleLine(buffer);
+        if (result) return result;
+        throw new Error('Conversion stream ended unexpectedly');
+      }
+    }
+  };
+
   const generateComprehensiveCSV = (data) => {
     let csvLines = [];
 
@@ -442,7 +489,13 @@ const Converter = () => {
       case 'upload':
         return <FileUpload onFileUpload={handleFileUpload} />;
       case 'processing':
-        return <ProcessingState filename={uploadedFile?.name} />;
+        return (
+          <ProcessingState
+            filename={uploadedFile?.name}
+            accountInfo={liveAccountInfo}
+            transactionCount={liveTransactionCount}
+          />
+        );
       case 'results':
         return (
           <Results